@@ -3,6 +3,10 @@ ASGI config for api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Only the async task views are served, Django runs sync views of an ASGI
+deployment one at a time on a single thread per process, they are
+served by the WSGI deployment, see gunicorn.conf.py.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
@@ -13,4 +17,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+ASYNC_PATH_PREFIX = '/api/task/async/'
+
+
+async def application(scope, receive, send):
+    """Pass requests for the async task views to Django, answer 404 to the rest."""
+    if scope['type'] == 'http' and not scope['path'].startswith(ASYNC_PATH_PREFIX):
+        await send({
+            'type': 'http.response.start',
+            'status': 404,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': b'{"detail":"Not found."}'})
+        return
+    await django_application(scope, receive, send)
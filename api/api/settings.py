@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
+from urllib.parse import urlsplit
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,8 +46,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
-    'rest_framework.authtoken',
     'drf_spectacular',
 
     'core',
@@ -53,7 +55,17 @@ INSTALLED_APPS = [
     'task',
 ]
 
+# The benchmark harness, `manage.py bench`, seeds and deletes users in
+# the configured database. Installed with DEBUG unless BENCH_ENABLED
+# says otherwise.
+BENCH_ENABLED = bool(int(os.environ.get('BENCH_ENABLED', int(DEBUG))))
+if BENCH_ENABLED:
+    INSTALLED_APPS.append('bench')
+
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.PasswordHashingUnavailableMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,17 +99,150 @@ WSGI_APPLICATION = 'api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# The core postgres backend adds CONN_HEALTH_CHECKS and an optional
+# in-process connection pool of POOL_SIZE connections, which are closed
+# once they are POOL_MAX_AGE seconds old, see
+# core/db/backends/postgresql/base.py.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': 5432,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': bool(int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1))),
+        'POOL_SIZE': int(os.environ.get('DB_POOL_SIZE', 0)),
+        'POOL_TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'POOL_MAX_AGE': int(os.environ.get('DB_POOL_MAX_AGE', 600)),
+    }
+}
+
+# Read replicas, a comma separated list of `host[:port][/name]` entries
+# which become the `replica1`, `replica2`, ... aliases with the
+# credentials of the primary. Reads of safe requests go to them, see
+# core/db/routers.py. Users who wrote read from the primary for
+# DB_REPLICA_PIN_SECONDS. DB_REPLICA_SELECTION is `round_robin` or
+# `least_lag`, which skips replicas more than DB_REPLICA_MAX_LAG seconds
+# behind and measures the lag once per DB_REPLICA_LAG_INTERVAL seconds.
+
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    replica = urlsplit(f'//{replica.strip()}')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica.hostname,
+        'PORT': replica.port or DATABASES['default']['PORT'],
+        'NAME': replica.path.lstrip('/') or DATABASES['default']['NAME'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['task.shards.TaskShardRouter', 'core.db.routers.PrimaryReplicaRouter']
+DB_REPLICA_SELECTION = os.environ.get('DB_REPLICA_SELECTION', 'round_robin')
+DB_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_LAG_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_INTERVAL', 1))
+
+# Task shards, a comma separated list of `host[:port][/name]` entries
+# which become the `shard1`, `shard2`, ... aliases with the credentials
+# of the default database. Every user's tasks live on one database of
+# DATABASE_SHARDS, new users are placed by a hash of their id and moved
+# with the move_user_tasks command, see task/shards.py. Shard directory
+# entries are cached for DB_SHARD_CACHE_SECONDS, writes routed by a
+# stale entry are rejected by the old shard.
+
+DATABASE_SHARDS = ['default']
+for number, shard in enumerate(filter(None, os.environ.get('DB_SHARDS', '').split(',')), 1):
+    shard = urlsplit(f'//{shard.strip()}')
+    DATABASES[f'shard{number}'] = {
+        **DATABASES['default'],
+        'HOST': shard.hostname,
+        'PORT': shard.port or DATABASES['default']['PORT'],
+        'NAME': shard.path.lstrip('/') or DATABASES['default']['NAME'],
+    }
+    DATABASE_SHARDS.append(f'shard{number}')
+DB_SHARD_CACHE_SECONDS = int(os.environ.get('DB_SHARD_CACHE_SECONDS', 300))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Rate limits, read-your-writes pins and shard lookups live here, use a
+# cache shared by all workers (e.g.
+# django.core.cache.backends.redis.RedisCache) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+# Seconds rendered task list bodies are cached for, 0 disables the cache.
+# Bodies are keyed by the task version kept in the database, so a cache
+# local to each process never serves a stale list.
+TASK_LIST_CACHE_TIMEOUT = int(os.environ.get('TASK_LIST_CACHE_TIMEOUT', 0))
+
+# Completed tasks not updated for this many days are moved to the archive
+# table by the archive_tasks command.
+TASK_ARCHIVE_AFTER_DAYS = int(os.environ.get('TASK_ARCHIVE_AFTER_DAYS', 90))
+
+# Task export files are deleted by the delete_expired_exports command
+# once they are this many hours old.
+TASK_EXPORT_EXPIRE_HOURS = int(os.environ.get('TASK_EXPORT_EXPIRE_HOURS', 24))
+
+
+# Threads running the database work of async views, this caps the number
+# of connections a single ASGI worker opens.
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 10))
+
+
+# Token bucket rate limits of the task and user endpoints, kept in the
+# default cache. Rates are set in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].
+THROTTLE_ENABLED = bool(int(os.environ.get('THROTTLE_ENABLED', 1)))
+
+
+# Per-view request latency and SQL metrics, served at /metrics and in
+# Server-Timing headers.
+METRICS_ENABLED = bool(int(os.environ.get('METRICS_ENABLED', 0)))
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/4.0/topics/auth/passwords/
+# Hashes are computed on PASSWORD_HASH_WORKERS threads per process with
+# PASSWORD_HASH_QUEUE more waiting, logins beyond that are answered with
+# 503 and a Retry-After header. 0 workers hash on the request thread.
+# PASSWORD_HASHER picks the hasher of new passwords, older hashes keep
+# working and are upgraded on the next login.
+
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+PASSWORD_HASH_RETRY_AFTER = int(os.environ.get('PASSWORD_HASH_RETRY_AFTER', 1))
+
+PASSWORD_HASHER = os.environ.get(
+    'PASSWORD_HASHER',
+    'argon2' if importlib.util.find_spec('argon2') else 'pbkdf2',
+)
+_PASSWORD_HASHERS = {
+    'argon2': 'core.hashers.Argon2PasswordHasher',
+    'pbkdf2': 'core.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'core.hashers.ScryptPasswordHasher',
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS.pop(PASSWORD_HASHER),
+    *_PASSWORD_HASHERS.values(),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Argon2id cost, memory in KiB. The defaults follow the OWASP minimum
+# and keep concurrent hashes small enough for a busy worker.
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 19456))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -135,6 +280,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Files written by background jobs, like task exports.
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -142,10 +290,67 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # orjson backed JSON handling, falls back to the stdlib when orjson is
+    # not installed. Use rest_framework.renderers.JSONRenderer and
+    # rest_framework.parsers.JSONParser to opt out.
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Answers a full password hashing pool with 503, see core/hashers.py.
+    'EXCEPTION_HANDLER': 'core.exceptions.exception_handler',
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.TokenBucketThrottle',
+    ],
+    # Bursts of up to <requests> refilled over the period, per user or
+    # per IP for anonymous requests. Listing pages, searching and bulk
+    # writes cost more than reading a single task, so their limits are
+    # lower.
+    'DEFAULT_THROTTLE_RATES': {
+        'task': '300/min',
+        'task.list': '120/min',
+        'task.retrieve': '600/min',
+        'task.bulk': '30/min',
+        'task.bulk_update': '30/min',
+        'task.bulk_destroy': '30/min',
+        'task.export': '10/min',
+        'task.export_job': '10/min',
+        'task.clear_completed': '10/min',
+        'job': '300/min',
+        'user.create': '20/hour',
+        'user.token': '30/min',
+        'user.profile': '120/min',
+    },
 }
 
 AUTH_USER_MODEL = 'user.User'
 
+# Api tokens expire AUTH_TOKEN_TTL seconds after they were issued or last
+# refreshed, using a token refreshes it at most once per
+# AUTH_TOKEN_REFRESH_INTERVAL seconds.
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 30 * 24 * 60 * 60))
+AUTH_TOKEN_REFRESH_INTERVAL = int(os.environ.get('AUTH_TOKEN_REFRESH_INTERVAL', 60 * 60))
+
+# Token authentication cache
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+
+# Background jobs are retried up to JOB_MAX_ATTEMPTS times, waiting
+# JOB_RETRY_DELAY seconds doubled per failed attempt, at most
+# JOB_RETRY_MAX_DELAY. Running jobs are leased for JOB_TIMEOUT seconds,
+# renewed every JOB_HEARTBEAT seconds while they run, a job whose lease
+# ran out is presumed lost with its worker and taken over by another one.
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 10))
+JOB_RETRY_MAX_DELAY = float(os.environ.get('JOB_RETRY_MAX_DELAY', 60 * 60))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 5 * 60))
+JOB_HEARTBEAT = float(os.environ.get('JOB_HEARTBEAT', 60))
+
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True
 }
\ No newline at end of file
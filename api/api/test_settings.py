@@ -0,0 +1,12 @@
+"""
+Settings of the test runner, `manage.py test` uses them.
+
+The sharding tests run against two more databases on the server of the
+default one, unless DB_SHARDS already configured them. The replica tests
+read through a mirror of the default database.
+"""
+from .settings import *  # noqa: F401,F403
+
+for alias in ['shard1', 'shard2']:
+    DATABASES.setdefault(alias, {**DATABASES['default'], 'NAME': f'{DATABASES["default"]["NAME"]}_{alias}'})
+DATABASES.setdefault('replica', {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}})
@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from django.urls import reverse
+
+from .seed import PASSWORD, WORDS
+
+@dataclass
+class Endpoint:
+    """A benchmarked route and how to build its i-th request for a user."""
+    name: str
+    method: str
+    path: Callable
+    body: Optional[Callable] = None
+    is_async: bool = False
+    authenticated: bool = True
+
+    def request_for(self, users):
+        """Return a function building the i-th request, spread over the users."""
+        def request(i):
+            user = users[i % len(users)]
+            body = self.body(user, i) if self.body is not None else None
+            return self.method, self.path(user, i), body, user.token if self.authenticated else None
+        return request
+
+def task_id(user, i):
+    return user.task_ids[i % len(user.task_ids)]
+
+def get_endpoints():
+    """Return the benchmarked endpoints, resolved from the project urls."""
+    tasks = reverse('task:task-list')
+    detail = lambda user, i: reverse('task:task-detail', args=[task_id(user, i)])
+    async_tasks = reverse('task:async-task-list')
+    return [
+        Endpoint('GET task:task-list', 'GET', lambda user, i: tasks),
+        Endpoint('GET task:task-list?search', 'GET', lambda user, i: f'{tasks}?search={WORDS[i % len(WORDS)]}'),
+        Endpoint('GET task:task-list?filter', 'GET', lambda user, i: f'{tasks}?is_completed=false&ordering=title'),
+        Endpoint('GET task:task-list?include_archived', 'GET', lambda user, i: f'{tasks}?include_archived=true'),
+        Endpoint('GET task:task-detail', 'GET', detail),
+        Endpoint('POST task:task-list', 'POST', lambda user, i: tasks, body=lambda user, i: {'title': f'bench {i}'}),
+        Endpoint('PATCH task:task-detail', 'PATCH', detail, body=lambda user, i: {'is_completed': i % 2 == 0}),
+        Endpoint(
+            'POST task:task-bulk',
+            'POST',
+            lambda user, i: reverse('task:task-bulk'),
+            body=lambda user, i: [{'title': f'bench {i}.{n}'} for n in range(10)],
+        ),
+        Endpoint('GET task:task-stats', 'GET', lambda user, i: reverse('task:task-stats')),
+        Endpoint('GET task:task-changes', 'GET', lambda user, i: reverse('task:task-changes')),
+        Endpoint('GET user:profile', 'GET', lambda user, i: reverse('user:profile')),
+        Endpoint(
+            'POST user:token',
+            'POST',
+            lambda user, i: reverse('user:token'),
+            body=lambda user, i: {'username': user.username, 'password': PASSWORD},
+            authenticated=False,
+        ),
+        Endpoint('GET task:async-task-list', 'GET', lambda user, i: async_tasks, is_async=True),
+        Endpoint(
+            'GET task:async-task-detail',
+            'GET',
+            lambda user, i: reverse('task:async-task-detail', args=[task_id(user, i)]),
+            is_async=True,
+        ),
+    ]
@@ -0,0 +1,148 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.test import AsyncClient, Client
+
+from .stats import summarize
+
+# Status recorded for requests that failed without a response.
+CONNECTION_ERROR = 599
+
+def auth_headers(token, prefix='HTTP_'):
+    return {f'{prefix}AUTHORIZATION': f'Token {token}'} if token else {}
+
+class ClientDriver:
+    """Send requests in-process through the WSGI handler."""
+
+    def __init__(self):
+        self.client = Client()
+
+    def send(self, method, path, body=None, token=None):
+        """Send a request and return its status and body."""
+        kwargs = auth_headers(token)
+        if body is not None:
+            kwargs.update(data=json.dumps(body), content_type='application/json')
+        response = self.client.generic(method, path, **kwargs)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, content
+
+class AsyncClientDriver:
+    """Send requests in-process through the ASGI handler."""
+
+    def __init__(self):
+        self.client = AsyncClient()
+
+    async def send(self, method, path, body=None, token=None):
+        """Send a request and return its status and body."""
+        kwargs = auth_headers(token, prefix='')
+        if body is not None:
+            kwargs.update(data=json.dumps(body), content_type='application/json')
+        response = await self.client.generic(method, path, **kwargs)
+        return response.status_code, response.content
+
+class HTTPDriver:
+    """Send requests to a running server over one keep-alive connection."""
+
+    def __init__(self, base_url, timeout=30):
+        url = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, method, path, body=None, token=None):
+        """Send a request and return its status and body."""
+        headers = {'Accept': 'application/json', **{k.title(): v for k, v in auth_headers(token, prefix='').items()}}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                self.connection.request(method, self.prefix + path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # The server may close idle keep-alive connections, retry once.
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def run_threads(make_driver, request_for, requests, concurrency):
+    """
+    Send `requests` requests from `concurrency` threads and summarize them.
+
+    Every thread gets its own driver. `request_for(i)` returns the
+    method, path, body and token of the i-th request.
+    """
+    lock = threading.Lock()
+    next_index = iter(range(requests))
+
+    def worker():
+        driver = make_driver()
+        durations, errors = [], 0
+        try:
+            while True:
+                with lock:
+                    i = next(next_index, None)
+                if i is None:
+                    return durations, errors
+                start = time.perf_counter()
+                try:
+                    status, _ = driver.send(*request_for(i))
+                except Exception:
+                    status = CONNECTION_ERROR
+                durations.append(time.perf_counter() - start)
+                errors += status >= 400
+        finally:
+            if hasattr(driver, 'close'):
+                driver.close()
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [future.result() for future in [executor.submit(worker) for _ in range(concurrency)]]
+    elapsed = time.perf_counter() - start
+    return summarize(
+        [duration for durations, _ in results for duration in durations],
+        elapsed,
+        sum(errors for _, errors in results),
+    )
+
+def run_async(request_for, requests, concurrency):
+    """Send `requests` requests from `concurrency` coroutines through the ASGI handler."""
+    async def main():
+        driver = AsyncClientDriver()
+        next_index = iter(range(requests))
+        durations, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            for i in next_index:
+                start = time.perf_counter()
+                try:
+                    status, _ = await driver.send(*request_for(i))
+                except Exception:
+                    status = CONNECTION_ERROR
+                durations.append(time.perf_counter() - start)
+                errors += status >= 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(durations, time.perf_counter() - start, errors)
+
+    return asyncio.run(main())
@@ -0,0 +1,138 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from bench import seed
+from bench.endpoints import get_endpoints
+from bench.load import ClientDriver, HTTPDriver, run_async, run_threads
+from bench.scenarios import SCENARIOS, BenchContext
+from core.concurrency import close_db_connections
+from core.db.pool import close_pools
+
+class Command(BaseCommand):
+    """Django command to benchmark the api."""
+    help = (
+        'Seed users and tasks, drive the api routes with concurrent workers and print '
+        'throughput and latency percentiles per endpoint as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Benchmark a running server over HTTP instead of in-process.')
+        parser.add_argument('--users', type=int, default=4, help='Users to seed.')
+        parser.add_argument('--tasks-per-user', type=int, default=2000, help='Tasks to seed per user.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent workers.')
+        parser.add_argument('--endpoints', nargs='*', help='Only endpoints whose name contains one of these.')
+        parser.add_argument('--scenarios', nargs='*', choices=sorted(SCENARIOS), help='Only these scenarios.')
+        parser.add_argument('--serializer-rows', type=int, default=10000, help='Rows of the serializer scenarios.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Tasks of the batch_vs_single scenario.')
+        parser.add_argument('--max-pages', type=int, default=100, help='Pages of the pagination_depth scenario.')
+        parser.add_argument('--pool-cycles', type=int, default=200, help='Connections of the connection_pool scenario.')
+        parser.add_argument('--partitions', type=int, default=8, help='Hash partitions of the partitioning scenario.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated tasks.')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the in-process benchmark database.')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        if options['users'] < 1:
+            raise CommandError('At least one user is needed.')
+        over_http = bool(options['url'])
+        if over_http:
+            report = self.run(options, lambda: HTTPDriver(options['url']), over_http)
+        else:
+            # Benchmark against throwaway databases, like the test runner.
+            setup_test_environment(debug=False)
+            old_names = {
+                alias: connections[alias].creation.create_test_db(
+                    verbosity=0, autoclobber=True, keepdb=options['keepdb'], serialize=False,
+                )
+                for alias in settings.DATABASE_SHARDS
+            }
+            try:
+                # Rate limits would turn most benchmark requests into 429s.
+                with override_settings(THROTTLE_ENABLED=False):
+                    report = self.run(options, ClientDriver, over_http)
+            finally:
+                close_db_connections()
+                close_pools()
+                for alias, old_name in old_names.items():
+                    connections[alias].creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+                teardown_test_environment()
+
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+    def run(self, options, make_driver, over_http):
+        """Seed the data, run the endpoints and scenarios and return the report."""
+        self.log(f'Seeding {options["users"]} users with {options["tasks_per_user"]} tasks each...')
+        seed.clear()
+        users = seed.seed(options['users'], options['tasks_per_user'], seed=options['seed'])
+        try:
+            report = {'meta': self.meta(options, over_http), 'endpoints': {}, 'scenarios': {}}
+            for endpoint in self.selected_endpoints(options):
+                self.log(f'Benchmarking {endpoint.name}...')
+                request_for = endpoint.request_for(users)
+                if endpoint.is_async and not over_http:
+                    result = run_async(request_for, options['requests'], options['concurrency'])
+                    close_db_connections()
+                else:
+                    result = run_threads(make_driver, request_for, options['requests'], options['concurrency'])
+                report['endpoints'][endpoint.name] = result
+
+            ctx = BenchContext(users, options, make_driver, over_http)
+            for name in options['scenarios'] or SCENARIOS:
+                scenario = SCENARIOS[name]
+                if over_http and getattr(scenario, 'in_process', False):
+                    continue
+                self.log(f'Running scenario {name}...')
+                report['scenarios'][name] = scenario(ctx)
+            return report
+        finally:
+            if over_http:
+                seed.clear()
+
+    def selected_endpoints(self, options):
+        """Return the endpoints matching the --endpoints filters."""
+        endpoints = get_endpoints()
+        if options['endpoints'] is None:
+            return endpoints
+        return [
+            endpoint for endpoint in endpoints
+            if any(name in endpoint.name for name in options['endpoints'])
+        ]
+
+    def meta(self, options, over_http):
+        """Return what a report has to be compared on."""
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'started': timezone.now().isoformat(),
+            'mode': 'http' if over_http else 'in-process',
+            'url': options['url'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'users': options['users'],
+            'tasks_per_user': options['tasks_per_user'],
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+        }
+
+    def log(self, message):
+        self.stderr.write(message)
@@ -0,0 +1,391 @@
+"""
+Focused benchmarks of single optimizations.
+
+Each scenario takes a `BenchContext` and returns a JSON serializable
+dict. Scenarios marked `in_process` measure code paths directly and are
+skipped when benchmarking a server over HTTP.
+"""
+import io
+import json
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, F, Q
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core import hashers
+from core.concurrency import close_db_connections
+from core.db.pool import close_pools
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+from core.throttling import TokenBucket
+from task.archive import TaskArchiver, restore_tasks
+from task.counters import get_task_counts
+from task.models import Task
+from task.partitions import TaskPartitioner
+from task.serializers import TaskDetailSerializer, TaskSerializer, task_detail_values, task_values
+from task.shards import TaskMover, shard_for_user
+
+from .endpoints import get_endpoints
+from .load import ClientDriver, run_async, run_threads
+from .stats import summarize
+
+@dataclass
+class BenchContext:
+    """Seeded users, command options and the driver factory of a run."""
+    users: list
+    options: dict
+    make_driver: Callable
+    over_http: bool = False
+
+def best_of(func, repeat=3):
+    """Return the fastest of `repeat` runs of func in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(min(timings) * 1000, 3)
+
+def pagination_depth(ctx):
+    """Time every page of a user's task list followed through cursors."""
+    driver = ctx.make_driver()
+    user = ctx.users[0]
+    url = f"{reverse('task:task-list')}?page_size=50"
+    timings = []
+    while url and len(timings) < ctx.options['max_pages']:
+        start = time.perf_counter()
+        status, content = driver.send('GET', url, token=user.token)
+        timings.append(time.perf_counter() - start)
+        next_url = json.loads(content)['next'] if status == 200 else None
+        url = None if next_url is None else urlsplit(next_url)._replace(scheme='', netloc='').geturl()
+        if ctx.over_http and url and driver.prefix and url.startswith(driver.prefix):
+            url = url[len(driver.prefix):]
+    ms = [round(timing * 1000, 3) for timing in timings]
+    return {
+        'pages': len(ms),
+        'first_ms': ms[0],
+        'median_ms': statistics.median(ms),
+        'last_ms': ms[-1],
+        'max_ms': max(ms),
+    }
+
+def batch_vs_single(ctx):
+    """Compare creating tasks one request each with one bulk request."""
+    driver = ctx.make_driver()
+    user = ctx.users[0]
+    size = ctx.options['batch_size']
+    tasks_url = reverse('task:task-list')
+    bulk_url = reverse('task:task-bulk')
+
+    start = time.perf_counter()
+    for i in range(size):
+        driver.send('POST', tasks_url, {'title': f'single {i}'}, user.token)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    driver.send('POST', bulk_url, [{'title': f'bulk {i}'} for i in range(size)], user.token)
+    bulk = time.perf_counter() - start
+    return {
+        'tasks': size,
+        'single_requests_ms': round(single * 1000, 3),
+        'bulk_request_ms': round(bulk * 1000, 3),
+        'speedup': round(single / bulk, 1),
+    }
+
+def export_memory(ctx):
+    """Measure the Python memory peak of streaming a user's export."""
+    user = ctx.users[0]
+    driver = ClientDriver()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        status, content = driver.send('GET', f"{reverse('task:task-export')}?output=ndjson", token=user.token)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'rows': content.count(b'\n'),
+        'bytes': len(content),
+        'duration_ms': round(elapsed * 1000, 3),
+        'peak_memory_bytes': peak,
+    }
+export_memory.in_process = True
+
+def build_tasks(count):
+    """Return unsaved tasks and the matching `.values()` rows."""
+    now = timezone.now()
+    tasks = [
+        Task(
+            id=i,
+            title=f'task {i}',
+            description='a moderately long task description ' * 3,
+            is_completed=i % 3 == 0,
+            created=now - timedelta(seconds=i),
+            updated=now,
+            user_id=1,
+        )
+        for i in range(count)
+    ]
+    fields = set(task_values.fields) | set(task_detail_values.fields)
+    rows = [{field: getattr(task, field) for field in fields} for task in tasks]
+    return tasks, rows
+
+def serializer(ctx):
+    """Compare the model serializers with the `.values()` representations."""
+    tasks, rows = build_tasks(ctx.options['serializer_rows'])
+    return {
+        'rows': len(tasks),
+        'list_serializer_ms': best_of(lambda: TaskSerializer(tasks, many=True).data),
+        'list_values_ms': best_of(lambda: task_values.to_representation_many(rows)),
+        'detail_serializer_ms': best_of(lambda: TaskDetailSerializer(tasks, many=True).data),
+        'detail_values_ms': best_of(lambda: task_detail_values.to_representation_many(rows)),
+    }
+serializer.in_process = True
+
+def renderer(ctx):
+    """Compare the stdlib and orjson renderers and parsers."""
+    _, rows = build_tasks(ctx.options['serializer_rows'])
+    data = task_detail_values.to_representation_many(rows)
+    content = JSONRenderer().render(data)
+    megabytes = len(content) / 1024 / 1024
+    result = {'bytes': len(content)}
+    for name, render in [('json', JSONRenderer().render), ('orjson', FastJSONRenderer().render)]:
+        ms = best_of(lambda: render(data))
+        result[f'render_{name}_ms'] = ms
+        result[f'render_{name}_mb_s'] = round(megabytes / ms * 1000, 1)
+    for name, parser in [('json', JSONParser()), ('orjson', FastJSONParser())]:
+        result[f'parse_{name}_ms'] = best_of(lambda: parser.parse(io.BytesIO(content)))
+    return result
+renderer.in_process = True
+
+def wsgi_vs_asgi(ctx):
+    """Compare the sync list through the WSGI handler with the async list through the ASGI handler."""
+    endpoints = {endpoint.name: endpoint for endpoint in get_endpoints()}
+    requests, concurrency = ctx.options['requests'], ctx.options['concurrency']
+    result = {
+        'wsgi': run_threads(
+            ClientDriver, endpoints['GET task:task-list'].request_for(ctx.users), requests, concurrency,
+        ),
+        'asgi': run_async(endpoints['GET task:async-task-list'].request_for(ctx.users), requests, concurrency),
+    }
+    close_db_connections()
+    return result
+wsgi_vs_asgi.in_process = True
+
+def connection_pool(ctx):
+    """Compare opening a connection per request with taking one from the pool."""
+    connection = connections[DEFAULT_DB_ALIAS]
+    result = {}
+    for name, size in [('unpooled', 0), ('pooled', 4)]:
+        settings_dict = dict(connection.settings_dict, POOL_SIZE=size, CONN_MAX_AGE=0)
+        wrapper = connection.__class__(settings_dict, DEFAULT_DB_ALIAS)
+        durations = []
+        for _ in range(ctx.options['pool_cycles']):
+            start = time.perf_counter()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            wrapper.close()
+            durations.append(time.perf_counter() - start)
+        result[name] = summarize(durations, sum(durations))
+    close_pools()
+    return result
+connection_pool.in_process = True
+
+def stats_vs_count(ctx):
+    """Compare reading the task counters with counting the tasks."""
+    user_id = ctx.users[0].id
+    count = lambda: Task.objects.filter(user_id=user_id).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(is_completed=True)),
+    )
+    return {
+        'tasks': get_task_counts(user_id)['total'],
+        'counter_ms': best_of(lambda: get_task_counts(user_id), repeat=20),
+        'count_ms': best_of(count, repeat=20),
+    }
+stats_vs_count.in_process = True
+
+def metrics_overhead(ctx):
+    """Compare the task list with the metrics middleware disabled and enabled."""
+    list_requests = get_endpoints()[0].request_for(ctx.users)
+    result = {}
+    for name, enabled in [('disabled', False), ('enabled', True)]:
+        with override_settings(METRICS_ENABLED=enabled):
+            result[name] = run_threads(ClientDriver, list_requests, ctx.options['requests'], ctx.options['concurrency'])
+    return result
+metrics_overhead.in_process = True
+
+def login_throughput(ctx):
+    """Compare token logins hashing on the request threads and on the hashing pool, next to task list requests."""
+    endpoints = {endpoint.name: endpoint for endpoint in get_endpoints()}
+    logins = endpoints['POST user:token'].request_for(ctx.users)
+    lists = endpoints['GET task:task-list'].request_for(ctx.users)
+    requests, concurrency = ctx.options['requests'], ctx.options['concurrency']
+    result = {}
+    for name, workers in [('inline', 0), ('pooled', max(settings.PASSWORD_HASH_WORKERS, 1))]:
+        # The queue fits every login, so the pool only bounds the hashes in flight.
+        pool = hashers.HashingPool(workers, queue=requests, retry_after=settings.PASSWORD_HASH_RETRY_AFTER)
+        previous, hashers.hashing_pool = hashers.hashing_pool, pool
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                login_run = executor.submit(run_threads, ClientDriver, logins, requests, concurrency)
+                list_run = executor.submit(run_threads, ClientDriver, lists, requests, concurrency)
+                result[name] = {'login': login_run.result(), 'list': list_run.result(), **pool.stats()}
+        finally:
+            hashers.hashing_pool = previous
+            pool.shutdown()
+    result['hasher'] = settings.PASSWORD_HASHER
+    return result
+login_throughput.in_process = True
+
+def throttle_overhead(ctx):
+    """Compare the task list with rate limiting disabled and enabled, and time taking a token."""
+    list_requests = get_endpoints()[0].request_for(ctx.users)
+    result = {}
+    # Rates high enough that no request is throttled, only the overhead is measured.
+    rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'task.list': '1000000/s'}
+    rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+    for name, enabled in [('disabled', False), ('enabled', True)]:
+        with override_settings(THROTTLE_ENABLED=enabled, REST_FRAMEWORK=rest_framework):
+            result[name] = run_threads(ClientDriver, list_requests, ctx.options['requests'], ctx.options['concurrency'])
+    bucket = TokenBucket(capacity=1000000, period=1)
+    takes = 1000
+    ms = best_of(lambda: [bucket.take('bench:throttle') for _ in range(takes)])
+    result['take_us'] = round(ms * 1000 / takes, 3)
+    return result
+throttle_overhead.in_process = True
+
+def shard_throughput(ctx):
+    """Compare the task list and create throughput with the users spread over one to every task shard."""
+    endpoints = {endpoint.name: endpoint for endpoint in get_endpoints()}
+    shards = settings.DATABASE_SHARDS
+    mover = TaskMover(batch_size=5000)
+    placed = {user.id: shard_for_user(user.id) for user in ctx.users}
+    result = {}
+    try:
+        for count in range(1, len(shards) + 1):
+            for i, user in enumerate(ctx.users):
+                mover.move(user.id, shards[i % count])
+            result[f'shards_{count}'] = {
+                name: run_threads(
+                    ClientDriver, endpoints[name].request_for(ctx.users),
+                    ctx.options['requests'], ctx.options['concurrency'],
+                )
+                for name in ['GET task:task-list', 'POST task:task-list']
+            }
+    finally:
+        for user_id, shard in placed.items():
+            mover.move(user_id, shard)
+    return result
+shard_throughput.in_process = True
+
+def partitioning(ctx):
+    """Compare task list, detail and create latency on the plain task table and on its hash partitions."""
+    endpoints = {endpoint.name: endpoint for endpoint in get_endpoints()}
+    partitions = ctx.options['partitions']
+
+    def measure():
+        return {
+            name: run_threads(
+                ClientDriver, endpoints[name].request_for(ctx.users),
+                ctx.options['requests'], ctx.options['concurrency'],
+            )
+            for name in ['GET task:task-list', 'GET task:task-detail', 'POST task:task-list']
+        }
+
+    result = {'plain': measure()}
+    try:
+        start = time.perf_counter()
+        for using in settings.DATABASE_SHARDS:
+            TaskPartitioner(partitions, using=using).run()
+        result['partition_seconds'] = round(time.perf_counter() - start, 3)
+        result[f'partitions_{partitions}'] = measure()
+    finally:
+        for using in settings.DATABASE_SHARDS:
+            TaskPartitioner(0, using=using).run()
+    return result
+partitioning.in_process = True
+
+# Partitions included, the tree of a plain table is empty.
+TABLE_SIZE_SQL = """
+SELECT COALESCE(SUM(pg_total_relation_size(relid)), pg_total_relation_size(%s::regclass))
+FROM pg_partition_tree(%s::regclass)
+"""
+
+def archiving(ctx):
+    """Compare the task table size and list latency before and after archiving the completed tasks."""
+    endpoints = {endpoint.name: endpoint for endpoint in get_endpoints()}
+    user_ids = [user.id for user in ctx.users]
+    table = Task._meta.db_table
+
+    def compact():
+        # Archiving frees space for new rows, only a rewrite returns it.
+        for using in settings.DATABASE_SHARDS:
+            with connections[using].cursor() as cursor:
+                cursor.execute(f'VACUUM FULL ANALYZE {table}')
+
+    def measure():
+        result = {'tasks': 0, 'table_bytes': 0}
+        for using in settings.DATABASE_SHARDS:
+            result['tasks'] += Task.all_objects.using(using).count()
+            with connections[using].cursor() as cursor:
+                cursor.execute(TABLE_SIZE_SQL, [table, table])
+                result['table_bytes'] += int(cursor.fetchone()[0])
+        for name in ['GET task:task-list', 'GET task:task-list?filter', 'GET task:task-list?include_archived']:
+            result[name] = run_threads(
+                ClientDriver, endpoints[name].request_for(ctx.users),
+                ctx.options['requests'], ctx.options['concurrency'],
+            )
+        return result
+
+    for using in settings.DATABASE_SHARDS:
+        completed = Task.all_objects.using(using).filter(user_id__in=user_ids, is_completed=True)
+        completed.update(updated=F('updated') - timedelta(days=settings.TASK_ARCHIVE_AFTER_DAYS + 1))
+    compact()
+    result = {'before': measure()}
+    try:
+        start = time.perf_counter()
+        result['archived'] = sum(TaskArchiver(using=using).run() for using in settings.DATABASE_SHARDS)
+        result['archive_seconds'] = round(time.perf_counter() - start, 3)
+        compact()
+        result['after'] = measure()
+    finally:
+        for user_id in user_ids:
+            restore_tasks(user_id, shard_for_user(user_id))
+    return result
+archiving.in_process = True
+
+SCENARIOS = {
+    scenario.__name__: scenario
+    for scenario in [
+        pagination_depth,
+        batch_vs_single,
+        export_memory,
+        serializer,
+        renderer,
+        wsgi_vs_asgi,
+        connection_pool,
+        stats_vs_count,
+        metrics_overhead,
+        login_throughput,
+        throttle_overhead,
+        shard_throughput,
+        partitioning,
+        archiving,
+    ]
+}
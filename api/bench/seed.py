@@ -0,0 +1,91 @@
+import random
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from task.models import ArchivedTask, Task
+from task.shards import place_user, shard_for_user
+from user.models import AuthToken
+
+USERNAME_PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+WORDS = [
+    'buy', 'call', 'email', 'fix', 'plan', 'review', 'write', 'clean', 'book', 'pay',
+    'milk', 'report', 'invoice', 'meeting', 'garden', 'car', 'dentist', 'budget', 'slides', 'tickets',
+]
+
+@dataclass
+class BenchUser:
+    """A seeded user with its token and task ids."""
+    id: int
+    username: str
+    token: str
+    task_ids: list = field(default_factory=list)
+
+def task_text(rng):
+    """Return a random title and description."""
+    title = ' '.join(rng.choices(WORDS, k=3))
+    description = ' '.join(rng.choices(WORDS, k=12))
+    return title, description
+
+def seed(users, tasks_per_user, using='default', batch_size=5000, seed=0):
+    """
+    Create users with tokens and tasks with `bulk_create`.
+
+    Users are named with USERNAME_PREFIX and share one pre-hashed
+    password, so seeding does not pay for hashing. Seeding the default
+    database puts every user's tasks on their hash shard.
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    User = get_user_model()
+    created = User.objects.using(using).bulk_create([
+        User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password=password)
+        for i in range(users)
+    ])
+    # Reload to get primary keys on every backend.
+    created = list(User.objects.using(using).filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+    tokens = AuthToken.objects.using(using).bulk_create([
+        AuthToken(key=AuthToken.generate_key(), user=user, device='bench') for user in created
+    ])
+
+    shards = {}
+    for user in created:
+        if using == DEFAULT_DB_ALIAS:
+            place_user(user.id)
+        shards[user.id] = shard_for_user(user.id) if using == DEFAULT_DB_ALIAS else using
+        batch = []
+        for _ in range(tasks_per_user):
+            title, description = task_text(rng)
+            batch.append(Task(title=title, description=description, is_completed=rng.random() < 0.3, user=user))
+            if len(batch) >= batch_size:
+                Task.objects.using(shards[user.id]).bulk_create(batch)
+                batch = []
+        Task.objects.using(shards[user.id]).bulk_create(batch)
+
+    for shard in set(shards.values()):
+        with connections[shard].cursor() as cursor:
+            cursor.execute(f'ANALYZE {Task._meta.db_table}')
+
+    bench_users = []
+    for user, token in zip(created, tokens):
+        tasks = Task.objects.using(shards[user.id]).filter(user=user)
+        task_ids = list(tasks.values_list('id', flat=True)[:1000])
+        bench_users.append(BenchUser(user.id, user.username, token.key, task_ids))
+    return bench_users
+
+def clear(using='default'):
+    """Delete the seeded users and their tasks."""
+    users = get_user_model().objects.using(using).filter(username__startswith=USERNAME_PREFIX)
+    user_ids = list(users.values_list('id', flat=True))
+    if not user_ids:
+        return
+    # Delete tasks in one statement per shard instead of loading them for signals.
+    for shard in settings.DATABASE_SHARDS if using == DEFAULT_DB_ALIAS else [using]:
+        with connections[shard].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Task._meta.db_table} WHERE user_id = ANY(%s)', [user_ids])
+            cursor.execute(f'DELETE FROM {ArchivedTask._meta.db_table} WHERE user_id = ANY(%s)', [user_ids])
+    users.delete()
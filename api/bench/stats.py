@@ -0,0 +1,30 @@
+import math
+
+
+def percentile(values, q):
+    """Return the nearest-rank percentile `q` (0-100) of sorted values."""
+    if not values:
+        return None
+    rank = max(math.ceil(q / 100 * len(values)), 1)
+    return values[rank - 1]
+
+def summarize(durations, elapsed, errors=0):
+    """
+    Summarize request durations in seconds.
+
+    Latencies are reported in milliseconds and throughput in requests per
+    second of wall clock time.
+    """
+    durations = sorted(durations)
+    count = len(durations)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(durations) / count) if count else None,
+        'p50_ms': ms(percentile(durations, 50)),
+        'p95_ms': ms(percentile(durations, 95)),
+        'p99_ms': ms(percentile(durations, 99)),
+        'max_ms': ms(durations[-1]) if count else None,
+    }
@@ -0,0 +1,63 @@
+from django.test import TestCase, TransactionTestCase
+
+from task.models import Task
+
+from . import seed
+from .endpoints import get_endpoints
+from .load import ClientDriver, run_threads
+from .scenarios import SCENARIOS, BenchContext
+from .stats import percentile, summarize
+
+class StatsTests(TestCase):
+    """Test the latency statistics."""
+
+    def test_percentile_nearest_rank(self):
+        """Test percentiles pick the nearest ranked value."""
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 1), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        """Test durations are summarized in milliseconds."""
+        summary = summarize([0.002, 0.001, 0.003, 0.004], elapsed=0.5, errors=1)
+
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput_rps'], 8.0)
+        self.assertEqual(summary['p50_ms'], 2.0)
+        self.assertEqual(summary['max_ms'], 4.0)
+
+class BenchRunTests(TransactionTestCase):
+    """Test seeding and driving the api."""
+
+    def setUp(self):
+        self.users = seed.seed(users=2, tasks_per_user=5)
+
+    def test_seed_and_clear(self):
+        """Test seeded users get tokens and tasks and are cleared again."""
+        self.assertEqual(len(self.users), 2)
+        self.assertTrue(all(user.token and len(user.task_ids) == 5 for user in self.users))
+
+        seed.clear()
+        self.assertFalse(Task.objects.exists())
+
+    def test_every_endpoint_succeeds(self):
+        """Test every benchmarked sync endpoint answers its requests."""
+        for endpoint in get_endpoints():
+            if endpoint.is_async:
+                continue
+            with self.subTest(endpoint=endpoint.name):
+                result = run_threads(ClientDriver, endpoint.request_for(self.users), requests=2, concurrency=1)
+                self.assertEqual(result['errors'], 0)
+
+    def test_scenarios(self):
+        """Test the in-process scenarios run against the seeded data."""
+        options = {'serializer_rows': 10, 'batch_size': 2, 'max_pages': 2, 'requests': 2, 'concurrency': 1}
+        ctx = BenchContext(self.users, options, ClientDriver)
+        for name in ['pagination_depth', 'batch_vs_single', 'export_memory', 'serializer', 'renderer', 'stats_vs_count']:
+            with self.subTest(scenario=name):
+                self.assertIsInstance(SCENARIOS[name](ctx), dict)
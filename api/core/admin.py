@@ -1,8 +1,155 @@
-
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import F
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import OrderBy
+from django.utils.functional import cached_property
 
 from task.models import Task
-from user.models import User
+from user.models import AuthToken, User
+
+from .models import Job
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Pick the task shard the changelist reads from, all of them by default."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in settings.DATABASE_SHARDS]
+
+    def queryset(self, request, queryset):
+        shard = self.value()
+        if shard is None:
+            return queryset
+        if shard not in settings.DATABASE_SHARDS:
+            return queryset.none()
+        return queryset.using(shard)
+
+
+def order_value(row, field):
+    """Return the value of a row a `field__lookup` ordering refers to, None along a missing relation."""
+    for name in field.split(LOOKUP_SEP):
+        if row is None:
+            return None
+        row = getattr(row, name)
+    return row
+
+
+def merge_ordered(rows, ordering):
+    """
+    Sort rows read from several shards by a queryset ordering.
+
+    Sorts are stable, so sorting by the last field first leaves the rows
+    in the ordering. NULLs sort last, first when descending, like
+    postgres sorts them.
+    """
+    rows = list(rows)
+    for field in reversed(ordering):
+        if isinstance(field, OrderBy) and isinstance(field.expression, F):
+            field = f'{"-" if field.descending else ""}{field.expression.name}'
+        if not isinstance(field, str):
+            continue
+        name = field.lstrip('-')
+
+        def key(row):
+            value = order_value(row, name)
+            return (value is None, value)
+        rows.sort(key=key, reverse=field.startswith('-'))
+    return rows
+
+
+class ShardPaginator(Paginator):
+    """
+    Paginate the tasks of every shard as one list.
+
+    A page reads the first rows up to its end from each shard and merges
+    them in the changelist ordering, deep pages read more rows.
+    """
+
+    def shard_querysets(self):
+        return [self.object_list.using(shard) for shard in settings.DATABASE_SHARDS]
+
+    @cached_property
+    def count(self):
+        return sum(queryset.count() for queryset in self.shard_querysets())
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        rows = merge_ordered(
+            [row for queryset in self.shard_querysets() for row in queryset[:top]],
+            self.object_list.query.order_by,
+        )
+        return self._get_page(rows[bottom:top], number, self)
+
+    def all_rows(self):
+        """Return the rows of every shard in the changelist ordering."""
+        rows = [row for queryset in self.shard_querysets() for row in queryset]
+        return merge_ordered(rows, self.object_list.query.order_by)
+
+
+class ShardChangeList(ChangeList):
+    """Changelist of the tasks of every shard, or of the shard picked with `ShardListFilter`."""
+
+    def get_results(self, request):
+        super().get_results(request)
+        if not isinstance(self.paginator, ShardPaginator):
+            return
+        if (self.show_all and self.can_show_all) or not self.multi_page:
+            self.result_list = self.paginator.all_rows()
+        if self.model_admin.show_full_result_count:
+            self.full_result_count = sum(
+                self.root_queryset.using(shard).count() for shard in settings.DATABASE_SHARDS
+            )
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    """Tasks of every shard, listed together or one shard at a time."""
+    list_display = ('id', 'title', 'user_id', 'is_completed', 'created')
+
+    def get_list_filter(self, request):
+        return [ShardListFilter] if len(settings.DATABASE_SHARDS) > 1 else []
+
+    def get_changelist(self, request, **kwargs):
+        return ShardChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # Querysets without a shard picked by ShardListFilter list every shard.
+        if len(settings.DATABASE_SHARDS) > 1 and queryset._db is None:
+            return ShardPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_actions(self, request):
+        # Actions run on the changelist queryset, which has to be on one shard.
+        if len(settings.DATABASE_SHARDS) > 1 and ShardListFilter.parameter_name not in request.GET:
+            return {}
+        return super().get_actions(request)
+
+    def get_object(self, request, object_id, from_field=None):
+        # Task ids are unique across shards, look for the task on each of them.
+        for shard in settings.DATABASE_SHARDS:
+            queryset = self.get_queryset(request).using(shard)
+            field = Task._meta.pk if from_field is None else Task._meta.get_field(from_field)
+            try:
+                return queryset.get(**{field.name: field.to_python(object_id)})
+            except (Task.DoesNotExist, ValidationError, ValueError):
+                continue
+        return None
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Background jobs with their status and last error."""
+    list_display = ('id', 'name', 'user', 'status', 'attempts', 'run_at', 'finished')
+    list_filter = ('status', 'name')
+
 
 admin.site.register(User)
-admin.site.register(Task)
\ No newline at end of file
+admin.site.register(AuthToken)
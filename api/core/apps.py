@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Cache backends every process has its own copy of.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Replica pins live in the cache, a process local one would let
+        # the other processes read a user's writes from lagging replicas.
+        if settings.DATABASE_REPLICAS and settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS:
+            raise ImproperlyConfigured('DB_REPLICAS needs a cache shared by all processes, set CACHE_BACKEND.')
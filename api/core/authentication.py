@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .db.routers import bind_user
+
+
+class CachedUser:
+    """Lightweight snapshot of an authenticated user."""
+    __slots__ = ('pk', 'username', 'email', 'is_active', 'is_staff', 'is_superuser')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk, username, email, is_active=True, is_staff=False, is_superuser=False):
+        self.pk = pk
+        self.username = username
+        self.email = email
+        self.is_active = is_active
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+
+    @classmethod
+    def from_user(cls, user):
+        """Create a snapshot of a user model instance."""
+        return cls(
+            pk=user.pk,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+            is_staff=user.is_staff,
+            is_superuser=user.is_superuser,
+        )
+
+    @property
+    def id(self):
+        return self.pk
+
+    def get_username(self):
+        return self.username
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk and getattr(other, 'is_authenticated', False)
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+class TokenCache:
+    """
+    Thread-safe LRU of token key -> user snapshot with a time to live.
+
+    Every process keeps its own cache. Signals invalidate entries in the
+    process that made the change, the TTL bounds staleness in the others.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached user for a token key or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, user = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, user, generation, ttl=None):
+        """
+        Cache a user for a token key, for at most `ttl` seconds.
+
+        The entry is dropped if any invalidation happened since
+        `generation` was read, so a concurrent change is never cached.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + ttl, user)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        """Drop every cached token of a user."""
+        with self._lock:
+            self.generation += 1
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the cache counters."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1].pk
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+token_cache = TokenCache(
+    maxsize=settings.AUTH_TOKEN_CACHE_SIZE,
+    ttl=settings.AUTH_TOKEN_CACHE_TTL,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Expiring token authentication backed by the in-process token cache.
+
+    A cache hit skips the token and user lookup and authenticates the
+    request as a `CachedUser` snapshot, `request.auth` is the token key.
+    A miss also slides the token's expiry forward, entries never
+    outlive the token. Tokens are read from the primary database, so a
+    token works right after login even while the replicas lag.
+    """
+
+    def get_model(self):
+        from user.models import AuthToken
+        return AuthToken
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            generation = token_cache.generation
+            model = self.get_model()
+            try:
+                token = model.objects.using(DEFAULT_DB_ALIAS).select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            now = timezone.now()
+            if token.is_expired(now):
+                raise exceptions.AuthenticationFailed(_('Token has expired.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            token.refresh(now)
+            user = CachedUser.from_user(token.user)
+            token_cache.set(key, user, generation, ttl=(token.expires - now).total_seconds())
+        bind_user(user.pk)
+        return (user, key)
@@ -0,0 +1,44 @@
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS,
+    thread_name_prefix='db',
+)
+
+
+def db_sync_to_async(func):
+    """
+    Wrap a blocking database function for use in async views.
+
+    Calls run on a bounded pool of threads instead of the single
+    thread-sensitive one, so concurrent requests overlap their queries
+    while the number of connections stays capped. Connections are
+    released by the usual `CONN_MAX_AGE` rules after every call.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(wrapper, thread_sensitive=False, executor=db_executor)
+
+
+def close_db_connections(timeout=10):
+    """Close the persistent connections held by the database threads."""
+    barrier = threading.Barrier(settings.ASYNC_DB_THREADS)
+
+    def close(_):
+        connections.close_all()
+        # Keep the thread busy so every call lands on a different thread.
+        barrier.wait(timeout)
+
+    list(db_executor.map(close, range(settings.ASYNC_DB_THREADS)))
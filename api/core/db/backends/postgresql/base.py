@@ -0,0 +1,98 @@
+import time
+
+from django.db.backends.postgresql import base
+
+from core.db.pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Postgres backend with connection health checks and optional pooling.
+
+    Extra keys of the database settings:
+    - CONN_HEALTH_CHECKS: check a persistent connection is still usable
+      before its first query in a request, like Django 4.1 does.
+    - POOL_SIZE: keep up to this many connections open in an in-process
+      pool shared by all threads, 0 disables the pool. Connections go
+      back to the pool at the end of every request.
+    - POOL_TIMEOUT: seconds to wait for a free pooled connection.
+    - POOL_MAX_AGE: seconds after which a pooled connection is closed
+      instead of being reused, 0 keeps them open.
+
+    Connections reused from the pool are health checked before their
+    first query like persistent ones.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.connection_reused = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    @property
+    def pool(self):
+        size = self.settings_dict.get('POOL_SIZE', 0)
+        if not size:
+            return None
+        key = tuple(self.settings_dict[name] for name in ('NAME', 'USER', 'HOST', 'PORT'))
+        return get_pool(
+            (self.alias,) + key, size,
+            self.settings_dict.get('POOL_TIMEOUT', 10), self.settings_dict.get('POOL_MAX_AGE') or None,
+        )
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        self.connection_reused = False
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        self.connection_reused = True
+
+        def connect():
+            self.connection_reused = False
+            return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+        connection = pool.getconn(connect)
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        return connection
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = not self.connection_reused
+        if self.pool is not None:
+            # Give the connection back to the pool when the request ends.
+            self.close_at = time.monotonic()
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.putconn(self.connection, discard=self.in_atomic_block)
+
+    def close_if_unusable_or_obsolete(self):
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def _cursor(self, name=None):
+        self.ensure_connection()
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_health_check_failed(self):
+        """Replace a persistent or pooled connection which stopped working."""
+        if not self.health_check_enabled:
+            return
+        while self.connection is not None and not self.health_check_done:
+            if self.is_usable():
+                self.health_check_done = True
+            elif self.in_atomic_block:
+                # The transaction is lost, the atomic block fails on its own.
+                self.close()
+                self.health_check_done = True
+            else:
+                self.close()
+                self.ensure_connection()
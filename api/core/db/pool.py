@@ -0,0 +1,109 @@
+import collections
+import os
+import threading
+import time
+import weakref
+
+from psycopg2 import Error
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+from django.db.utils import OperationalError
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of open psycopg2 connections.
+
+    At most `max_size` connections are checked out at once, further
+    checkouts wait up to `timeout` seconds for one to be returned, which
+    applies backpressure instead of overloading postgres. Connections
+    older than `max_age` seconds are closed instead of being reused, so
+    server side state and memory do not pile up forever, None keeps them.
+    """
+
+    def __init__(self, max_size, timeout, max_age=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self._idle = collections.deque()
+        self._created = weakref.WeakKeyDictionary()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    def getconn(self, connect):
+        """Return an idle connection, or a new one made by `connect`."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError(f'Connection pool exhausted after waiting {self.timeout}s.')
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    connection = connect()
+                    self._created[connection] = time.monotonic()
+                    return connection
+                if not connection.closed and not self.expired(connection):
+                    return connection
+                connection.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, discard=False):
+        """Return a checked out connection, rolling back any open transaction."""
+        try:
+            if not discard and not connection.closed:
+                status = connection.info.transaction_status
+                if status == TRANSACTION_STATUS_UNKNOWN or self.expired(connection):
+                    discard = True
+                elif status != TRANSACTION_STATUS_IDLE:
+                    try:
+                        connection.rollback()
+                    except Error:
+                        discard = True
+            if discard or connection.closed:
+                connection.close()
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+    def expired(self, connection):
+        """Return whether a connection is older than max_age."""
+        if self.max_age is None:
+            return False
+        return time.monotonic() - self._created.get(connection, 0) >= self.max_age
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def stats(self):
+        """Return the number of idle and checked out connections."""
+        with self._lock:
+            idle = len(self._idle)
+        return {'idle': idle, 'max_size': self.max_size}
+
+
+def get_pool(key, max_size, timeout, max_age=None):
+    """Return the process wide pool for connection parameters `key`."""
+    key = (os.getpid(), key)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(max_size, timeout, max_age)
+        return pool
+
+
+def close_pools():
+    """Close the idle connections of every pool in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
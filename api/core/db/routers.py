@@ -0,0 +1,144 @@
+import contextvars
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PIN_KEY = 'db-pin:{}'
+
+LAG_SQL = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+'''
+
+
+@dataclass
+class RoutingState:
+    """Routing facts of the current request."""
+    read_replica: bool
+    user_id: object = None
+    pinned: object = None
+    wrote: bool = False
+    replica: object = None
+
+
+current_routing = contextvars.ContextVar('current_routing', default=None)
+
+
+def bind_user(user_id):
+    """Make the current request follow the primary pin of a user."""
+    state = current_routing.get()
+    if state is not None:
+        state.user_id = user_id
+
+
+def read_primary():
+    """Send the remaining reads of the current request to the primary."""
+    state = current_routing.get()
+    if state is not None:
+        state.read_replica = False
+
+
+def pin_user(user_id):
+    """Send the reads of a user to the primary for DB_REPLICA_PIN_SECONDS."""
+    cache.set(PIN_KEY.format(user_id), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+def replication_lag(connection):
+    """Return how many seconds a postgres standby is behind its primary, 0 for anything else."""
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+class PrimaryReplicaRouter:
+    """
+    Send the reads of safe requests to the replicas in DATABASE_REPLICAS.
+
+    Writes, unsafe requests, reads after a write or inside a transaction
+    and anything outside a request use the primary. A user who wrote is
+    pinned to the primary for DB_REPLICA_PIN_SECONDS, so they read their
+    own writes while the replicas catch up. Replicas are picked round
+    robin or, with DB_REPLICA_SELECTION=least_lag, by the lowest lag
+    below DB_REPLICA_MAX_LAG, once per request, so all reads of a
+    request see the same replica.
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self._lags = {}
+        self._lock = threading.Lock()
+
+    def db_for_read(self, model, **hints):
+        state = current_routing.get()
+        if state is None or not state.read_replica or state.wrote or not settings.DATABASE_REPLICAS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if state.user_id is not None:
+            if state.pinned is None:
+                state.pinned = is_pinned(state.user_id)
+            if state.pinned:
+                return None
+        if state.replica is None:
+            state.replica = self.choose_replica() or DEFAULT_DB_ALIAS
+        return state.replica if state.replica != DEFAULT_DB_ALIAS else None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db not in (None, DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS):
+            # Objects of other databases, like task shards, are written where they came from.
+            return instance._state.db
+        state = current_routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+    def choose_replica(self):
+        """Return the replica alias to read from, or None for the primary."""
+        replicas = settings.DATABASE_REPLICAS
+        if settings.DB_REPLICA_SELECTION == 'least_lag':
+            lag, alias = min((self.lag(alias), alias) for alias in replicas)
+            return alias if lag <= settings.DB_REPLICA_MAX_LAG else None
+        return replicas[next(self._counter) % len(replicas)]
+
+    def lag(self, alias):
+        """Return the lag of a replica, measured at most once per DB_REPLICA_LAG_INTERVAL."""
+        now = time.monotonic()
+        with self._lock:
+            checked = self._lags.get(alias)
+            if checked is not None and now - checked[0] < settings.DB_REPLICA_LAG_INTERVAL:
+                return checked[1]
+            # Other threads keep using the previous value while this one measures.
+            self._lags[alias] = (now, checked[1] if checked is not None else 0.0)
+        try:
+            lag = replication_lag(connections[alias])
+        except DatabaseError:
+            lag = float('inf')
+        with self._lock:
+            self._lags[alias] = (now, lag)
+        return lag
@@ -0,0 +1,29 @@
+from rest_framework import exceptions, status
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from .hashers import PasswordHashingUnavailable
+
+
+class ServiceUnavailable(exceptions.APIException):
+    """The server is too busy to answer, the client should retry later."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service temporarily unavailable, try again later.'
+    default_code = 'service_unavailable'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # Rendered as a Retry-After header by the DRF exception handler.
+        self.wait = wait
+
+
+class PasswordHashingServiceUnavailable(ServiceUnavailable):
+    """Every password hashing worker is busy."""
+    default_detail = 'Too many logins in progress, try again later.'
+    default_code = 'password_hashing_unavailable'
+
+
+def exception_handler(exc, context):
+    """DRF exception handler answering a full password hashing pool with 503."""
+    if isinstance(exc, PasswordHashingUnavailable):
+        exc = PasswordHashingServiceUnavailable(exc.wait)
+    return drf_exception_handler(exc, context)
@@ -0,0 +1,118 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PasswordHashingUnavailable(Exception):
+    """Raised when the hashing pool has no room for another password."""
+
+    def __init__(self, wait):
+        super().__init__(f'Password hashing pool is full, retry after {wait}s.')
+        # Seconds clients are asked to wait, see core/exceptions.py.
+        self.wait = wait
+
+
+class HashingPool:
+    """
+    Bounded pool of threads computing password hashes.
+
+    The calling thread waits for its hash, the pool bounds how many
+    hashes a process computes at once: at most `workers` run and `queue`
+    more wait for a thread, further calls fail fast with
+    `PasswordHashingUnavailable` instead of piling up slow requests on
+    every worker. hashlib and argon2-cffi release the GIL, so a burst of
+    logins takes at most `workers` cores from the other requests. With
+    no workers hashes run inline on the calling thread, unbounded.
+    """
+
+    def __init__(self, workers, queue, retry_after):
+        self.workers = workers
+        self.queue = queue
+        self.retry_after = retry_after
+        self.completed = 0
+        self.rejected = 0
+        self._executor = None
+        if workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def run(self, func, *args, **kwargs):
+        """Call func on a pool thread and return its result."""
+        # Hashers call each other, e.g. PBKDF2 verifies by encoding, those
+        # calls stay on the thread that is already hashing.
+        if self._executor is None or getattr(self._local, 'inside', False):
+            return func(*args, **kwargs)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingUnavailable(self.retry_after)
+        try:
+            result = self._executor.submit(self._call, func, args, kwargs).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self):
+        """Return the pool counters."""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue': self.queue,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        """Stop the pool threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _call(self, func, args, kwargs):
+        self._local.inside = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._local.inside = False
+
+
+hashing_pool = HashingPool(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue=settings.PASSWORD_HASH_QUEUE,
+    retry_after=settings.PASSWORD_HASH_RETRY_AFTER,
+)
+
+
+class PooledHasherMixin:
+    """
+    Compute a hasher's hashes on the hashing pool.
+
+    The algorithm name is unchanged, so existing hashes stay valid and
+    `check_password` keeps upgrading outdated ones on login.
+    """
+
+    def encode(self, password, salt, *args, **kwargs):
+        return hashing_pool.run(super().encode, password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return hashing_pool.run(super().verify, password, encoded)
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    """PBKDF2 SHA256 hasher running on the hashing pool."""
+
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    """Argon2id hasher running on the hashing pool with configurable cost."""
+    time_cost = settings.ARGON2_TIME_COST
+    memory_cost = settings.ARGON2_MEMORY_COST
+    parallelism = settings.ARGON2_PARALLELISM
+
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    """Scrypt hasher running on the hashing pool."""
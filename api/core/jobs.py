@@ -0,0 +1,258 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+# Takes the oldest due jobs nobody else is taking, queued ones and
+# running ones whose lease ran out, and starts their next attempt.
+CLAIM_SQL = """
+UPDATE {table} SET status = 'running', attempts = attempts + 1, run_at = %s, started = %s, worker = %s
+WHERE id IN (
+    SELECT id FROM {table}
+    WHERE status IN ('queued', 'running') AND run_at <= %s
+    ORDER BY run_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING *
+"""
+
+def job(name, max_attempts=None):
+    """Register a function taking a `Job` as the job `name`, its return value is stored as the result."""
+    def decorator(func):
+        registry[name] = (func, max_attempts)
+        return func
+    return decorator
+
+def enqueue(name, payload=None, user_id=None, delay=0, max_attempts=None):
+    """
+    Queue the job `name`, for the user `user_id` if given, and return it.
+
+    The job is written in the current transaction, so it only runs if
+    the changes it was queued with are committed.
+    """
+    if name not in registry:
+        raise ValueError(f'Unknown job {name!r}.')
+    max_attempts = max_attempts or registry[name][1] or settings.JOB_MAX_ATTEMPTS
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        user_id=user_id,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+def retry_delay(attempts):
+    """Return the seconds to wait before retrying a job which failed `attempts` times."""
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+
+def claim_jobs(worker, limit=1, now=None):
+    """Lease up to `limit` due jobs to a worker for JOB_TIMEOUT seconds and return them."""
+    now = now or timezone.now()
+    lease = now + timedelta(seconds=settings.JOB_TIMEOUT)
+    sql = CLAIM_SQL.format(table=Job._meta.db_table)
+    jobs = Job.objects.raw(sql, [lease, now, worker, now, limit], using=router.db_for_write(Job))
+    return sorted(jobs, key=lambda job: job.pk)
+
+@contextmanager
+def keep_lease(job):
+    """
+    Extend the lease of a claimed job every JOB_HEARTBEAT seconds while the block runs.
+
+    The lease only runs out when the worker stops renewing it, so long
+    jobs are not taken over while they still run. Renewals stop once
+    another worker took the job over.
+    """
+    done = threading.Event()
+    attempt = Job.objects.filter(pk=job.pk, attempts=job.attempts, status=Job.Status.RUNNING)
+
+    def renew():
+        try:
+            while not done.wait(settings.JOB_HEARTBEAT):
+                lease = timezone.now() + timedelta(seconds=settings.JOB_TIMEOUT)
+                if not attempt.update(run_at=lease):
+                    logger.warning('Job %s lost its lease.', job)
+                    return
+        except DatabaseError:
+            logger.exception('Job %s could not renew its lease.', job)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=renew, name=f'job-lease-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+def run_job(job):
+    """
+    Run a claimed job and record its outcome.
+
+    Its lease is renewed while it runs, see `keep_lease`. Failed attempts are retried after an exponential backoff until
+    `max_attempts` is reached. Outcomes are only written while the job
+    is still on the attempt it was claimed for, a worker whose lease
+    ran out does not overwrite the attempt which took over.
+    """
+    attempt = Job.objects.filter(pk=job.pk, attempts=job.attempts)
+    func = registry.get(job.name, (None, None))[0]
+    if func is None or job.attempts > job.max_attempts:
+        # Unknown jobs and jobs whose last lease ran out are not retried.
+        error = f'Unknown job {job.name!r}.' if func is None else 'Lease expired on the last attempt.'
+        attempt.update(status=Job.Status.FAILED, finished=timezone.now(), error=error)
+        logger.error('Job %s failed: %s', job, error)
+        return False
+
+    try:
+        with keep_lease(job):
+            result = func(job)
+    except Exception:
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            run_at = now + timedelta(seconds=retry_delay(job.attempts))
+            attempt.update(status=Job.Status.QUEUED, run_at=run_at, worker='', error=error)
+            logger.warning('Job %s failed on attempt %s, retrying at %s.', job, job.attempts, run_at, exc_info=True)
+        else:
+            attempt.update(status=Job.Status.FAILED, finished=now, error=error)
+            logger.exception('Job %s failed on its last attempt.', job)
+        return False
+
+    attempt.update(status=Job.Status.SUCCEEDED, finished=timezone.now(), result=result, error='')
+    return True
+
+def release_connections():
+    """Close the broken connections and the ones past CONN_MAX_AGE, leaving those in a transaction alone."""
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+@contextmanager
+def handle_signals(handler):
+    """Call `handler` on SIGINT and SIGTERM, restoring the previous handlers afterwards."""
+    previous = {signum: signal.signal(signum, handler) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+class Worker:
+    """
+    Run jobs on `threads` threads until stopped.
+
+    Every thread claims one job at a time and sleeps `poll_interval`
+    seconds when none is due. With `burst` the threads return as soon
+    as no job is due instead. Stopping lets the running jobs finish.
+    """
+
+    def __init__(self, threads=1, poll_interval=1, burst=False, name=None):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Run jobs until stopped, on the calling thread when there is only one."""
+        if self.threads == 1:
+            self.work(self.name)
+            return
+        threads = [
+            threading.Thread(target=self.work, args=(f'{self.name}:{n}',), name=f'job-worker-{n}')
+            for n in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        """Stop claiming jobs."""
+        self.stopping.set()
+
+    def work(self, name):
+        try:
+            while not self.stopping.is_set():
+                release_connections()
+                try:
+                    jobs = claim_jobs(name)
+                    for job in jobs:
+                        run_job(job)
+                except DatabaseError:
+                    # Unrecorded jobs are taken over once their lease ends.
+                    logger.exception('Worker %s lost its database connection.', name)
+                    jobs = []
+                if jobs:
+                    continue
+                if self.burst:
+                    break
+                self.stopping.wait(self.poll_interval)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+def run_worker(threads=1, poll_interval=1, burst=False):
+    """Run a worker in this process until SIGINT or SIGTERM."""
+    worker = Worker(threads=threads, poll_interval=poll_interval, burst=burst)
+    with handle_signals(lambda signum, frame: worker.stop()):
+        worker.run()
+
+def run_workers(processes=1, threads=1, poll_interval=1, burst=False):
+    """
+    Run workers in `processes` forked processes with `threads` threads each.
+
+    SIGINT and SIGTERM are passed on to the workers, which finish their
+    running jobs and exit. Workers exiting with an error are restarted.
+    """
+    if processes == 1:
+        run_worker(threads, poll_interval, burst)
+        return
+
+    # Forked children must not share the parent's connections.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    stopping = threading.Event()
+
+    def start():
+        process = context.Process(target=run_worker, args=(threads, poll_interval, burst))
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        stopping.set()
+        for process in children:
+            if process.is_alive():
+                process.terminate()
+
+    children = [start() for _ in range(processes)]
+    with handle_signals(stop):
+        while children:
+            multiprocessing.connection.wait([process.sentinel for process in children])
+            running = []
+            for process in children:
+                if process.is_alive():
+                    running.append(process)
+                    continue
+                process.join()
+                if process.exitcode and not stopping.is_set() and not burst:
+                    logger.warning('Worker process %s exited with %s, restarting it.', process.pid, process.exitcode)
+                    running.append(start())
+            children[:] = running
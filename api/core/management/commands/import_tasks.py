@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from task.imports import READERS, TaskImportCommitError, TaskImportError, TaskImporter
+
+class Command(BaseCommand):
+    """Django command to import tasks from a file."""
+    help = (
+        'Import tasks from a csv or NDJSON file. Rows have title, description, is_completed '
+        'and created fields and name their owner by username or email.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - reads stdin.')
+        parser.add_argument('--format', choices=sorted(READERS), help='Input format, by default the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows validated and written at once.')
+        parser.add_argument('--method', choices=['copy', 'bulk_create'], help='Write method, copy on postgres.')
+        parser.add_argument('--skip-invalid', action='store_true', help='Skip invalid rows instead of aborting.')
+        parser.add_argument('--database', default='default', help='Database to import into.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        path = options['path']
+        input_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if input_format not in READERS:
+            raise CommandError('Can not tell the input format, use --format.')
+
+        importer = TaskImporter(
+            using=options['database'],
+            chunk_size=options['chunk_size'],
+            method=options['method'],
+            skip_invalid=options['skip_invalid'],
+            progress=self.report_progress,
+        )
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = importer.run(READERS[input_format](stream))
+        except TaskImportError as e:
+            raise CommandError(f'Import aborted, nothing was imported: {e}')
+        except TaskImportCommitError as e:
+            raise CommandError(
+                f'Import failed, only the tasks of the shards that committed were imported: {e}'
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in result['errors']:
+            self.stderr.write(f'Skipped {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result["imported"]} tasks, skipped {result["skipped"]} rows '
+            f'in {result["seconds"]}s ({result["rows_per_second"]} rows/s).'
+        ))
+
+    def report_progress(self, imported, skipped, seconds):
+        rate = imported / seconds if seconds else 0
+        self.stderr.write(f'{imported} tasks imported, {skipped} skipped, {rate:.0f} rows/s')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import run_workers
+
+class Command(BaseCommand):
+    """Django command to run background jobs."""
+    help = (
+        'Run queued background jobs on a pool of processes and threads until stopped with SIGINT or SIGTERM, '
+        'running jobs are finished first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to fork.')
+        parser.add_argument('--threads', type=int, default=1, help='Jobs run at once by every process.')
+        parser.add_argument('--poll-interval', type=float, default=1, help='Seconds to wait when no job is due.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        if options['processes'] < 1 or options['threads'] < 1:
+            raise CommandError('--processes and --threads must be at least 1.')
+        self.stdout.write(f'Running jobs on {options["processes"]} processes with {options["threads"]} threads each.')
+        run_workers(
+            processes=options['processes'],
+            threads=options['threads'],
+            poll_interval=options['poll_interval'],
+            burst=options['burst'],
+        )
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
@@ -0,0 +1,157 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from .authentication import token_cache
+from .hashers import hashing_pool
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current_query_stats = contextvars.ContextVar('current_query_stats', default=None)
+
+
+class QueryStats:
+    """Number and duration of the SQL queries of one request."""
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper adding the query to the stats of the current request.
+
+    The stats travel in a context variable, so queries run by async views
+    on other threads are counted for the request that started them.
+    """
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    """Add the query recorder to a database connection once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Per-view request metrics rendered in the Prometheus text format.
+
+    Every process keeps its own metrics, like the token cache, so each
+    worker has to be scraped or aggregated separately.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._requests = {}
+        self._durations = {}
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, status, duration, query_stats):
+        """Record a finished request."""
+        with self._lock:
+            key = (view, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            histogram = self._durations.get(view)
+            if histogram is None:
+                histogram = self._durations[view] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(self.buckets, duration)] += 1
+            histogram[-1] += duration
+
+            queries = self._queries.setdefault(view, [0, 0.0])
+            queries[0] += query_stats.count
+            queries[1] += query_stats.duration
+
+    def clear(self):
+        """Drop every recorded request."""
+        with self._lock:
+            self._requests.clear()
+            self._durations.clear()
+            self._queries.clear()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            durations = sorted((view, list(values)) for view, values in self._durations.items())
+            queries = sorted((view, list(values)) for view, values in self._queries.items())
+
+        lines = [
+            '# HELP http_requests_total Requests handled, by view, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (view, method, status), count in requests:
+            lines.append(
+                f'http_requests_total{{view="{escape_label(view)}",method="{method}",status="{status}"}} {count}'
+            )
+
+        lines += [
+            '# HELP http_request_duration_seconds Request latency, by view.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for view, histogram in durations:
+            label = escape_label(view)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{view="{label}"}} {histogram[-1]}')
+            lines.append(f'http_request_duration_seconds_count{{view="{label}"}} {cumulative}')
+
+        lines += [
+            '# HELP db_queries_total SQL queries executed, by view.',
+            '# TYPE db_queries_total counter',
+        ]
+        lines += [f'db_queries_total{{view="{escape_label(view)}"}} {count}' for view, (count, _) in queries]
+        lines += [
+            '# HELP db_query_duration_seconds_total Time spent executing SQL queries, by view.',
+            '# TYPE db_query_duration_seconds_total counter',
+        ]
+        lines += [
+            f'db_query_duration_seconds_total{{view="{escape_label(view)}"}} {seconds}'
+            for view, (_, seconds) in queries
+        ]
+
+        cache_stats = token_cache.stats()
+        lines += [
+            '# HELP auth_token_cache_hits_total Token lookups answered from the cache.',
+            '# TYPE auth_token_cache_hits_total counter',
+            f'auth_token_cache_hits_total {cache_stats["hits"]}',
+            '# HELP auth_token_cache_misses_total Token lookups that missed the cache.',
+            '# TYPE auth_token_cache_misses_total counter',
+            f'auth_token_cache_misses_total {cache_stats["misses"]}',
+            '# HELP auth_token_cache_size Tokens in the cache.',
+            '# TYPE auth_token_cache_size gauge',
+            f'auth_token_cache_size {cache_stats["size"]}',
+        ]
+
+        pool_stats = hashing_pool.stats()
+        lines += [
+            '# HELP password_hashes_total Password hashes computed on the hashing pool.',
+            '# TYPE password_hashes_total counter',
+            f'password_hashes_total {pool_stats["completed"]}',
+            '# HELP password_hashes_rejected_total Password hashes rejected because the hashing pool was full.',
+            '# TYPE password_hashes_rejected_total counter',
+            f'password_hashes_rejected_total {pool_stats["rejected"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
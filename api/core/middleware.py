@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from .db.routers import RoutingState, current_routing, pin_user
+from .hashers import PasswordHashingUnavailable
+from .metrics import QueryStats, current_query_stats, install_query_recorder, metrics
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class MetricsMiddleware:
+    """
+    Record the latency and SQL queries of every request per view.
+
+    The totals are added to the process metrics served at `/metrics` and
+    returned to the client in a `Server-Timing` header. The middleware
+    removes itself when `METRICS_ENABLED` is off, so disabled metrics
+    cost nothing.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function like Django's own middleware.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        connection_created.connect(install_query_recorder, dispatch_uid='core.metrics')
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.process_metrics(request, response, time.perf_counter() - start, stats)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_stats.reset(token)
+        return self.process_metrics(request, response, time.perf_counter() - start, stats)
+
+    def process_metrics(self, request, response, duration, stats):
+        """Record the request and add the Server-Timing header."""
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        metrics.observe(view, request.method, response.status_code, duration, stats)
+        response['Server-Timing'] = (
+            f'db;dur={stats.duration * 1000:.3f};desc="{stats.count} queries", '
+            f'total;dur={duration * 1000:.3f}'
+        )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Give the database router the routing state of every request.
+
+    Reads of safe requests may go to a replica, a request that wrote
+    pins its user to the primary afterwards. The middleware removes
+    itself when no DATABASE_REPLICAS are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function like Django's own middleware.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState(read_replica=request.method in SAFE_METHODS)
+        token = current_routing.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            current_routing.reset(token)
+            self.pin(state)
+
+    async def __acall__(self, request):
+        state = RoutingState(read_replica=request.method in SAFE_METHODS)
+        token = current_routing.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+            self.pin(state)
+
+    def pin(self, state):
+        """Pin the user of a request that wrote to the primary."""
+        if state.wrote and not state.read_replica and state.user_id is not None:
+            pin_user(state.user_id)
+
+
+class PasswordHashingUnavailableMiddleware(MiddlewareMixin):
+    """
+    Answer 503 with a Retry-After header when the password hashing pool is full.
+
+    DRF views answer it in core.exceptions.exception_handler, this covers
+    the Django views, e.g. the admin login.
+    """
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, PasswordHashingUnavailable):
+            return None
+        response = HttpResponse('Too many logins in progress, try again later.', status=503, content_type='text/plain')
+        response['Retry-After'] = str(exception.wait)
+        return response
@@ -0,0 +1,74 @@
+from rest_framework import serializers
+
+from .models import Job
+
+PASSTHROUGH_FIELDS = (serializers.BooleanField, serializers.CharField, serializers.IntegerField)
+
+
+class ValuesRepresentation:
+    """
+    Precompiled field plan rendering `.values()` rows like a serializer.
+
+    Builds the same dicts as `serializer_class(instance).data` for flat
+    model serializers without instantiating models or walking the
+    serializer fields per object. Fields whose database value already is
+    the representation are copied as is, the others go through the
+    serializer field's `to_representation`.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._fields = None
+        self._converters = None
+
+    @property
+    def fields(self):
+        """Return the names of the rendered fields in serializer order."""
+        if self._fields is None:
+            self._compile()
+        return self._fields
+
+    def to_representation(self, row):
+        """Return the representation of a single `.values()` row."""
+        if self._fields is None:
+            self._compile()
+        data = {name: row[name] for name in self._fields}
+        for name, convert in self._converters:
+            value = data[name]
+            if value is not None:
+                data[name] = convert(value)
+        return data
+
+    def to_representation_many(self, rows):
+        """Return the representations of many `.values()` rows."""
+        return [self.to_representation(row) for row in rows]
+
+    def _compile(self):
+        fields = [
+            (name, field)
+            for name, field in self.serializer_class().fields.items()
+            if not field.write_only
+        ]
+        for name, field in fields:
+            if field.source != name:
+                raise ValueError(f'Field {name!r} of {self.serializer_class.__name__} has a custom source.')
+        self._converters = [
+            (name, field.to_representation)
+            for name, field in fields
+            if not isinstance(field, PASSTHROUGH_FIELDS)
+        ]
+        self._fields = [name for name, _ in fields]
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for background job status."""
+    error = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'status', 'attempts', 'max_attempts', 'result', 'error', 'created', 'started', 'finished']
+        read_only_fields = fields
+
+    def get_error(self, job) -> str:
+        """Return the exception line of the last failure, without its traceback."""
+        lines = job.error.strip().splitlines()
+        return lines[-1] if lines else ''
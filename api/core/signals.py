@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from user.models import AuthToken
+
+from .authentication import token_cache
+
+
+@receiver(post_save, sender=AuthToken)
+@receiver(post_delete, sender=AuthToken)
+def invalidate_token_cache_for_token(sender, instance, **kwargs):
+    """Drop cached credentials when a token is rotated or deleted."""
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_token_cache_for_user(sender, instance, **kwargs):
+    """Drop cached credentials when a user changes or is deleted."""
+    token_cache.invalidate_user(instance.pk)
@@ -0,0 +1,1045 @@
+import datetime
+import decimal
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zoneinfo
+from unittest import mock
+
+import psycopg2
+from asgiref.sync import async_to_sync
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.utils import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.exceptions import ParseError, Throttled
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from task.async_views import authenticate_and_throttle
+from task.models import Task, TaskCounter
+from task.versions import get_task_version
+from user.models import AuthToken
+from user.serializers import UserSerializer
+
+from . import jobs
+from .authentication import CachedUser, TokenCache, token_cache
+from .concurrency import close_db_connections
+from .db.pool import ConnectionPool, close_pools
+from .db.routers import PrimaryReplicaRouter, RoutingState, bind_user, current_routing, is_pinned, read_primary
+from .hashers import HashingPool, PasswordHashingUnavailable
+from .metrics import metrics
+from .models import Job
+from .middleware import ReplicaRoutingMiddleware
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .throttling import TokenBucket, get_rate
+
+TASKS_URL = reverse('task:task-list')
+PROFILE_URL = reverse('user:profile')
+ASYNC_TASKS_URL = reverse('task:async-task-list')
+CREATE_USER_URL = reverse('user:create')
+METRICS_URL = reverse('metrics')
+JOBS_URL = reverse('core:job-list')
+
+def create_user(username='testusername', email='test@example.com', password='testpass123'):
+    """Create and return a user."""
+    return get_user_model().objects.create_user(username=username, email=email, password=password)
+
+def job_detail(job_id):
+    """Create and return a job detail url."""
+    return reverse('core:job-detail', args=[job_id])
+
+@jobs.job('test.echo')
+def echo_job(job):
+    """Return the payload of the job."""
+    return job.payload
+
+@jobs.job('test.sleep')
+def sleep_job(job):
+    """Sleep for the seconds of the payload."""
+    time.sleep(job.payload['seconds'])
+
+@jobs.job('test.fail', max_attempts=3)
+def fail_job(job):
+    """Fail every attempt."""
+    raise RuntimeError(f'attempt {job.attempts} failed')
+
+class TokenCacheTests(TestCase):
+    """Test the token cache."""
+
+    def test_get_counts_hits_and_misses(self):
+        """Test lookups update the hit and miss counters."""
+        cache = TokenCache(maxsize=10, ttl=60)
+        cache.set('key', CachedUser(1, 'user', 'user@example.com'), cache.generation)
+
+        self.assertIsNotNone(cache.get('key'))
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10})
+
+    def test_least_recently_used_entry_evicted(self):
+        """Test the least recently used entry is evicted when the cache is full."""
+        cache = TokenCache(maxsize=2, ttl=60)
+        for key, pk in [('a', 1), ('b', 2)]:
+            cache.set(key, CachedUser(pk, key, f'{key}@example.com'), cache.generation)
+        cache.get('a')
+        cache.set('c', CachedUser(3, 'c', 'c@example.com'), cache.generation)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_expired_entry_dropped(self):
+        """Test entries older than the ttl are not returned."""
+        cache = TokenCache(maxsize=10, ttl=0)
+        cache.set('key', CachedUser(1, 'user', 'user@example.com'), cache.generation)
+
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_set_skipped_after_invalidation(self):
+        """Test a lookup started before an invalidation is not cached."""
+        cache = TokenCache(maxsize=10, ttl=60)
+        generation = cache.generation
+        cache.invalidate_user(1)
+        cache.set('key', CachedUser(1, 'user', 'user@example.com'), generation)
+
+        self.assertIsNone(cache.get('key'))
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test authenticating with cached tokens."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = create_user()
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_second_request_served_from_cache(self):
+        """Test the token lookup is cached between requests."""
+        self.client.get(TASKS_URL)
+        # The task version and the page, no token lookup.
+        with self.assertNumQueries(2):
+            response = self.client.get(TASKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token is no longer accepted."""
+        self.client.get(TASKS_URL)
+        self.token.delete()
+        response = self.client.get(TASKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        """Test a deactivated user is no longer authenticated."""
+        self.client.get(TASKS_URL)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(TASKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_cache(self):
+        """Test changing the password through the serializer drops cached tokens."""
+        self.client.get(TASKS_URL)
+        serializer = UserSerializer(self.user, data={'password': 'newpassword123'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_profile_update_with_cached_user(self):
+        """Test the profile can be updated when authenticated from the cache."""
+        self.client.get(PROFILE_URL)
+        response = self.client.patch(PROFILE_URL, {'username': 'updatedusername'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.username, 'updatedusername')
+
+class FastJSONTests(TestCase):
+    """Test the fast json renderer and parser."""
+
+    data = {
+        'id': 1,
+        'title': 'zażółć \u2028 "quoted"',
+        'created': datetime.datetime(2022, 8, 8, 14, 2, 1, 123456, tzinfo=timezone.utc),
+        'due': datetime.date(2022, 8, 9),
+        'amount': decimal.Decimal('1.5'),
+        'items': [None, True, 1.25],
+    }
+
+    def test_render_matches_json_renderer(self):
+        """Test the fast renderer output is identical to the stdlib renderer."""
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_render_floats_equivalent(self):
+        """Test floats spelled differently than by the stdlib renderer parse to the same values."""
+        data = [1e16, 1.5e-7]
+
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_render_datetimes_match_json_renderer(self):
+        """Test datetimes are formatted like the stdlib renderer does, whatever their offset."""
+        data = [
+            datetime.datetime(2022, 8, 8, 14, 2, 1, 500, tzinfo=zoneinfo.ZoneInfo('Europe/Warsaw')),
+            datetime.datetime(2022, 8, 8, 14, 2, 1, tzinfo=datetime.timezone(datetime.timedelta(seconds=3601))),
+            datetime.datetime(2022, 8, 8, 14, 2, 1, 123),
+            datetime.time(14, 2, 1, 123456),
+        ]
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_render_indented_falls_back(self):
+        """Test indented output is rendered by the stdlib renderer."""
+        media_type = 'application/json; indent=4'
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, media_type),
+            JSONRenderer().render(self.data, media_type),
+        )
+
+    def test_render_without_orjson(self):
+        """Test the renderer falls back to the stdlib when orjson is missing."""
+        with mock.patch('core.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_parse_matches_json_parser(self):
+        """Test the fast parser returns the same data as the stdlib parser."""
+        body = '{"title": "zażółć", "is_completed": true, "items": [1, 2.5, null]}'.encode()
+
+        self.assertEqual(
+            FastJSONParser().parse(io.BytesIO(body)),
+            JSONParser().parse(io.BytesIO(body)),
+        )
+
+    def test_parse_invalid_json(self):
+        """Test malformed json raises a parse error."""
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"title": '))
+
+class FakeConnection:
+    """Stand-in for a psycopg2 connection."""
+
+    def __init__(self, transaction_status=0):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=transaction_status)
+        self.rollback = mock.Mock()
+
+    def close(self):
+        self.closed = 1
+
+class ConnectionPoolTests(TestCase):
+    """Test the connection pool."""
+
+    def test_returned_connection_reused(self):
+        """Test a returned connection is handed out again."""
+        pool = ConnectionPool(max_size=2, timeout=0)
+        conn = pool.getconn(FakeConnection)
+        pool.putconn(conn)
+
+        self.assertIs(pool.getconn(FakeConnection), conn)
+
+    def test_exhausted_pool_raises(self):
+        """Test checking out more than max_size connections fails after the timeout."""
+        pool = ConnectionPool(max_size=1, timeout=0)
+        pool.getconn(FakeConnection)
+
+        with self.assertRaises(OperationalError):
+            pool.getconn(FakeConnection)
+
+    def test_open_transaction_rolled_back(self):
+        """Test a connection returned inside a transaction is rolled back."""
+        pool = ConnectionPool(max_size=1, timeout=0)
+        conn = pool.getconn(lambda: FakeConnection(transaction_status=2))
+        pool.putconn(conn)
+
+        conn.rollback.assert_called_once()
+        self.assertFalse(conn.closed)
+
+    def test_discarded_connection_closed(self):
+        """Test discarded and closed connections are not reused."""
+        pool = ConnectionPool(max_size=1, timeout=0)
+        conn = pool.getconn(FakeConnection)
+        pool.putconn(conn, discard=True)
+
+        self.assertTrue(conn.closed)
+        self.assertIsNot(pool.getconn(FakeConnection), conn)
+
+    def test_expired_connection_closed(self):
+        """Test connections older than max_age are closed instead of reused."""
+        pool = ConnectionPool(max_size=2, timeout=0, max_age=60)
+        with mock.patch('core.db.pool.time.monotonic', return_value=100):
+            old = pool.getconn(FakeConnection)
+        with mock.patch('core.db.pool.time.monotonic', return_value=150):
+            young = pool.getconn(FakeConnection)
+            pool.putconn(young)
+        with mock.patch('core.db.pool.time.monotonic', return_value=170):
+            pool.putconn(old)
+            self.assertTrue(old.closed)
+            self.assertIs(pool.getconn(FakeConnection), young)
+        with mock.patch('core.db.pool.time.monotonic', return_value=210):
+            pool.putconn(young)
+            self.assertIsNot(pool.getconn(FakeConnection), young)
+        self.assertTrue(young.closed)
+
+def occupy(pool):
+    """Block a hash on the pool until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    thread = threading.Thread(target=pool.run, args=(lambda: started.set() or release.wait(10),))
+    thread.start()
+    started.wait(10)
+    return release, thread
+
+class HashingPoolTests(TestCase):
+    """Test the password hashing pool."""
+
+    def test_runs_on_pool_thread(self):
+        """Test functions run on a pool thread and return their result."""
+        pool = HashingPool(workers=1, queue=0, retry_after=1)
+        self.addCleanup(pool.shutdown)
+
+        self.assertTrue(pool.run(lambda: threading.current_thread().name).startswith('hash'))
+        self.assertEqual(pool.stats()['completed'], 1)
+
+    def test_no_workers_runs_inline(self):
+        """Test a pool without workers runs functions on the calling thread."""
+        pool = HashingPool(workers=0, queue=0, retry_after=1)
+
+        self.assertEqual(pool.run(threading.get_ident), threading.get_ident())
+
+    def test_full_pool_rejects(self):
+        """Test calls beyond the workers and queue fail with a retry delay."""
+        pool = HashingPool(workers=1, queue=0, retry_after=7)
+        self.addCleanup(pool.shutdown)
+        release, thread = occupy(pool)
+
+        with self.assertRaises(PasswordHashingUnavailable) as cm:
+            pool.run(lambda: None)
+        release.set()
+        thread.join()
+
+        self.assertEqual(cm.exception.wait, 7)
+        self.assertEqual(pool.stats()['rejected'], 1)
+        self.assertIsNone(pool.run(lambda: None))
+
+    def test_failed_hash_not_completed(self):
+        """Test a hash raising is passed on and not counted as completed."""
+        pool = HashingPool(workers=1, queue=0, retry_after=1)
+        self.addCleanup(pool.shutdown)
+
+        with self.assertRaises(ZeroDivisionError):
+            pool.run(lambda: 1 / 0)
+
+        self.assertEqual(pool.stats()['completed'], 0)
+        self.assertIsNone(pool.run(lambda: None))
+
+    def test_admin_login_busy_pool(self):
+        """Test the admin login answers 503 with a retry delay while the pool is full."""
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'adminpass123')
+
+        with mock.patch('core.hashers.hashing_pool.run', side_effect=PasswordHashingUnavailable(3)):
+            response = self.client.post(
+                reverse('admin:login'), {'username': 'admin', 'password': 'adminpass123'},
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_nested_calls_run_inline(self):
+        """Test a hash calling the pool again does not wait for a free thread."""
+        pool = HashingPool(workers=1, queue=0, retry_after=1)
+        self.addCleanup(pool.shutdown)
+
+        self.assertEqual(pool.run(lambda: pool.run(lambda: 'done')), 'done')
+
+def throttle_rates(**rates):
+    """Override the throttle rates, scopes are given with `__` for dots."""
+    rates = {scope.replace('__', '.'): rate for scope, rate in rates.items()}
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+class TokenBucketTests(TestCase):
+    """Test the cache backed token bucket."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.bucket = TokenBucket(capacity=3, period=30)
+
+    def test_burst_then_throttled(self):
+        """Test a full bucket allows `capacity` requests and then returns the wait."""
+        waits = [self.bucket.take('key', now=1000) for _ in range(4)]
+
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertEqual(waits[3], 10)
+
+    def test_refills_over_time(self):
+        """Test tokens come back at `capacity / period` per second."""
+        for _ in range(3):
+            self.bucket.take('key', now=1000)
+
+        self.assertEqual(self.bucket.take('key', now=1010), 0)
+        self.assertGreater(self.bucket.take('key', now=1010), 0)
+
+    def test_idle_bucket_refills_to_capacity(self):
+        """Test an idle client gets a full burst, not the tokens of the idle time."""
+        self.bucket.take('key', now=1000)
+        waits = [self.bucket.take('key', now=5000) for _ in range(4)]
+
+        self.assertEqual(waits, [0, 0, 0, 10])
+
+    def test_throttled_requests_take_no_token(self):
+        """Test rejected requests do not push the next token further out."""
+        for _ in range(3):
+            self.bucket.take('key', now=1000)
+        for _ in range(5):
+            self.bucket.take('key', now=1000)
+
+        self.assertEqual(self.bucket.take('key', now=1010), 0)
+
+    def test_keys_independent(self):
+        """Test buckets of different keys do not share tokens."""
+        for _ in range(3):
+            self.bucket.take('a', now=1000)
+
+        self.assertEqual(self.bucket.take('b', now=1000), 0)
+
+    @throttle_rates(task='5/min', task__list='2/min')
+    def test_action_rate_precedes_scope_rate(self):
+        """Test `scope.action` rates override the scope's rate."""
+        self.assertEqual(get_rate('task', 'list'), ('task.list', 2, 60))
+        self.assertEqual(get_rate('task', 'retrieve'), ('task', 5, 60))
+        self.assertIsNone(get_rate('other', 'list'))
+        self.assertIsNone(get_rate(None, 'list'))
+
+class ThrottleTests(TestCase):
+    """Test rate limiting the api."""
+
+    def setUp(self):
+        caches['default'].clear()
+        token_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.key = AuthToken.objects.create(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    @throttle_rates(task='10/min', task__list='2/min')
+    def test_throttled_with_retry_after(self):
+        """Test requests over the rate get a 429 with a Retry-After header."""
+        statuses = [self.client.get(TASKS_URL).status_code for _ in range(3)]
+        response = self.client.get(TASKS_URL)
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+    @throttle_rates(task='10/min', task__list='1/min')
+    def test_actions_limited_separately(self):
+        """Test an exhausted list limit leaves other actions available."""
+        self.client.get(TASKS_URL)
+        self.assertEqual(self.client.get(TASKS_URL).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self.client.post(TASKS_URL, {'title': 'task'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @throttle_rates(task__list='1/min')
+    def test_users_limited_separately(self):
+        """Test one user exhausting the limit does not throttle another."""
+        self.client.get(TASKS_URL)
+        other = create_user(username='other', email='other@example.com')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.create(user=other).key}')
+
+        self.assertEqual(client.get(TASKS_URL).status_code, status.HTTP_200_OK)
+
+    @throttle_rates(user__create='1/hour')
+    def test_anonymous_limited_per_ip(self):
+        """Test signups are limited per client IP."""
+        client = APIClient()
+        payload = {'username': 'new', 'email': 'new@example.com', 'password': 'testpass123'}
+        client.post(CREATE_USER_URL, payload, REMOTE_ADDR='10.0.0.1')
+        payload = {'username': 'new2', 'email': 'new2@example.com', 'password': 'testpass123'}
+
+        self.assertEqual(
+            client.post(CREATE_USER_URL, payload, REMOTE_ADDR='10.0.0.1').status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+        self.assertEqual(
+            client.post(CREATE_USER_URL, payload, REMOTE_ADDR='10.0.0.2').status_code,
+            status.HTTP_201_CREATED,
+        )
+
+    @throttle_rates(task__list='1/min')
+    def test_async_views_share_limits(self):
+        """Test the async task list takes from the list limit."""
+        self.client.get(TASKS_URL)
+        request = RequestFactory().get(ASYNC_TASKS_URL, HTTP_AUTHORIZATION=f'Token {self.key}')
+
+        with self.assertRaises(Throttled):
+            authenticate_and_throttle(request, 'task', 'list')
+
+    @override_settings(THROTTLE_ENABLED=False)
+    @throttle_rates(task__list='1/min')
+    def test_disabled(self):
+        """Test nothing is throttled when rate limiting is disabled."""
+        statuses = {self.client.get(TASKS_URL).status_code for _ in range(3)}
+
+        self.assertEqual(statuses, {status.HTTP_200_OK})
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DB_REPLICA_SELECTION='round_robin')
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """Test routing reads to replicas."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.router = PrimaryReplicaRouter()
+
+    def route(self, state):
+        """Return the read alias chosen while `state` is the request's state."""
+        token = current_routing.set(state)
+        try:
+            return self.router.db_for_read(Task)
+        finally:
+            current_routing.reset(token)
+
+    def test_safe_requests_read_replicas_round_robin(self):
+        """Test reads of safe requests alternate between the replicas."""
+        aliases = [self.route(RoutingState(read_replica=True)) for _ in range(4)]
+
+        self.assertEqual(aliases, ['replica1', 'replica2', 'replica1', 'replica2'])
+
+    def test_request_reads_one_replica(self):
+        """Test every read of a request goes to the same replica."""
+        state = RoutingState(read_replica=True)
+        aliases = [self.route(state) for _ in range(3)]
+
+        self.assertEqual(aliases, ['replica1'] * 3)
+        self.assertEqual(self.route(RoutingState(read_replica=True)), 'replica2')
+
+    def test_read_primary(self):
+        """Test a request told to read the primary stops reading its replica."""
+        state = RoutingState(read_replica=True)
+        self.route(state)
+        token = current_routing.set(state)
+        try:
+            read_primary()
+        finally:
+            current_routing.reset(token)
+
+        self.assertIsNone(self.route(state))
+
+    def test_primary_outside_requests_and_for_unsafe_requests(self):
+        """Test reads outside requests and of unsafe requests use the primary."""
+        self.assertIsNone(self.router.db_for_read(Task))
+        self.assertIsNone(self.route(RoutingState(read_replica=False)))
+
+    def test_reads_in_transaction_use_primary(self):
+        """Test reads inside a transaction on the primary stay on the primary."""
+        with mock.patch.object(connection, 'in_atomic_block', True):
+            self.assertIsNone(self.route(RoutingState(read_replica=True)))
+
+    def test_reads_after_write_use_primary(self):
+        """Test a request reads from the primary once it wrote."""
+        state = RoutingState(read_replica=True)
+        token = current_routing.set(state)
+        try:
+            self.assertEqual(self.router.db_for_write(Task), 'default')
+        finally:
+            current_routing.reset(token)
+
+        self.assertIsNone(self.route(state))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Test everything uses the primary without replicas."""
+        self.assertIsNone(self.route(RoutingState(read_replica=True)))
+
+    def test_write_pins_user(self):
+        """Test a user who wrote reads from the primary in their next requests."""
+        def write(request):
+            bind_user(7)
+            self.router.db_for_write(Task)
+            return None
+
+        ReplicaRoutingMiddleware(write)(RequestFactory().post('/'))
+
+        self.assertTrue(is_pinned(7))
+        self.assertIsNone(self.route(RoutingState(read_replica=True, user_id=7)))
+        self.assertEqual(self.route(RoutingState(read_replica=True, user_id=8)), 'replica1')
+
+    def test_safe_request_does_not_pin(self):
+        """Test writes of safe requests, e.g. token refreshes, do not pin the user."""
+        def refresh(request):
+            bind_user(7)
+            self.router.db_for_write(Task)
+            return None
+
+        ReplicaRoutingMiddleware(refresh)(RequestFactory().get('/'))
+
+        self.assertFalse(is_pinned(7))
+
+    @override_settings(DB_REPLICA_SELECTION='least_lag', DB_REPLICA_MAX_LAG=5)
+    def test_least_lag(self):
+        """Test the least lagging replica is picked and lagging replicas are skipped."""
+        lags = {'replica1': 3.0, 'replica2': 1.0}
+        with mock.patch('core.db.routers.replication_lag', side_effect=lambda conn: lags[conn.alias]), \
+                mock.patch('core.db.routers.connections', {alias: mock.Mock(alias=alias) for alias in lags}):
+            self.assertEqual(self.router.choose_replica(), 'replica2')
+            lags['replica2'] = 9.0
+            # Lags are measured at most once per interval.
+            self.assertEqual(self.router.choose_replica(), 'replica2')
+            self.router._lags.clear()
+            self.assertEqual(self.router.choose_replica(), 'replica1')
+            lags['replica1'] = 6.0
+            self.router._lags.clear()
+            self.assertIsNone(self.router.choose_replica())
+
+    def test_migrations_only_on_primary(self):
+        """Test migrations never run on a replica."""
+        self.assertFalse(self.router.allow_migrate('replica1', 'task'))
+        self.assertIsNone(self.router.allow_migrate('default', 'task'))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_replicas_need_shared_cache(self):
+        """Test replicas with a process local cache fail at startup."""
+        with self.assertRaises(ImproperlyConfigured):
+            apps.get_app_config('core').ready()
+
+    def test_lagging_replica_reads_primary(self):
+        """Test a replica behind the primary's task version sends the request to the primary."""
+        versions = {'replica1': 3, 'replica2': 3, 'default': 5}
+        state = RoutingState(read_replica=True)
+        token = current_routing.set(state)
+        try:
+            with mock.patch('task.versions.read_task_version', side_effect=lambda user_id, using: versions[using]):
+                self.assertEqual(get_task_version(7), 5)
+        finally:
+            current_routing.reset(token)
+
+        self.assertFalse(state.read_replica)
+        self.assertIsNone(self.route(state))
+
+    def test_current_replica_stays(self):
+        """Test a replica with the primary's task version keeps serving the request."""
+        state = RoutingState(read_replica=True)
+        token = current_routing.set(state)
+        try:
+            with mock.patch('task.versions.read_task_version', return_value=5):
+                self.assertEqual(get_task_version(7), 5)
+        finally:
+            current_routing.reset(token)
+
+        self.assertTrue(state.read_replica)
+        self.assertIn(self.route(state), ['replica1', 'replica2'])
+
+class DatabaseWrapperTests(TransactionTestCase):
+    """Test the postgres backend health checks and pooling."""
+
+    def test_broken_persistent_connection_replaced(self):
+        """Test a persistent connection that stopped working is replaced before use."""
+        connection.ensure_connection()
+        broken = connection.connection
+        connection.close_if_unusable_or_obsolete()
+        broken.close()
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+        self.assertIsNot(connection.connection, broken)
+
+    def test_pooled_connection_reused(self):
+        """Test closing a pooled connection returns it to the pool."""
+        connection.close()
+        try:
+            with mock.patch.dict(connection.settings_dict, {'POOL_SIZE': 2}):
+                connection.ensure_connection()
+                raw = connection.connection
+                connection.close()
+                self.assertFalse(raw.closed)
+
+                connection.ensure_connection()
+                self.assertIs(connection.connection, raw)
+                connection.close()
+        finally:
+            close_pools()
+
+    def test_broken_pooled_connection_replaced(self):
+        """Test a pooled connection that stopped while idle is replaced before use."""
+        connection.close()
+        try:
+            with mock.patch.dict(connection.settings_dict, {'POOL_SIZE': 2}):
+                connection.ensure_connection()
+                raw = connection.connection
+                connection.close()
+                with psycopg2.connect(**connection.get_connection_params()) as other:
+                    other.cursor().execute('SELECT pg_terminate_backend(%s)', [raw.get_backend_pid()])
+                other.close()
+
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+
+                self.assertIsNot(connection.connection, raw)
+                self.assertTrue(raw.closed)
+                connection.close()
+        finally:
+            close_pools()
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsMiddlewareTests(TransactionTestCase):
+    """Test the request metrics."""
+
+    def setUp(self):
+        metrics.clear()
+        self.user = create_user()
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        close_db_connections()
+
+    def test_server_timing_header(self):
+        """Test responses report their SQL queries and duration."""
+        token_cache.clear()
+        response = self.client.get(TASKS_URL)
+
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="3 queries", total;dur=[\d.]+$')
+
+    def test_metrics_recorded_per_view(self):
+        """Test requests are counted per resolved view name."""
+        token_cache.clear()
+        self.client.get(TASKS_URL)
+        self.client.get(TASKS_URL)
+        response = self.client.get(METRICS_URL)
+        body = response.content.decode()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('http_requests_total{view="task:task-list",method="GET",status="200"} 2', body)
+        self.assertIn('http_request_duration_seconds_count{view="task:task-list"} 2', body)
+        self.assertIn('db_queries_total{view="task:task-list"} 5', body)
+        self.assertIn('auth_token_cache_hits_total 1', body)
+
+    def test_async_view_queries_recorded(self):
+        """Test queries run by async views on database threads are recorded."""
+        headers = {'AUTHORIZATION': f'Token {self.token.key}'}
+        token_cache.clear()
+        response = async_to_sync(self.async_client.get)(ASYNC_TASKS_URL, **headers)
+
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        """Test disabled metrics add no header and are not served."""
+        response = self.client.get(TASKS_URL)
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(METRICS_URL).status_code, status.HTTP_404_NOT_FOUND)
+
+class ImportTasksCommandTests(TestCase):
+    """Test the task import command."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.other_user = create_user(username='otheruser', email='other@example.com')
+
+    def import_file(self, content, suffix, *args):
+        """Write content to a file, import it and return the command output."""
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_tasks', f.name, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_import_csv_with_copy(self):
+        """Test csv rows are copied to the users named by username or email."""
+        content = (
+            'username,email,title,description,is_completed,created\n'
+            'testusername,,first,,true,2022-01-02T03:04:05Z\n'
+            ',other@example.com,second,"with, comma",false,\n'
+        )
+        out = self.import_file(content, '.csv', '--chunk-size', '1')
+
+        self.assertIn('Imported 2 tasks', out)
+        first = Task.objects.get(title='first')
+        self.assertEqual(first.user, self.user)
+        self.assertTrue(first.is_completed)
+        self.assertEqual(first.description, '')
+        self.assertEqual(first.created, datetime.datetime(2022, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+        self.assertEqual(first.updated, first.created)
+        self.assertEqual(Task.objects.get(title='second').user, self.other_user)
+        self.assertEqual(TaskCounter.objects.get(user=self.user).completed, 1)
+
+    def test_import_ndjson_with_bulk_create(self):
+        """Test NDJSON rows can be loaded with bulk_create."""
+        content = (
+            '{"email": "test@example.com", "title": "first", "created": "2022-01-02T03:04:05"}\n'
+            '\n'
+            '{"username": "otheruser", "title": "second", "is_completed": true}\n'
+        )
+        self.import_file(content, '.ndjson', '--method', 'bulk_create')
+
+        first = Task.objects.get(title='first')
+        self.assertEqual(first.user, self.user)
+        self.assertEqual(first.created, datetime.datetime(2022, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+        self.assertTrue(Task.objects.get(title='second').is_completed)
+
+    def test_invalid_row_aborts_import(self):
+        """Test an invalid row rolls back the whole import."""
+        content = 'username,title\ntestusername,first\nunknownuser,second\n'
+
+        with self.assertRaisesMessage(CommandError, "line 3: user 'unknownuser' does not exist"):
+            self.import_file(content, '.csv', '--chunk-size', '1')
+        self.assertFalse(Task.objects.exists())
+
+    def test_skip_invalid_rows(self):
+        """Test invalid rows are skipped and counted when asked to."""
+        content = 'username,title,is_completed\ntestusername,first,no\ntestusername,,no\ntestusername,third,maybe\n'
+        out = self.import_file(content, '.csv', '--skip-invalid')
+
+        self.assertIn('Imported 1 tasks, skipped 2 rows', out)
+        self.assertEqual(list(Task.objects.values_list('title', flat=True)), ['first'])
+
+    def test_ambiguous_user_rejected(self):
+        """Test a name that is one user's username and another's email is rejected."""
+        create_user(username='other@example.com', email='third@example.com')
+        content = 'username,title\nother@example.com,first\n'
+
+        with self.assertRaisesMessage(CommandError, "'other@example.com' names more than one user"):
+            self.import_file(content, '.csv')
+        self.assertFalse(Task.objects.exists())
+
+
+@override_settings(JOB_RETRY_DELAY=10, JOB_RETRY_MAX_DELAY=15, JOB_TIMEOUT=60)
+class JobQueueTests(TestCase):
+    """Test the background job queue."""
+
+    def test_enqueue_unknown_job(self):
+        """Test queueing a job nobody registered fails."""
+        with self.assertRaisesMessage(ValueError, "Unknown job 'test.missing'."):
+            jobs.enqueue('test.missing')
+
+    def test_claim_leases_due_jobs(self):
+        """Test claimed jobs are leased to the worker and not claimed again until the lease ends."""
+        first = jobs.enqueue('test.echo')
+        jobs.enqueue('test.echo', delay=60)
+        now = timezone.now()
+
+        claimed = jobs.claim_jobs('worker-1', limit=5, now=now)
+
+        self.assertEqual([job.pk for job in claimed], [first.pk])
+        job = claimed[0]
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.worker, 'worker-1')
+        self.assertEqual(job.run_at, now + datetime.timedelta(seconds=60))
+        self.assertEqual(jobs.claim_jobs('worker-2', now=now + datetime.timedelta(seconds=30)), [])
+
+    def test_run_job_records_result(self):
+        """Test a successful job stores what it returned."""
+        jobs.enqueue('test.echo', {'answer': 42})
+        job = jobs.claim_jobs('worker')[0]
+
+        self.assertTrue(jobs.run_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+        self.assertEqual(job.result, {'answer': 42})
+        self.assertIsNotNone(job.finished)
+
+    def test_failed_job_retried_with_backoff(self):
+        """Test failures are retried after a doubling delay until the attempts run out."""
+        created = jobs.enqueue('test.fail')
+        delays = []
+        for _ in range(3):
+            job = jobs.claim_jobs('worker', now=timezone.now() + datetime.timedelta(hours=1))[0]
+            before = timezone.now()
+            with self.assertLogs('core.jobs', 'WARNING'):
+                self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            if job.status == Job.Status.QUEUED:
+                delays.append((job.run_at - before).total_seconds())
+
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('RuntimeError: attempt 3 failed', job.error)
+        self.assertEqual(created.max_attempts, 3)
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 10, delta=1)
+        self.assertAlmostEqual(delays[1], 15, delta=1)
+
+    def test_expired_lease_taken_over(self):
+        """Test a job whose lease ran out is claimed again and the old attempt cannot record its outcome."""
+        jobs.enqueue('test.echo', max_attempts=2)
+        lost = jobs.claim_jobs('worker-1')[0]
+        later = timezone.now() + datetime.timedelta(seconds=61)
+
+        retried = jobs.claim_jobs('worker-2', now=later)[0]
+        jobs.run_job(lost)
+
+        retried.refresh_from_db()
+        self.assertEqual(retried.status, Job.Status.RUNNING)
+        self.assertEqual(retried.attempts, 2)
+        self.assertEqual(retried.worker, 'worker-2')
+        self.assertTrue(jobs.run_job(retried))
+
+    def test_expired_last_attempt_fails(self):
+        """Test a job whose last lease ran out fails without running again."""
+        jobs.enqueue('test.echo', max_attempts=1)
+        jobs.claim_jobs('worker-1')
+        job = jobs.claim_jobs('worker-2', now=timezone.now() + datetime.timedelta(seconds=61))[0]
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertFalse(jobs.run_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.error, 'Lease expired on the last attempt.')
+
+    def test_run_workers_burst(self):
+        """Test the command runs the due jobs and exits."""
+        echo = jobs.enqueue('test.echo', {'n': 1})
+        failed = jobs.enqueue('test.fail', max_attempts=1)
+        later = jobs.enqueue('test.echo', delay=60)
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            call_command('run_workers', '--burst', stdout=io.StringIO())
+
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[echo.pk], Job.Status.SUCCEEDED)
+        self.assertEqual(statuses[failed.pk], Job.Status.FAILED)
+        self.assertEqual(statuses[later.pk], Job.Status.QUEUED)
+
+
+class JobConcurrencyTests(TransactionTestCase):
+    """Test job workers running side by side."""
+
+    def test_locked_jobs_skipped(self):
+        """Test a job locked by another worker's claim is skipped instead of waited for."""
+        locked = jobs.enqueue('test.echo')
+        free = jobs.enqueue('test.echo')
+        claimed = []
+
+        with transaction.atomic():
+            Job.objects.select_for_update().get(pk=locked.pk)
+            thread = threading.Thread(target=lambda: claimed.extend(jobs.claim_jobs('other', limit=2)))
+            thread.start()
+            thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([job.pk for job in claimed], [free.pk])
+
+    @override_settings(JOB_TIMEOUT=1, JOB_HEARTBEAT=0.1)
+    def test_running_job_keeps_lease(self):
+        """Test a job running longer than JOB_TIMEOUT keeps its lease and is not taken over."""
+        queued = jobs.enqueue('test.sleep', {'seconds': 2})
+        job = jobs.claim_jobs('worker-1')[0]
+
+        def run():
+            jobs.run_job(job)
+            connections.close_all()
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(1.5)
+
+        self.assertEqual(jobs.claim_jobs('worker-2'), [])
+        thread.join(10)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.Status.SUCCEEDED)
+        self.assertEqual(queued.attempts, 1)
+
+    def test_process_and_thread_pool(self):
+        """Test forked worker processes with several threads run every job once."""
+        queued = [jobs.enqueue('test.echo', {'n': n}) for n in range(8)]
+
+        call_command('run_workers', '--burst', '--processes', '2', '--threads', '2', stdout=io.StringIO())
+
+        done = Job.objects.filter(pk__in=[job.pk for job in queued])
+        self.assertEqual(set(done.values_list('status', flat=True)), {Job.Status.SUCCEEDED})
+        self.assertEqual(set(done.values_list('attempts', flat=True)), {1})
+        self.assertEqual(sorted(job.result['n'] for job in done), list(range(8)))
+
+
+class JobApiTests(TestCase):
+    """Test the job status api."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_auth_required(self):
+        """Test job status requires authentication."""
+        response = APIClient().get(JOBS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_list_own_jobs(self):
+        """Test listing returns the user's jobs, newest first."""
+        other_user = create_user(username='otheruser', email='other@example.com')
+        first = jobs.enqueue('test.echo', user_id=self.user.pk)
+        second = jobs.enqueue('test.echo', user_id=self.user.pk)
+        jobs.enqueue('test.echo', user_id=other_user.pk)
+
+        response = self.client.get(JOBS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([job['id'] for job in response.data['results']], [second.pk, first.pk])
+
+    def test_list_jobs_with_token(self):
+        """Test token authenticated users list their jobs."""
+        token_cache.clear()
+        job = jobs.enqueue('test.echo', user_id=self.user.pk)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.create(user=self.user).key}')
+
+        response = client.get(JOBS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in response.data['results']], [job.pk])
+
+    def test_job_status(self):
+        """Test a job's status shows the last error without its traceback."""
+        job = jobs.enqueue('test.fail', user_id=self.user.pk, max_attempts=1)
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_job(jobs.claim_jobs('worker')[0])
+
+        response = self.client.get(job_detail(job.pk))
+
+        self.assertEqual(response.data['status'], Job.Status.FAILED)
+        self.assertEqual(response.data['attempts'], 1)
+        self.assertEqual(response.data['error'], 'RuntimeError: attempt 1 failed')
+
+    def test_other_users_job_not_found(self):
+        """Test the jobs of other users are not visible."""
+        other_user = create_user(username='otheruser', email='other@example.com')
+        job = jobs.enqueue('test.echo', user_id=other_user.pk)
+
+        response = self.client.get(job_detail(job.pk))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_download_unfinished_job_not_found(self):
+        """Test there is nothing to download before a job succeeded."""
+        job = jobs.enqueue('test.echo', user_id=self.user.pk)
+
+        response = self.client.get(reverse('core:job-download', args=[job.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
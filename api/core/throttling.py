@@ -0,0 +1,118 @@
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Return the capacity and period in seconds of a `<requests>/<period>` rate."""
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def get_rate(scope, action):
+    """
+    Return the rate name, capacity and period of a scope's action.
+
+    `<scope>.<action>` rates take precedence over the `<scope>` rate,
+    None means the action is not throttled.
+    """
+    if scope is None:
+        return None
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    for name in (f'{scope}.{action}', scope):
+        if name in rates:
+            return (name, *parse_rate(rates[name])) if rates[name] else None
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket of `capacity` tokens refilled over `period` seconds.
+
+    A bucket is stored in the cache as one integer, the time its next
+    token is due in refill intervals (the theoretical arrival time of
+    GCRA), so taking a token is a single atomic `incr` shared by every
+    worker using the same cache. Missing keys are full buckets, keys
+    outlive the time needed to refill and are refreshed while a client
+    is throttled.
+    """
+
+    def __init__(self, capacity, period, cache=cache):
+        self.capacity = capacity
+        self.interval = period / capacity
+        self.timeout = math.ceil(period) * 2
+        self.cache = cache
+
+    def take(self, key, now=None):
+        """Take a token and return 0, or the seconds until one is available."""
+        now = int((time.time() if now is None else now) / self.interval)
+        try:
+            due = self.cache.incr(key)
+        except ValueError:
+            due = now + 1
+            if not self.cache.add(key, due, self.timeout):
+                due = self.cache.incr(key)
+        if due <= now:
+            # Refilled completely since the last request, concurrent
+            # requests racing here each take from the full bucket.
+            due = now + 1
+            self.cache.set(key, due, self.timeout)
+        if due > now + self.capacity:
+            self.cache.decr(key)
+            self.cache.touch(key, self.timeout)
+            return (due - now - self.capacity) * self.interval
+        return 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_bucket(capacity, period):
+    return TokenBucket(capacity, period)
+
+
+def take_token(scope, action, ident):
+    """Take a token from the bucket of `ident` for a scope's action and return the seconds to wait."""
+    if not settings.THROTTLE_ENABLED:
+        return 0
+    rate = get_rate(scope, action)
+    if rate is None:
+        return 0
+    name, capacity, period = rate
+    return get_bucket(capacity, period).take(f'throttle:{name}:{ident}')
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle requests with cache backed token buckets.
+
+    Rates are looked up in DEFAULT_THROTTLE_RATES by the view's
+    `throttle_scope` and action, e.g. `task.list` before `task`. Buckets
+    belong to the authenticated user, or to the client IP for anonymous
+    requests and throttles that are not `per_user`.
+    """
+    scope = None
+    per_user = True
+
+    def __init__(self):
+        self.wait_seconds = 0
+
+    def allow_request(self, request, view):
+        if self.per_user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        scope = self.scope or getattr(view, 'throttle_scope', None)
+        action = getattr(view, 'action', None) or request.method.lower()
+        self.wait_seconds = take_token(scope, action, ident)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,14 @@
+from django.urls import path, include
+
+from rest_framework.routers import SimpleRouter
+
+from core import views
+
+router = SimpleRouter()
+router.register('', views.JobViewSet, basename='job')
+
+app_name = 'core'
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
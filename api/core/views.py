@@ -0,0 +1,60 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+
+from .authentication import CachedTokenAuthentication
+from .metrics import metrics
+from .models import Job
+from .serializers import JobSerializer
+
+
+def metrics_view(request):
+    """Return the request metrics in the Prometheus text format."""
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class JobCursorPagination(CursorPagination):
+    """Cursor pagination of jobs, newest first."""
+    ordering = '-id'
+    page_size = 50
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """View for the status of the user's background jobs."""
+    serializer_class = JobSerializer
+    queryset = Job.objects.all()
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    pagination_class = JobCursorPagination
+    throttle_scope = 'job'
+
+    def get_queryset(self):
+        """Get the list of items for this view."""
+        return self.queryset.filter(user_id=self.request.user.pk)
+
+    @extend_schema(responses={(200, 'application/octet-stream'): OpenApiTypes.BINARY})
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Download the file written by a finished job, like a task export."""
+        job = self.get_object()
+        name = (job.result or {}).get('file') if job.status == Job.Status.SUCCEEDED else None
+        if not name or not default_storage.exists(name):
+            raise Http404()
+        return FileResponse(
+            default_storage.open(name),
+            as_attachment=True,
+            filename=os.path.basename(name),
+            content_type=job.result.get('content_type'),
+        )
@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration serving the async task views with uvicorn workers.
+
+Run from this directory with:
+    gunicorn api.asgi:application -c gunicorn.asgi.conf.py
+
+Every worker is a single process running an event loop, the async task
+views overlap their queries on ASYNC_DB_THREADS threads per worker, so
+a worker holds at most ASYNC_DB_THREADS + 1 database connections. Only
+/api/task/async/ is served, sync views would run one at a time on the
+single thread of the event loop, they are served by gunicorn.conf.py.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_ASGI_BIND', '0.0.0.0:8001')
+workers = int(os.environ.get('GUNICORN_ASGI_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = '-'
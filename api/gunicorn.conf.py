@@ -0,0 +1,23 @@
+"""
+Gunicorn configuration serving the WSGI application with threaded workers.
+
+Run from this directory with:
+    gunicorn api.wsgi:application -c gunicorn.conf.py
+
+The sync api is served by GUNICORN_WORKERS processes running
+GUNICORN_THREADS request threads each, so a worker holds at most
+GUNICORN_THREADS database connections. The async task views are served
+by the ASGI deployment of gunicorn.asgi.conf.py, route
+/api/task/async/ to it.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = '-'
@@ -0,0 +1,93 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import ArchivedTask, Task
+
+# Scans the next `batch_size` task ids and moves the old completed tasks
+# among them, skipping the ones locked by a concurrent write. Returns the
+# last scanned id and how many tasks were moved.
+ARCHIVE_BATCH_SQL = """
+WITH scanned AS (
+    SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s
+), candidates AS (
+    SELECT id FROM {table}
+    WHERE id IN (SELECT id FROM scanned) AND is_completed AND deleted IS NULL AND GREATEST(updated, restored) < %s
+    FOR UPDATE SKIP LOCKED
+), moved AS (
+    DELETE FROM {table} WHERE id IN (SELECT id FROM candidates)
+    RETURNING id, title, description, is_completed, created, updated, user_id
+), archived AS (
+    INSERT INTO {archive} (id, title, description, is_completed, created, updated, user_id, archived)
+    SELECT id, title, description, is_completed, created, updated, user_id, %s FROM moved
+    RETURNING id
+)
+SELECT (SELECT MAX(id) FROM scanned), (SELECT COUNT(*) FROM archived)
+"""
+
+# Restored tasks keep their times and are synced again through their new
+# change_xid. They are only archived again once their restore is as old
+# as an archived task.
+RESTORE_SQL = """
+WITH restored AS (
+    DELETE FROM {archive} WHERE user_id = %s{ids}
+    RETURNING id, title, description, is_completed, created, updated, user_id
+)
+INSERT INTO {table} (id, title, description, is_completed, created, updated, restored, user_id)
+SELECT id, title, description, is_completed, created, updated, %s, user_id FROM restored
+RETURNING id
+"""
+
+class TaskArchiver:
+    """
+    Move completed tasks last updated, and restored, more than `days` ago to the archive table.
+
+    The task table is scanned in id order, `batch_size` ids per
+    transaction, and the matching tasks are moved with one statement per
+    batch. Tasks locked by a concurrent write are skipped and left for
+    the next run, so archiving never waits on requests. Synced clients
+    see archived tasks as deleted, the task counters keep counting them.
+    """
+
+    def __init__(self, days=None, using='default', batch_size=10000, sleep=0, progress=None):
+        self.days = settings.TASK_ARCHIVE_AFTER_DAYS if days is None else days
+        self.using = using
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.progress = progress
+
+    def run(self, now=None):
+        """Archive the old completed tasks and return how many were moved."""
+        now = now or timezone.now()
+        sql = ARCHIVE_BATCH_SQL.format(table=Task._meta.db_table, archive=ArchivedTask._meta.db_table)
+        before = now - timedelta(days=self.days)
+        archived = last_id = 0
+        while True:
+            with transaction.atomic(using=self.using), connections[self.using].cursor() as cursor:
+                cursor.execute(sql, [last_id, self.batch_size, before, now])
+                last_id, moved = cursor.fetchone()
+            if last_id is None:
+                return archived
+            archived += moved
+            if self.progress is not None:
+                self.progress(archived)
+            if self.sleep:
+                time.sleep(self.sleep)
+
+def restore_tasks(user_id, using, ids=None):
+    """Move archived tasks of a user, all of them or the given ids, back to the task table and return their ids."""
+    params = [user_id]
+    if ids is not None:
+        params.append(list(ids))
+    params.append(timezone.now())
+    sql = RESTORE_SQL.format(
+        table=Task._meta.db_table,
+        archive=ArchivedTask._meta.db_table,
+        ids=' AND id = ANY(%s)' if ids is not None else '',
+    )
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
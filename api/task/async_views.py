@@ -0,0 +1,107 @@
+import functools
+
+from django.db import DatabaseError
+from django.http import HttpResponse, HttpResponseNotAllowed
+
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from core.authentication import CachedTokenAuthentication
+from core.concurrency import db_sync_to_async
+from core.throttling import take_token
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+from .models import Task
+from .pagination import TaskCursorPagination
+from .serializers import TaskDetailSerializer, task_values, task_detail_values
+from .shards import forget_user, is_shard_moved
+from .views import TaskShardMoved
+
+authentication = CachedTokenAuthentication()
+renderer = FastJSONRenderer()
+
+def json_response(data, status=status.HTTP_200_OK):
+    """Return a rendered json response."""
+    return HttpResponse(renderer.render(data), content_type=renderer.media_type, status=status)
+
+def authenticate_and_throttle(request, scope, action):
+    """Return the user of a token authenticated request that is within its rate limit."""
+    result = authentication.authenticate(request)
+    if result is None:
+        raise exceptions.NotAuthenticated()
+    user = result[0]
+    wait = take_token(scope, action, f'user:{user.pk}')
+    if wait:
+        raise exceptions.Throttled(wait)
+    return user
+
+def async_api_view(actions, throttle_scope=None):
+    """
+    Turn a coroutine into a token authenticated, throttled json view.
+
+    `actions` maps the allowed methods to the action names their rate
+    limits are looked up by, like `TaskViewSet` actions. The view is
+    called with the request and the authenticated user, API exceptions
+    are rendered like DRF renders them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in actions:
+                return HttpResponseNotAllowed(list(actions))
+            try:
+                user = await db_sync_to_async(authenticate_and_throttle)(
+                    request, throttle_scope, actions[request.method],
+                )
+                return await view(request, user, *args, **kwargs)
+            except exceptions.APIException as exc:
+                response = json_response({'detail': exc.detail}, status=exc.status_code)
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    response['WWW-Authenticate'] = authentication.authenticate_header(request)
+                if getattr(exc, 'wait', None):
+                    response['Retry-After'] = '%d' % exc.wait
+                return response
+
+        # csrf_exempt wraps views in a sync function in this Django version.
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+def list_page(request, user_id):
+    """Return a page of the user's tasks like `TaskViewSet.list`."""
+    paginator = TaskCursorPagination()
+    page = paginator.paginate_values(Task.objects.for_user(user_id), request, task_values)
+    return paginator.get_paginated_response(page).data
+
+def task_values_or_none(user_id, pk):
+    """Return the detail values of a user's task or None."""
+    queryset = Task.objects.for_user(user_id).values(*task_detail_values.fields)
+    return queryset.filter(pk=pk).first()
+
+@async_api_view({'GET': 'list', 'POST': 'create'}, throttle_scope='task')
+async def task_list_view(request, user):
+    """List or create tasks without holding a worker thread."""
+    drf_request = Request(request, parsers=[FastJSONParser()])
+    if request.method == 'GET':
+        return json_response(await db_sync_to_async(list_page)(drf_request, user.pk))
+
+    serializer = TaskDetailSerializer(data=drf_request.data)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        await db_sync_to_async(serializer.save)(user_id=user.pk)
+    except DatabaseError as exc:
+        if not is_shard_moved(exc):
+            raise
+        await db_sync_to_async(forget_user)(user.pk)
+        raise TaskShardMoved(1)
+    return json_response(serializer.data, status=status.HTTP_201_CREATED)
+
+@async_api_view({'GET': 'retrieve'}, throttle_scope='task')
+async def task_detail_view(request, user, pk):
+    """Retrieve a task without holding a worker thread."""
+    row = await db_sync_to_async(task_values_or_none)(user.pk, pk)
+    if row is None:
+        raise exceptions.NotFound()
+    return json_response(task_detail_values.to_representation(row))
@@ -0,0 +1,38 @@
+from django.db import connections, transaction
+
+from .models import ArchivedTask, Task, TaskCounter
+
+# Counters are recounted in place, their versions back the ETags of the
+# task api and must never go back.
+RESET_SQL = 'UPDATE task_taskcounter SET total = 0, completed = 0 WHERE total <> 0 OR completed <> 0'
+
+REBUILD_SQL = """
+INSERT INTO task_taskcounter (user_id, total, completed, version)
+SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE is_completed), nextval('task_version_seq')
+FROM (
+    SELECT user_id, is_completed FROM task_task WHERE deleted IS NULL
+    UNION ALL
+    SELECT user_id, is_completed FROM task_archivedtask
+) AS tasks
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET total = EXCLUDED.total, completed = EXCLUDED.completed
+"""
+
+def get_task_counts(user_id):
+    """Return the total, completed and open task counts of a user."""
+    counter = TaskCounter.objects.for_user(user_id).first() or TaskCounter(user_id=user_id)
+    return {'total': counter.total, 'completed': counter.completed, 'open': counter.open}
+
+def rebuild_task_counters(using='default'):
+    """
+    Recount the live and archived tasks of every user from scratch and return how many users have tasks.
+
+    Task writes are blocked while counting so no change is lost between
+    the count and the update of the counters.
+    """
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {Task._meta.db_table}, {ArchivedTask._meta.db_table} IN SHARE MODE')
+        cursor.execute(RESET_SQL)
+        cursor.execute(REBUILD_SQL)
+        return cursor.rowcount
@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from core.renderers import FastJSONRenderer
+
+from .serializers import task_detail_values
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_DIR = 'exports'
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+encode = FastJSONRenderer().render
+
+def export_rows(queryset):
+    """
+    Yield task dicts shaped like `TaskDetailSerializer` output.
+
+    Rows are read with `.values()` through `.iterator()`, which uses a
+    server-side cursor on Postgres, so memory does not grow with the
+    number of tasks.
+    """
+    rows = queryset.values(*task_detail_values.fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield task_detail_values.to_representation(row)
+
+def stream_json(rows):
+    """Yield a JSON array of rows in buffered chunks."""
+    buffer = [b'[']
+    size = 1
+    separator = b''
+    for row in rows:
+        item = separator + encode(row)
+        separator = b','
+        buffer.append(item)
+        size += len(item)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(b']')
+    yield b''.join(buffer)
+
+def stream_ndjson(rows):
+    """Yield one JSON document per line in buffered chunks."""
+    buffer = []
+    size = 0
+    for row in rows:
+        item = encode(row) + b'\n'
+        buffer.append(item)
+        size += len(item)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+EXPORT_FORMATS = {
+    'json': (stream_json, 'application/json'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
+
+def export_expires(now=None):
+    """Return when an export written now is deleted."""
+    return (now or timezone.now()) + timedelta(hours=settings.TASK_EXPORT_EXPIRE_HOURS)
+
+def delete_expired_exports(hours=None, now=None):
+    """Delete the export files of every user older than `hours`, TASK_EXPORT_EXPIRE_HOURS by default."""
+    hours = settings.TASK_EXPORT_EXPIRE_HOURS if hours is None else hours
+    cutoff = (now or timezone.now()) - timedelta(hours=hours)
+    if not default_storage.exists(EXPORT_DIR):
+        return 0
+    deleted = 0
+    for user_dir in default_storage.listdir(EXPORT_DIR)[0]:
+        for file_name in default_storage.listdir(f'{EXPORT_DIR}/{user_dir}')[1]:
+            name = f'{EXPORT_DIR}/{user_dir}/{file_name}'
+            if default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                deleted += 1
+    return deleted
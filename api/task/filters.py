@@ -0,0 +1,115 @@
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .search import search_tasks
+from .serializers import TaskFilterQuerySerializer
+
+
+class TaskFilterBackend(BaseFilterBackend):
+    """
+    Filter tasks by completion, creation time range and title prefix.
+
+    Every filter is served by an index scoped to the user, the partial
+    index on open tasks covers the default "what is left to do" list.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = TaskFilterQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.validated_data
+
+        if filters.get('is_completed') is not None:
+            queryset = queryset.filter(is_completed=filters['is_completed'])
+        if 'created_after' in filters:
+            queryset = queryset.filter(created__gte=filters['created_after'])
+        if 'created_before' in filters:
+            queryset = queryset.filter(created__lt=filters['created_before'])
+        if filters.get('title'):
+            queryset = queryset.filter(title__istartswith=filters['title'])
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': 'is_completed',
+                'required': False,
+                'in': 'query',
+                'description': 'Only completed or only open tasks.',
+                'schema': {'type': 'boolean'},
+            },
+            {
+                'name': 'created_after',
+                'required': False,
+                'in': 'query',
+                'description': 'Only tasks created at or after this time.',
+                'schema': {'type': 'string', 'format': 'date-time'},
+            },
+            {
+                'name': 'created_before',
+                'required': False,
+                'in': 'query',
+                'description': 'Only tasks created before this time.',
+                'schema': {'type': 'string', 'format': 'date-time'},
+            },
+            {
+                'name': 'title',
+                'required': False,
+                'in': 'query',
+                'description': 'Only tasks whose title starts with this value, case insensitive.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': 'include_archived',
+                'required': False,
+                'in': 'query',
+                'description': 'Include the archived tasks, marked by `is_archived`.',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+
+class TaskSearchFilter(BaseFilterBackend):
+    """Filter tasks by the `search` query parameter, ranked by relevance."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return search_tasks(queryset, term)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Full-text search over title and description, results are ordered by relevance.',
+                'schema': {'type': 'string'},
+            },
+        ]
+
+
+class TaskOrderingFilter(OrderingFilter):
+    """
+    Order tasks by a whitelisted field, search results by relevance.
+
+    Only fields backed by an index on the user's tasks can be ordered by.
+    The id is appended as a tiebreaker so the cursor pagination stays
+    stable for equal values.
+    """
+    ordering_fields = ['created', 'updated', 'title']
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        ordering = []
+        if params:
+            fields = [param.strip() for param in params.split(',')]
+            ordering = self.remove_invalid_fields(queryset, fields, view, request)
+        if not ordering:
+            ordering = list(self.get_default_ordering(view))
+            if 'rank' in queryset.query.annotations:
+                return ['-rank'] + ordering
+            return ordering
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
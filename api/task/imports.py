@@ -0,0 +1,259 @@
+import csv
+import io
+import itertools
+import json
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Task
+from .shards import shard_for_user
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', ''}
+COPY_COLUMNS = ('title', 'description', 'is_completed', 'created', 'updated', 'user_id')
+MAX_REPORTED_ERRORS = 100
+AMBIGUOUS = object()
+
+class TaskImportError(ValueError):
+    """A row of an import could not be loaded."""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+class TaskImportCommitError(Exception):
+    """Committing the import failed on a shard after others committed."""
+
+    def __init__(self, committed, error):
+        shards = ', '.join(f'{using} ({count} tasks)' for using, count in committed.items())
+        super().__init__(f'{error} (already committed: {shards})')
+        self.committed = committed
+
+def read_csv(stream):
+    """Yield the line number and dict of every csv row."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+def read_ndjson(stream):
+    """Yield the line number and dict of every non-empty NDJSON line."""
+    loads = orjson.loads if orjson is not None else json.loads
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = loads(text)
+        except ValueError as e:
+            row = e
+        yield line, row
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower() if value is not None else ''
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f'is_completed must be a boolean, got {value!r}')
+
+def parse_row(row, now):
+    """Return the user key and task values of a row, raise ValueError if invalid."""
+    if not isinstance(row, dict):
+        raise ValueError(f'row must be an object, got {row}')
+    user = (row.get('username') or row.get('email') or '').strip()
+    if not user:
+        raise ValueError('username or email is required')
+    title = str(row.get('title') or '').strip()
+    if not title:
+        raise ValueError('title is required')
+    max_length = Task._meta.get_field('title').max_length
+    if len(title) > max_length:
+        raise ValueError(f'title is longer than {max_length} characters')
+
+    created = row.get('created')
+    if created:
+        parsed = parse_datetime(str(created))
+        if parsed is None:
+            raise ValueError(f'created must be an ISO 8601 datetime, got {created!r}')
+        created = timezone.make_aware(parsed, timezone.utc) if timezone.is_naive(parsed) else parsed
+    else:
+        created = now
+    return user, {
+        'title': title,
+        'description': str(row.get('description') or ''),
+        'is_completed': parse_bool(row.get('is_completed')),
+        'created': created,
+    }
+
+class TaskImporter:
+    """
+    Load tasks from parsed rows in chunks.
+
+    Each chunk is validated, its users are resolved by username or email
+    with one query, and it is written with Postgres `COPY`, or with
+    `bulk_create` on other backends. The whole import runs in one
+    transaction, so an invalid row aborts it unless invalid rows are
+    skipped. Identifiers naming one user by username and another by
+    email are invalid. Importing into the default database writes the
+    tasks of every user to their shard, in one transaction per shard,
+    committed one after another once every row is loaded. A failed
+    commit raises TaskImportCommitError with the shards that did commit.
+    Task counters and versions are kept by their triggers.
+    """
+
+    def __init__(self, using='default', chunk_size=10000, method=None, skip_invalid=False, progress=None):
+        self.using = using
+        self.chunk_size = chunk_size
+        connection = connections[using]
+        self.method = method or ('copy' if connection.vendor == 'postgresql' else 'bulk_create')
+        self.skip_invalid = skip_invalid
+        self.progress = progress
+        self.user_ids = {}
+        self.shard_counts = defaultdict(int)
+        self.committed = {}
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def run(self, rows):
+        """Import the rows and return the import statistics."""
+        start = time.perf_counter()
+        rows = iter(rows)
+        databases = settings.DATABASE_SHARDS if self.using == DEFAULT_DB_ALIAS else [self.using]
+        try:
+            with ExitStack() as stack:
+                for using in databases:
+                    stack.enter_context(self.shard_transaction(using))
+                while True:
+                    chunk = list(itertools.islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    tasks = self.validate(chunk)
+                    for using, shard_tasks in self.group_by_shard(tasks).items():
+                        getattr(self, f'load_{self.method}')(shard_tasks, using)
+                        self.shard_counts[using] += len(shard_tasks)
+                    self.imported += len(tasks)
+                    if self.progress is not None:
+                        self.progress(self.imported, self.skipped, time.perf_counter() - start)
+        except Exception as e:
+            if self.committed:
+                raise TaskImportCommitError(self.committed, e) from e
+            raise
+
+        seconds = time.perf_counter() - start
+        return {
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'shards': self.committed,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.imported / seconds) if seconds else None,
+        }
+
+    @contextmanager
+    def shard_transaction(self, using):
+        """Load into a database in a transaction, recording its tasks once committed."""
+        with transaction.atomic(using=using):
+            yield
+        if self.shard_counts[using]:
+            self.committed[using] = self.shard_counts[using]
+
+    def validate(self, chunk):
+        """Return the task values of the valid rows of a chunk."""
+        now = timezone.now()
+        parsed = []
+        for line, row in chunk:
+            try:
+                parsed.append((line, *parse_row(row, now)))
+            except ValueError as e:
+                self.reject(line, str(e))
+        self.resolve_users({user for _, user, _ in parsed})
+
+        tasks = []
+        for line, user, values in parsed:
+            user_id = self.user_ids.get(user)
+            if user_id is None:
+                self.reject(line, f'user {user!r} does not exist')
+                continue
+            if user_id is AMBIGUOUS:
+                self.reject(line, f'user {user!r} names more than one user by username or email')
+                continue
+            values['user_id'] = user_id
+            tasks.append(values)
+        return tasks
+
+    def reject(self, line, message):
+        """Skip an invalid row or abort the import."""
+        if not self.skip_invalid:
+            raise TaskImportError(line, message)
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'line {line}: {message}')
+
+    def resolve_users(self, keys):
+        """Look up the ids of users not seen in earlier chunks, marking keys matching several."""
+        missing = keys - self.user_ids.keys()
+        if not missing:
+            return
+        users = get_user_model().objects.using(self.using).filter(Q(username__in=missing) | Q(email__in=missing))
+        matches = defaultdict(set)
+        for user_id, username, email in users.values_list('id', 'username', 'email'):
+            for key in {username, email} & missing:
+                matches[key].add(user_id)
+        for key, user_ids in matches.items():
+            self.user_ids[key] = user_ids.pop() if len(user_ids) == 1 else AMBIGUOUS
+
+    def group_by_shard(self, tasks):
+        """Return the tasks by the database of their user."""
+        if self.using != DEFAULT_DB_ALIAS:
+            return {self.using: tasks}
+        groups = defaultdict(list)
+        for task in tasks:
+            groups[shard_for_user(task['user_id'])].append(task)
+        return groups
+
+    def load_copy(self, tasks, using):
+        """Write tasks with COPY from an in-memory csv buffer."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for task in tasks:
+            created = task['created'].isoformat()
+            writer.writerow([
+                task['title'], task['description'], 't' if task['is_completed'] else 'f',
+                created, created, task['user_id'],
+            ])
+        buffer.seek(0)
+        columns = ', '.join(COPY_COLUMNS)
+        sql = (
+            f'COPY {Task._meta.db_table} ({columns}) FROM STDIN '
+            'WITH (FORMAT csv, FORCE_NOT_NULL (title, description))'
+        )
+        with connections[using].cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+
+    def load_bulk_create(self, tasks, using):
+        """Write tasks with bulk_create, keeping their creation times."""
+        objs = [Task(updated=task['created'], **task) for task in tasks]
+        created = {id(obj): obj.created for obj in objs}
+        Task.objects.using(using).bulk_create(objs, batch_size=self.chunk_size)
+        # bulk_create stamps the auto_now(_add) fields, restore the imported times.
+        if connections[using].features.can_return_rows_from_bulk_insert:
+            for obj in objs:
+                obj.created = obj.updated = created[id(obj)]
+            Task.all_objects.using(using).bulk_update(objs, ['created', 'updated'], batch_size=self.chunk_size)
@@ -0,0 +1,89 @@
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from core.jobs import job
+
+from .archive import TaskArchiver
+from .counters import rebuild_task_counters
+from .export import EXPORT_DIR, EXPORT_FORMATS, delete_expired_exports, export_expires, export_rows
+from .models import Task
+from .shards import forget_moved_user, task_db
+
+DELETE_BATCH_SIZE = 1000
+
+@job('task.clear_completed')
+def clear_completed(job):
+    """
+    Soft delete the completed tasks of the job's user, a batch per statement.
+
+    When the user's tasks moved meanwhile, the retry runs on their new shard.
+    """
+    using = task_db(job.user_id)
+    tasks = Task.objects.using(using).filter(user_id=job.user_id, is_completed=True)
+    deleted = 0
+    with forget_moved_user(job.user_id):
+        while True:
+            now = timezone.now()
+            batch = tasks.values('id')[:DELETE_BATCH_SIZE]
+            count = Task.objects.using(using).filter(id__in=batch).update(deleted=now, updated=now)
+            deleted += count
+            if count < DELETE_BATCH_SIZE:
+                return {'deleted': deleted}
+
+@job('task.export')
+def export_tasks(job):
+    """Write every task of the job's user to a file in the default storage, deleted once it expires."""
+    output = job.payload.get('output', 'json')
+    stream, content_type = EXPORT_FORMATS[output]
+    tasks = Task.objects.using(task_db(job.user_id)).filter(user_id=job.user_id)
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    name = f'{EXPORT_DIR}/{job.user_id}/tasks-{job.pk}.{output}'
+    # A retried export replaces the file of the failed attempt.
+    default_storage.delete(name)
+    with tempfile.TemporaryFile() as f:
+        for chunk in stream(counted(export_rows(tasks))):
+            f.write(chunk)
+        f.seek(0)
+        name = default_storage.save(name, File(f))
+    return {
+        'file': name,
+        'content_type': content_type,
+        'tasks': count,
+        'expires': export_expires().isoformat(),
+    }
+
+@job('task.delete_expired_exports')
+def delete_expired_export_files(job):
+    """Delete the task export files older than the given hours, TASK_EXPORT_EXPIRE_HOURS by default."""
+    return {'deleted': delete_expired_exports(hours=job.payload.get('hours'))}
+
+@job('task.rebuild_counters')
+def rebuild_counters(job):
+    """Recount the tasks of every user on the given databases, every shard by default."""
+    databases = job.payload.get('databases') or settings.DATABASE_SHARDS
+    return {'users': sum(rebuild_task_counters(using=using) for using in databases)}
+
+@job('task.archive_tasks')
+def archive_tasks(job):
+    """Move the old completed tasks to the archive table on the given databases, every shard by default."""
+    databases = job.payload.get('databases') or settings.DATABASE_SHARDS
+    archived = sum(
+        TaskArchiver(
+            days=job.payload.get('days'),
+            using=using,
+            batch_size=job.payload.get('batch_size', 10000),
+        ).run()
+        for using in databases
+    )
+    return {'archived': archived}
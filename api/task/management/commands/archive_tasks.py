@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue
+from task.archive import TaskArchiver
+
+class Command(BaseCommand):
+    """Django command to move old completed tasks to the archive table."""
+    help = (
+        'Move completed tasks not updated for --days days to the archive table in batches, '
+        'each in its own transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.TASK_ARCHIVE_AFTER_DAYS,
+            help='Archive completed tasks not updated for this many days.',
+        )
+        parser.add_argument('--batch-size', type=int, default=10000, help='Task ids scanned per transaction.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--database', help='Database to archive the tasks of, every task shard by default.')
+        parser.add_argument('--background', action='store_true', help='Queue the archival for the job workers.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        databases = [options['database']] if options['database'] else settings.DATABASE_SHARDS
+        if options['background']:
+            payload = {'days': options['days'], 'databases': databases, 'batch_size': options['batch_size']}
+            job = enqueue('task.archive_tasks', payload)
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk} to archive the tasks.'))
+            return
+        archived = 0
+        for using in databases:
+            archiver = TaskArchiver(
+                days=options['days'],
+                using=using,
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                progress=lambda count, using=using: self.stderr.write(f'{count} tasks archived on {using}'),
+            )
+            archived += archiver.run()
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} tasks.'))
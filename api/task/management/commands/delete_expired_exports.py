@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue
+from task.export import delete_expired_exports
+
+class Command(BaseCommand):
+    """Django command to delete expired task export files."""
+    help = 'Delete the task export files written by background jobs once they are --hours old.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=settings.TASK_EXPORT_EXPIRE_HOURS,
+            help='Delete export files older than this many hours.',
+        )
+        parser.add_argument('--background', action='store_true', help='Queue the cleanup for the job workers.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        if options['background']:
+            job = enqueue('task.delete_expired_exports', {'hours': options['hours']})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk} to delete the expired exports.'))
+            return
+        deleted = delete_expired_exports(hours=options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired exports.'))
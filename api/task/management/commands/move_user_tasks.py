@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from task.shards import TaskMover, directory_shard, plan_rebalance, shard_loads
+
+class Command(BaseCommand):
+    """Django command to move the tasks of users between shards."""
+    help = (
+        'Move the tasks of users to another shard in batches, or with --rebalance move users '
+        'from the fullest shards to the emptiest ones until the task counts are even.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='*', type=int, help='Ids of the users to move.')
+        parser.add_argument('--to', dest='target', help='Shard to move the users to.')
+        parser.add_argument('--rebalance', action='store_true', help='Plan the moves from the task counters.')
+        parser.add_argument('--dry-run', action='store_true', help='Print the moves without moving anything.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tasks copied per statement.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        if options['rebalance']:
+            if options['users'] or options['target']:
+                raise CommandError('--rebalance plans its own moves, do not pass users or --to.')
+            moves = plan_rebalance(shard_loads())
+        else:
+            target = options['target']
+            if not options['users'] or target is None:
+                raise CommandError('Pass the users to move and --to, or --rebalance.')
+            if target not in settings.DATABASE_SHARDS:
+                raise CommandError(f'Unknown shard {target!r}, choose from {", ".join(settings.DATABASE_SHARDS)}.')
+            moves = [(user_id, directory_shard(user_id), target) for user_id in options['users']]
+            moves = [move for move in moves if move[1] != move[2]]
+
+        mover = TaskMover(
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            progress=self.report_progress,
+        )
+        for user_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f'Would move user {user_id} from {source} to {target}.')
+                continue
+            tasks = mover.move(user_id, target)
+            self.stdout.write(f'Moved {tasks} tasks of user {user_id} from {source} to {target}.')
+        verb = 'Planned' if options['dry_run'] else 'Made'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(moves)} moves.'))
+
+    def report_progress(self, user_id, copied):
+        self.stderr.write(f'{copied} tasks of user {user_id} copied')
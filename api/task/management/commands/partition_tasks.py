@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from task.partitions import TaskPartitioner, task_partition_count
+
+class Command(BaseCommand):
+    """Django command to partition the task table."""
+    help = (
+        'Rebuild the task table as hash partitions by user while it stays in use, '
+        'or back into a plain table with --partitions 0.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, required=True, help='Hash partitions, 0 for a plain table.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Tasks copied per transaction.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--database', help='Database to partition, every task shard by default.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        partitions = options['partitions']
+        if partitions < 0:
+            raise CommandError('--partitions can not be negative.')
+        for using in [options['database']] if options['database'] else settings.DATABASE_SHARDS:
+            connection = connections[using]
+            if connection.vendor != 'postgresql' or connection.pg_version < 130000:
+                raise CommandError(
+                    f'Partitioning needs postgres 13 or later, {using} is not. The change_xid trigger '
+                    'is recreated as a BEFORE row trigger on the partitioned table, older versions '
+                    'do not support those.'
+                )
+            current = task_partition_count(using)
+            if current == partitions:
+                self.stdout.write(f'The task table of {using} already has {partitions} partitions.')
+                continue
+            partitioner = TaskPartitioner(
+                partitions,
+                using=using,
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                progress=self.report_progress,
+            )
+            copied = partitioner.run()
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt the task table of {using} with {partitions} partitions, copied {copied} tasks.'
+            ))
+
+    def report_progress(self, copied):
+        self.stderr.write(f'{copied} tasks copied')
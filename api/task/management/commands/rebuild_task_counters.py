@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue
+from task.counters import rebuild_task_counters
+
+class Command(BaseCommand):
+    """Django command to recount the tasks of every user."""
+    help = 'Rebuild the per-user task counters from the task table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Database to rebuild the counters in, every task shard by default.')
+        parser.add_argument('--background', action='store_true', help='Queue the rebuild for the job workers.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        databases = [options['database']] if options['database'] else settings.DATABASE_SHARDS
+        if options['background']:
+            job = enqueue('task.rebuild_counters', {'databases': databases})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk} to rebuild the task counters.'))
+            return
+        users = sum(rebuild_task_counters(using=using) for using in databases)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt task counters of {users} users.'))
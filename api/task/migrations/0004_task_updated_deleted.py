@@ -0,0 +1,34 @@
+# Generated by Django 4.0.6 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+def backfill_updated(apps, schema_editor):
+    """Use the creation time as the last modification of existing tasks."""
+    Task = apps.get_model('task', 'Task')
+    Task.objects.using(schema_editor.connection.alias).update(updated=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0003_task_user_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='deleted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'updated', 'id'], name='task_user_updated_id_idx'),
+        ),
+    ]
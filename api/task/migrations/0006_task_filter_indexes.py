@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0005_task_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('deleted__isnull', True), ('is_completed', False)), fields=['user', '-created', '-id'], name='task_user_open_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'title', 'id'], name='task_user_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(django.db.models.expressions.F('user'), django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), name='task_user_title_prefix_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.0.6 on 2026-10-18 17:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Applies the change of one task row to its owner's counter. Removing a
+# task only updates an existing counter, so deleting a user whose
+# counter is already gone does not recreate it.
+TRIGGER_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION task_counter_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.deleted IS NULL THEN
+        UPDATE task_taskcounter
+        SET total = total - 1, completed = completed - OLD.is_completed::int
+        WHERE user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.deleted IS NULL THEN
+        INSERT INTO task_taskcounter (user_id, total, completed)
+        VALUES (NEW.user_id, 1, NEW.is_completed::int)
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + 1,
+            completed = task_taskcounter.completed + EXCLUDED.completed;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGERS_SQL = """
+CREATE TRIGGER task_counter_insert_delete
+AFTER INSERT OR DELETE ON task_task
+FOR EACH ROW EXECUTE FUNCTION task_counter_apply();
+
+CREATE TRIGGER task_counter_update
+AFTER UPDATE OF user_id, is_completed, deleted ON task_task
+FOR EACH ROW
+WHEN (
+    OLD.user_id IS DISTINCT FROM NEW.user_id
+    OR OLD.is_completed IS DISTINCT FROM NEW.is_completed
+    OR OLD.deleted IS DISTINCT FROM NEW.deleted
+)
+EXECUTE FUNCTION task_counter_apply();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS task_counter_update ON task_task;
+DROP TRIGGER IF EXISTS task_counter_insert_delete ON task_task;
+DROP FUNCTION IF EXISTS task_counter_apply();
+"""
+
+BACKFILL_SQL = """
+INSERT INTO task_taskcounter (user_id, total, completed)
+SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE is_completed)
+FROM task_task
+WHERE deleted IS NULL
+GROUP BY user_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_alter_user_managers'),
+        ('task', '0006_task_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='task_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(TRIGGER_FUNCTION_SQL + CREATE_TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,90 @@
+from importlib import import_module
+
+from django.db import migrations
+
+row_triggers = import_module('task.migrations.0007_task_counter')
+
+# Applies the changes of one statement to the counters of their owners,
+# aggregated per user from the transition tables. Removing tasks only
+# updates existing counters, so deleting a user whose counter is already
+# gone does not recreate it. Updates only write counters whose counts
+# changed.
+TRIGGER_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION task_counter_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO task_taskcounter (user_id, total, completed)
+        SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE is_completed)
+        FROM new_rows
+        WHERE deleted IS NULL
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + EXCLUDED.total,
+            completed = task_taskcounter.completed + EXCLUDED.completed;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO task_taskcounter (user_id, total, completed)
+        SELECT user_id, SUM(total), SUM(completed)
+        FROM (
+            SELECT user_id, -1 AS total, -is_completed::int AS completed FROM old_rows WHERE deleted IS NULL
+            UNION ALL
+            SELECT user_id, 1, is_completed::int FROM new_rows WHERE deleted IS NULL
+        ) AS changes
+        GROUP BY user_id
+        HAVING SUM(total) <> 0 OR SUM(completed) <> 0
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + EXCLUDED.total,
+            completed = task_taskcounter.completed + EXCLUDED.completed;
+    ELSE
+        UPDATE task_taskcounter AS counter
+        SET total = counter.total - removed.total,
+            completed = counter.completed - removed.completed
+        FROM (
+            SELECT user_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE is_completed) AS completed
+            FROM old_rows
+            WHERE deleted IS NULL
+            GROUP BY user_id
+        ) AS removed
+        WHERE counter.user_id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGERS_SQL = """
+CREATE TRIGGER task_counter_insert
+AFTER INSERT ON task_task
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_counter_apply();
+
+CREATE TRIGGER task_counter_update
+AFTER UPDATE ON task_task
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_counter_apply();
+
+CREATE TRIGGER task_counter_delete
+AFTER DELETE ON task_task
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_counter_apply();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS task_counter_insert ON task_task;
+DROP TRIGGER IF EXISTS task_counter_update ON task_task;
+DROP TRIGGER IF EXISTS task_counter_delete ON task_task;
+DROP FUNCTION IF EXISTS task_counter_apply();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0007_task_counter'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            row_triggers.DROP_TRIGGERS_SQL + TRIGGER_FUNCTION_SQL + CREATE_TRIGGERS_SQL,
+            DROP_TRIGGERS_SQL + row_triggers.TRIGGER_FUNCTION_SQL + row_triggers.CREATE_TRIGGERS_SQL,
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Soft deleted tasks are filtered out by the model manager rather than in
+# the view, with a filter in the union branch postgres no longer scans the
+# task table in index order and sorts every task of the user instead.
+CREATE_VIEW_SQL = """
+CREATE VIEW task_task_with_archived AS
+SELECT id, title, description, is_completed, created, updated, deleted, user_id, false AS is_archived
+FROM task_task
+UNION ALL
+SELECT id, title, description, is_completed, created, updated, NULL::timestamptz, user_id, true
+FROM task_archivedtask;
+"""
+
+DROP_VIEW_SQL = 'DROP VIEW IF EXISTS task_task_with_archived;'
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('task', '0009_task_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskWithArchived',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=150)),
+                ('description', models.TextField(blank=True)),
+                ('is_completed', models.BooleanField()),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('deleted', models.DateTimeField(null=True)),
+                ('is_archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'task_task_with_archived',
+                'ordering': ['-created', '-id'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTask',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=150)),
+                ('description', models.TextField(blank=True)),
+                ('is_completed', models.BooleanField(default=True)),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_tasks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtask',
+            index=models.Index(fields=['user', '-created', '-id'], name='archived_user_created_id_idx'),
+        ),
+        migrations.RunSQL(CREATE_VIEW_SQL, DROP_VIEW_SQL),
+    ]
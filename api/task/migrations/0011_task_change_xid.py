@@ -0,0 +1,42 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+# Stamps every inserted or updated task with the id of the transaction
+# writing it, the sync feed orders changes by it, see task/sync.py.
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION task_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER task_change_xid
+BEFORE INSERT OR UPDATE ON task_task
+FOR EACH ROW EXECUTE FUNCTION task_change_xid();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS task_change_xid ON task_task;
+DROP FUNCTION IF EXISTS task_change_xid();
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0010_archived_tasks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='change_xid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'change_xid', 'id'], name='task_user_change_xid_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+    ]
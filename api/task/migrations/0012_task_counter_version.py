@@ -0,0 +1,83 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:30
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+statement_triggers = import_module('task.migrations.0008_task_counter_statement_triggers')
+
+# Like the function of 0008, and every statement also gives the counters
+# of the users it touched a new version from task_version_seq, which
+# backs the ETags of the task api. Versions are written in the same
+# transaction as the change, by whichever process made it.
+TRIGGER_FUNCTION_SQL = """
+CREATE SEQUENCE IF NOT EXISTS task_version_seq;
+
+CREATE OR REPLACE FUNCTION task_counter_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO task_taskcounter (user_id, total, completed, version)
+        SELECT user_id,
+               COUNT(*) FILTER (WHERE deleted IS NULL),
+               COUNT(*) FILTER (WHERE deleted IS NULL AND is_completed),
+               nextval('task_version_seq')
+        FROM new_rows
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + EXCLUDED.total,
+            completed = task_taskcounter.completed + EXCLUDED.completed,
+            version = EXCLUDED.version;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO task_taskcounter (user_id, total, completed, version)
+        SELECT user_id, SUM(total), SUM(completed), nextval('task_version_seq')
+        FROM (
+            SELECT user_id, -(deleted IS NULL)::int AS total, -(deleted IS NULL AND is_completed)::int AS completed
+            FROM old_rows
+            UNION ALL
+            SELECT user_id, (deleted IS NULL)::int, (deleted IS NULL AND is_completed)::int FROM new_rows
+        ) AS changes
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + EXCLUDED.total,
+            completed = task_taskcounter.completed + EXCLUDED.completed,
+            version = EXCLUDED.version;
+    ELSE
+        UPDATE task_taskcounter AS counter
+        SET total = counter.total - removed.total,
+            completed = counter.completed - removed.completed,
+            version = nextval('task_version_seq')
+        FROM (
+            SELECT user_id,
+                   COUNT(*) FILTER (WHERE deleted IS NULL) AS total,
+                   COUNT(*) FILTER (WHERE deleted IS NULL AND is_completed) AS completed
+            FROM old_rows
+            GROUP BY user_id
+        ) AS removed
+        WHERE counter.user_id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+DROP_SEQUENCE_SQL = 'DROP SEQUENCE IF EXISTS task_version_seq;'
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0011_task_change_xid'),
+    ]
+    # Supports a task table partitioned by partition_tasks, see task/signals.py.
+    partitioned_tasks = True
+
+    operations = [
+        migrations.AddField(
+            model_name='taskcounter',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            TRIGGER_FUNCTION_SQL,
+            statement_triggers.TRIGGER_FUNCTION_SQL + DROP_SEQUENCE_SQL,
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Rejects every statement writing tasks of a user fenced off this
+# database, see task/shards.py. The error is of class 40 like a
+# serialization failure, so it rolls back the whole transaction and is
+# raised as an OperationalError. Databases without fences only pay for
+# the first check.
+CREATE_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION task_fence_check() RETURNS trigger AS $$
+DECLARE
+    fenced bigint;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM task_taskfence) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        SELECT user_id INTO fenced FROM task_taskfence WHERE user_id IN (SELECT user_id FROM old_rows) LIMIT 1;
+    ELSE
+        SELECT user_id INTO fenced FROM task_taskfence WHERE user_id IN (SELECT user_id FROM new_rows) LIMIT 1;
+    END IF;
+    IF fenced IS NOT NULL THEN
+        RAISE EXCEPTION 'tasks of user % moved to another database', fenced USING ERRCODE = '40S01';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER task_fence_insert
+AFTER INSERT ON task_task
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_fence_check();
+
+CREATE TRIGGER task_fence_update
+AFTER UPDATE ON task_task
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_fence_check();
+
+CREATE TRIGGER task_fence_delete
+AFTER DELETE ON task_task
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_fence_check();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS task_fence_insert ON task_task;
+DROP TRIGGER IF EXISTS task_fence_update ON task_task;
+DROP TRIGGER IF EXISTS task_fence_delete ON task_task;
+DROP FUNCTION IF EXISTS task_fence_check();
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_authtoken'),
+        ('task', '0012_task_counter_version'),
+    ]
+    partitioned_tasks = True
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskFence',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('moved', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:00
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+archive_view = import_module('task.migrations.0010_archived_tasks')
+
+# Like 0010, with the transaction which last wrote each row for the
+# sync feed, see task/sync.py.
+CREATE_VIEW_SQL = """
+CREATE VIEW task_task_with_archived AS
+SELECT id, title, description, is_completed, created, updated, deleted, user_id, false AS is_archived, change_xid
+FROM task_task
+UNION ALL
+SELECT id, title, description, is_completed, created, updated, NULL::timestamptz, user_id, true, change_xid
+FROM task_archivedtask;
+"""
+
+DROP_VIEW_SQL = archive_view.DROP_VIEW_SQL
+
+# Archived tasks are stamped with the transaction archiving them, which
+# is when synced clients learn they are gone, and are still counted by
+# the task counters, so archiving or restoring a task leaves the counts
+# as they are. Tasks archived before are reported by the next sync.
+CREATE_TRIGGERS_SQL = """
+CREATE TRIGGER task_archived_change_xid
+BEFORE INSERT ON task_archivedtask
+FOR EACH ROW EXECUTE FUNCTION task_change_xid();
+
+UPDATE task_archivedtask SET change_xid = txid_current();
+
+CREATE OR REPLACE FUNCTION task_archive_counter_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO task_taskcounter (user_id, total, completed, version)
+        SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE is_completed), nextval('task_version_seq')
+        FROM new_rows
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total = task_taskcounter.total + EXCLUDED.total,
+            completed = task_taskcounter.completed + EXCLUDED.completed,
+            version = EXCLUDED.version;
+    ELSE
+        UPDATE task_taskcounter AS counter
+        SET total = counter.total - removed.total,
+            completed = counter.completed - removed.completed,
+            version = nextval('task_version_seq')
+        FROM (
+            SELECT user_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE is_completed) AS completed
+            FROM old_rows
+            GROUP BY user_id
+        ) AS removed
+        WHERE counter.user_id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER task_archive_counter_insert
+AFTER INSERT ON task_archivedtask
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_archive_counter_apply();
+
+CREATE TRIGGER task_archive_counter_delete
+AFTER DELETE ON task_archivedtask
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION task_archive_counter_apply();
+"""
+
+# The counters of the tasks archived so far, run before the triggers
+# count new ones.
+COUNT_ARCHIVED_SQL = """
+INSERT INTO task_taskcounter (user_id, total, completed, version)
+SELECT user_id, {sign}COUNT(*), {sign}COUNT(*) FILTER (WHERE is_completed), nextval('task_version_seq')
+FROM task_archivedtask
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET total = task_taskcounter.total + EXCLUDED.total,
+    completed = task_taskcounter.completed + EXCLUDED.completed,
+    version = EXCLUDED.version;
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS task_archived_change_xid ON task_archivedtask;
+DROP TRIGGER IF EXISTS task_archive_counter_insert ON task_archivedtask;
+DROP TRIGGER IF EXISTS task_archive_counter_delete ON task_archivedtask;
+DROP FUNCTION IF EXISTS task_archive_counter_apply();
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0013_task_fence'),
+    ]
+    partitioned_tasks = True
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtask',
+            name='change_xid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='restored',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtask',
+            index=models.Index(fields=['user', 'change_xid', 'id'], name='archived_user_change_xid_idx'),
+        ),
+        migrations.RunSQL(
+            DROP_VIEW_SQL + CREATE_VIEW_SQL,
+            DROP_VIEW_SQL + archive_view.CREATE_VIEW_SQL,
+        ),
+        migrations.RunSQL(
+            COUNT_ARCHIVED_SQL.format(sign='') + CREATE_TRIGGERS_SQL,
+            DROP_TRIGGERS_SQL + COUNT_ARCHIVED_SQL.format(sign='-'),
+        ),
+    ]
@@ -1,17 +1,215 @@
 from django.db import models
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.utils import timezone
 
 from django.conf import settings
 
+from .search import task_search_vector
+
+class UserShardedQuerySet(models.QuerySet):
+    """QuerySet of a model stored on the task shard of its user."""
+
+    def create(self, **kwargs):
+        """Create a row, on the shard of its user unless a database was chosen."""
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+class UserShardedManager(models.Manager.from_queryset(UserShardedQuerySet)):
+    """Manager of a model stored on the task shard of its user."""
+
+    def for_user(self, user_id):
+        """Return the rows of a user, on the database the shard router picks for them."""
+        return self.db_manager(hints={'user_id': user_id}).filter(user_id=user_id)
+
+class TaskManager(UserShardedManager):
+    """Manager for tasks which hides soft deleted tasks."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted__isnull=True)
+
 class Task(models.Model):
     """Task model."""
     title = models.CharField(max_length=150)
     description = models.TextField(blank=True)
     is_completed = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    updated = models.DateTimeField(auto_now=True)
+    deleted = models.DateTimeField(null=True, blank=True)
+    # Transaction which last wrote the task, set by a trigger, see task/sync.py.
+    change_xid = models.BigIntegerField(default=0, editable=False)
+    # When the task was last restored from the archive, it is not archived
+    # again before it is as old as an archived task, see task/archive.py.
+    restored = models.DateTimeField(null=True, blank=True, editable=False)
+    # Users live on the default database and tasks on their user's shard,
+    # so the reference is not enforced by a database constraint.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+
+    objects = TaskManager()
+    all_objects = UserShardedManager()
 
     def __str__(self):
         return self.title
 
+    def soft_delete(self):
+        """Mark the task as deleted, keeping a tombstone for sync."""
+        self.deleted = timezone.now()
+        self.save(update_fields=['deleted', 'updated'])
+
     class Meta:
-        ordering = ['-created']
+        ordering = ['-created', '-id']
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='task_user_created_id_idx'),
+            models.Index(fields=['user', 'updated', 'id'], name='task_user_updated_id_idx'),
+            models.Index(fields=['user', 'change_xid', 'id'], name='task_user_change_xid_idx'),
+            GinIndex(task_search_vector(), name='task_search_idx'),
+            models.Index(
+                fields=['user', '-created', '-id'],
+                name='task_user_open_created_idx',
+                condition=models.Q(is_completed=False, deleted__isnull=True),
+            ),
+            models.Index(fields=['user', 'title', 'id'], name='task_user_title_id_idx'),
+            models.Index(
+                models.F('user'),
+                OpClass(Upper('title'), name='text_pattern_ops'),
+                name='task_user_title_prefix_idx',
+            ),
+        ]
+
+class ArchivedTask(models.Model):
+    """
+    Completed task moved out of the task table, see task/archive.py.
+
+    Archived tasks keep their id and times, restoring one moves it back.
+    They are still counted by the task counters and are reported as
+    deleted by the sync feed.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=150)
+    description = models.TextField(blank=True)
+    is_completed = models.BooleanField(default=True)
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    archived = models.DateTimeField(default=timezone.now)
+    # Transaction which archived the task, set by a trigger, see task/sync.py.
+    change_xid = models.BigIntegerField(default=0, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='archived_tasks',
+    )
+
+    objects = UserShardedManager()
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='archived_user_created_id_idx'),
+            models.Index(fields=['user', 'change_xid', 'id'], name='archived_user_change_xid_idx'),
+        ]
+
+class TaskWithArchived(models.Model):
+    """
+    Read only view of the live tasks and the archived ones.
+
+    Lists including archived tasks and the sync feed are served from it,
+    postgres runs their filters on both tables and merges the results.
+    Soft deleted tasks are hidden by the manager, like for `Task`.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=150)
+    description = models.TextField(blank=True)
+    is_completed = models.BooleanField()
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    deleted = models.DateTimeField(null=True)
+    is_archived = models.BooleanField()
+    change_xid = models.BigIntegerField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+
+    objects = TaskManager()
+    all_objects = UserShardedManager()
+
+    class Meta:
+        managed = False
+        db_table = 'task_task_with_archived'
+        ordering = ['-created', '-id']
+
+class TaskCounter(models.Model):
+    """
+    Materialized task counts and version of a user.
+
+    Rows are maintained by database triggers on the task table, in the
+    same transaction as the change, so bulk updates and raw SQL are
+    counted too. Soft deleted tasks are not counted, archived ones are. Every statement
+    writing tasks of the user takes a new `version` from a sequence.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='task_counter',
+        db_constraint=False,
+    )
+    total = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+
+    objects = UserShardedManager()
+
+    def __str__(self):
+        return f'{self.user_id}: {self.completed}/{self.total}'
+
+    @property
+    def open(self):
+        return self.total - self.completed
+
+class TaskShard(models.Model):
+    """
+    Shard directory entry, the database holding the tasks of a user.
+
+    Entries live on the default database. Users without one keep their
+    tasks on the default database, see task/shards.py.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='task_shard',
+    )
+    shard = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.shard}'
+
+class TaskFence(models.Model):
+    """
+    User whose tasks moved off this database.
+
+    Writes of their tasks here are rejected by a trigger, so a process
+    still routing the user here with a stale directory entry fails
+    instead of writing tasks nobody reads, see task/shards.py.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        db_constraint=False,
+    )
+    moved = models.DateTimeField(default=timezone.now)
+
+    objects = UserShardedManager()
+
+    def __str__(self):
+        return f'{self.user_id}: {self.moved}'
@@ -0,0 +1,31 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TaskCursorPagination(CursorPagination):
+    """
+    Keyset pagination for task lists.
+
+    Pages are selected with a `created < position` filter on the
+    `(user, -created, -id)` index, so deep pages cost about the same as
+    the first one. The position is the `created` of the last task of the
+    page only, tasks sharing it are skipped with a small offset kept in
+    the cursor, which the `id` tiebreaker in the ordering makes stable.
+    Cursors are opaque, base64 encoded positions returned in the `next`
+    and `previous` links.
+    """
+    ordering = ('-created', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_values(self, queryset, request, representation, view=None):
+        """
+        Paginate a queryset as `.values()` rows rendered by a `ValuesRepresentation`.
+
+        The ordering columns the cursor is built from are fetched
+        alongside the rendered fields.
+        """
+        ordering = [field.lstrip('-') for field in self.get_ordering(request, queryset, view)]
+        columns = representation.fields + [field for field in ordering if field not in representation.fields]
+        page = self.paginate_queryset(queryset.values(*columns), request, view)
+        return representation.to_representation_many(page)
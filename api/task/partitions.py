@@ -0,0 +1,183 @@
+import re
+import time
+from importlib import import_module
+
+from django.db import connections, transaction
+
+from .models import Task
+
+counter_triggers = import_module('task.migrations.0008_task_counter_statement_triggers')
+archive_view = import_module('task.migrations.0014_archived_task_sync')
+change_xid_trigger = import_module('task.migrations.0011_task_change_xid')
+fence_triggers = import_module('task.migrations.0013_task_fence')
+
+PARTITION_COUNT_SQL = 'SELECT COUNT(*) FROM pg_inherits WHERE inhparent = to_regclass(%s)'
+
+PRIMARY_KEY_SQL = "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'"
+
+INDEXES_SQL = 'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s'
+
+INDEX_RE = re.compile(r'^CREATE (UNIQUE )?INDEX (\S+) ON (?:ONLY )?(\S+) (.*)$', re.DOTALL)
+
+# Keeps the new table up to date with the writes made while it is filled.
+MIRROR_SQL = """
+CREATE FUNCTION {table}_mirror() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {new} WHERE id = OLD.id AND user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {new} SELECT NEW.*;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER {table}_mirror
+AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE FUNCTION {table}_mirror();
+"""
+
+DROP_MIRROR_SQL = """
+DROP TRIGGER IF EXISTS {table}_mirror ON {table};
+DROP FUNCTION IF EXISTS {table}_mirror();
+"""
+
+DROP_COUNTER_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS task_counter_insert ON {table};
+DROP TRIGGER IF EXISTS task_counter_update ON {table};
+DROP TRIGGER IF EXISTS task_counter_delete ON {table};
+"""
+
+# Rows are locked while copied, so a concurrent update or delete either
+# waits for the copy or is mirrored after it.
+COPY_BATCH_SQL = """
+WITH batch AS (
+    SELECT * FROM {table} WHERE id > %s AND id <= %s FOR SHARE
+)
+INSERT INTO {new} SELECT * FROM batch
+ON CONFLICT DO NOTHING
+"""
+
+NEXT_BATCH_SQL = 'SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s) AS batch'
+
+def task_partition_count(using='default'):
+    """Return the number of partitions of the task table, 0 if it is a plain table or missing."""
+    if connections[using].vendor != 'postgresql':
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(PARTITION_COUNT_SQL, [Task._meta.db_table])
+        return cursor.fetchone()[0]
+
+class TaskPartitioner:
+    """
+    Rebuild the task table as `partitions` hash partitions by user, or as a plain table with 0.
+
+    Every task query filters on one user, so postgres prunes them to a
+    single partition and vacuum, index builds and bloat stay per
+    partition. The primary key becomes `(id, user_id)` as it has to
+    include the partition key, ids stay unique through their sequence.
+
+    The new table is created with the indexes of the current one and
+    filled in id order, `batch_size` tasks at a time, while a trigger
+    mirrors the writes made meanwhile. The tables are then swapped in
+    one short transaction, which moves the id sequence, the triggers and
+    the archive view to the new table and drops the old one.
+
+    The migration state keeps describing the plain table, so migrations
+    of the task app only run on a partitioned table when they declare
+    `partitioned_tasks = True`, see task/signals.py.
+    """
+
+    def __init__(self, partitions, using='default', batch_size=10000, sleep=0, progress=None):
+        self.partitions = partitions
+        self.using = using
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.progress = progress
+        self.table = Task._meta.db_table
+        self.new = f'{self.table}_new'
+        self.indexes = []
+
+    def run(self):
+        """Rebuild the table and return how many tasks were copied."""
+        self.create()
+        self.mirror()
+        copied = self.copy()
+        self.swap()
+        return copied
+
+    def execute(self, sql, params=None):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def create(self):
+        """Create the new table, its partitions and indexes."""
+        with transaction.atomic(using=self.using):
+            self.execute(f'DROP TABLE IF EXISTS {self.new}')
+            partition_by = ' PARTITION BY HASH (user_id)' if self.partitions else ''
+            self.execute(
+                f'CREATE TABLE {self.new} (LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                f'{partition_by}'
+            )
+            key = 'id, user_id' if self.partitions else 'id'
+            self.execute(f'ALTER TABLE {self.new} ADD CONSTRAINT {self.new}_pkey PRIMARY KEY ({key})')
+            for remainder in range(self.partitions):
+                self.execute(
+                    f'CREATE TABLE {self.table}_p{self.partitions}_{remainder} PARTITION OF {self.new} '
+                    f'FOR VALUES WITH (MODULUS {self.partitions}, REMAINDER {remainder})'
+                )
+
+            primary_key = self.execute(PRIMARY_KEY_SQL, [self.table])[0][0]
+            for name, definition in self.execute(INDEXES_SQL, [self.table]):
+                if name == primary_key:
+                    continue
+                unique, _, _, rest = INDEX_RE.match(definition).groups()
+                self.execute(f'CREATE {unique or ""}INDEX {name}_new ON {self.new} {rest}')
+                self.indexes.append(name)
+
+    def mirror(self):
+        """Start mirroring the writes to the current table into the new one."""
+        with transaction.atomic(using=self.using):
+            self.execute(DROP_MIRROR_SQL.format(table=self.table))
+            self.execute(MIRROR_SQL.format(table=self.table, new=self.new))
+
+    def copy(self):
+        """Copy the tasks into the new table in batches, each in its own transaction."""
+        copied = last_id = 0
+        while True:
+            with transaction.atomic(using=self.using):
+                upto = self.execute(NEXT_BATCH_SQL.format(table=self.table), [last_id, self.batch_size])[0][0]
+                if upto is None:
+                    return copied
+                with connections[self.using].cursor() as cursor:
+                    cursor.execute(COPY_BATCH_SQL.format(table=self.table, new=self.new), [last_id, upto])
+                    copied += cursor.rowcount
+            last_id = upto
+            if self.progress is not None:
+                self.progress(copied)
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def swap(self):
+        """Replace the current table with the new one."""
+        table, new = self.table, self.new
+        with transaction.atomic(using=self.using):
+            self.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+            self.execute(DROP_MIRROR_SQL.format(table=table))
+            self.execute(DROP_COUNTER_TRIGGERS_SQL.format(table=table))
+            sequence = self.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])[0][0]
+            self.execute(f'ALTER SEQUENCE {sequence} OWNED BY {new}.id')
+            # The view of live and archived tasks depends on the table.
+            self.execute(archive_view.DROP_VIEW_SQL)
+            self.execute(f'DROP TABLE {table}')
+            self.execute(f'ALTER TABLE {new} RENAME TO {table}')
+            self.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey')
+            for name in self.indexes:
+                self.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+            self.execute(counter_triggers.CREATE_TRIGGERS_SQL)
+            self.execute(change_xid_trigger.CREATE_TRIGGER_SQL)
+            self.execute(fence_triggers.CREATE_TRIGGERS_SQL)
+            self.execute(archive_view.CREATE_VIEW_SQL)
+            self.execute(f'ANALYZE {table}')
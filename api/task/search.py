@@ -0,0 +1,48 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import FloatField, Value
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'english'
+SHORT_PREFIX_LENGTH = 3
+
+def task_search_vector():
+    """
+    Return the weighted search document of a task.
+
+    The GIN index on tasks is built from this exact expression, queries
+    must use it unchanged for the index to apply.
+    """
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+def task_search_query(term):
+    """Return a query matching every word of a term as a prefix, None if it has no words."""
+    words = re.findall(r'\w+', term)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+def search_tasks(queryset, term):
+    """
+    Filter tasks matching a search term and annotate their `rank`.
+
+    Terms shorter than SHORT_PREFIX_LENGTH characters are too short for
+    the full-text index and match title prefixes instead, served by the
+    trigram index where the pg_trgm extension is available.
+    """
+    if len(term) < SHORT_PREFIX_LENGTH:
+        return queryset.filter(title__istartswith=term).annotate(rank=Value(0.0, output_field=FloatField()))
+
+    query = task_search_query(term)
+    if query is None:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    vector = task_search_vector()
+    return (
+        queryset
+        .annotate(document=vector, rank=Cast(SearchRank(vector, query), FloatField()))
+        .filter(document=query)
+    )
@@ -1,6 +1,9 @@
 from rest_framework import serializers
 
-from .models import Task
+from core.serializers import ValuesRepresentation
+
+from .models import Task, TaskWithArchived
+from .sync import read_sync_token
 
 class TaskSerializer(serializers.ModelSerializer):
     """Serializer for the task model."""
@@ -15,4 +18,76 @@ class TaskDetailSerializer(TaskSerializer):
 
     class Meta(TaskSerializer.Meta):
         fields = TaskSerializer.Meta.fields + ['description', 'created']
-        read_only_fields = TaskSerializer.Meta.read_only_fields + ['created']
\ No newline at end of file
+        read_only_fields = TaskSerializer.Meta.read_only_fields + ['created']
+
+class TaskWithArchivedSerializer(serializers.ModelSerializer):
+    """Serializer for tasks listed together with the archived ones."""
+
+    class Meta:
+        model = TaskWithArchived
+        fields = TaskSerializer.Meta.fields + ['is_archived']
+
+class TaskWithArchivedDetailSerializer(TaskWithArchivedSerializer):
+    """Detailed serializer for tasks listed together with the archived ones."""
+
+    class Meta(TaskWithArchivedSerializer.Meta):
+        fields = TaskDetailSerializer.Meta.fields + ['is_archived']
+
+task_values = ValuesRepresentation(TaskSerializer)
+task_detail_values = ValuesRepresentation(TaskDetailSerializer)
+archived_task_values = ValuesRepresentation(TaskWithArchivedSerializer)
+archived_task_detail_values = ValuesRepresentation(TaskWithArchivedDetailSerializer)
+
+class TaskBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for deleting many tasks at once."""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class TaskBulkDeleteResultSerializer(serializers.Serializer):
+    """Serializer for the result of a bulk task deletion."""
+    deleted = serializers.ListField(child=serializers.IntegerField())
+    not_found = serializers.ListField(child=serializers.IntegerField())
+
+class TaskSyncSerializer(TaskDetailSerializer):
+    """Serializer for tasks returned by the changes feed."""
+
+    class Meta(TaskDetailSerializer.Meta):
+        fields = TaskDetailSerializer.Meta.fields + ['updated']
+        read_only_fields = TaskDetailSerializer.Meta.read_only_fields + ['updated']
+
+class TaskChangesQuerySerializer(serializers.Serializer):
+    """Serializer for the changes feed query parameters."""
+    since = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=1000, default=500)
+
+    def validate_since(self, value):
+        """Decode the sync token into a position."""
+        if not value:
+            return None
+        try:
+            return read_sync_token(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+class TaskChangesSerializer(serializers.Serializer):
+    """Serializer for a batch of the changes feed."""
+    changed = TaskSyncSerializer(many=True)
+    deleted = serializers.ListField(child=serializers.IntegerField())
+    next = serializers.CharField(allow_null=True)
+    has_more = serializers.BooleanField()
+
+class TaskStatsSerializer(serializers.Serializer):
+    """Serializer for the task counts of a user."""
+    total = serializers.IntegerField()
+    completed = serializers.IntegerField()
+    open = serializers.IntegerField()
+
+class TaskFilterQuerySerializer(serializers.Serializer):
+    """Serializer for the task list filter query parameters."""
+    is_completed = serializers.BooleanField(allow_null=True, default=None)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    title = serializers.CharField(required=False, max_length=255)
+
+class TaskExportQuerySerializer(serializers.Serializer):
+    """Serializer for the export query parameters."""
+    output = serializers.ChoiceField(choices=['json', 'ndjson'], default='json')
@@ -0,0 +1,322 @@
+import csv
+import io
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Q
+
+from .models import ArchivedTask, Task, TaskCounter, TaskFence, TaskShard, TaskWithArchived
+
+SHARD_KEY = 'task-shard:{}'
+
+# Raised by the fence trigger of migration 0013 on writes of moved users.
+SHARD_MOVED_PGCODE = '40S01'
+
+SNAPSHOT_XMIN_SQL = 'SELECT txid_snapshot_xmin(txid_current_snapshot())'
+
+# Every shard hands out task ids from its own range, the n-th shard of
+# DATABASE_SHARDS starts at n << ID_RANGE_BITS, so moved tasks keep
+# their ids without colliding with the tasks of their new shard.
+ID_RANGE_BITS = 40
+
+RESERVE_IDS_SQL = """
+SELECT setval(seq, %s, false)
+FROM (SELECT pg_get_serial_sequence(%s, 'id')::regclass AS seq) AS task_seq
+WHERE COALESCE(pg_sequence_last_value(seq), 0) < %s
+"""
+
+MOVE_COLUMNS = ['id', 'title', 'description', 'is_completed', 'created', 'updated', 'deleted', 'restored', 'user_id']
+
+ARCHIVE_MOVE_COLUMNS = ['id', 'title', 'description', 'is_completed', 'created', 'updated', 'archived', 'user_id']
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+def hash_shard(user_id, shards=None):
+    """Return the shard a new user is placed on, by a hash of the user id."""
+    shards = shards or settings.DATABASE_SHARDS
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+def shard_for_user(user_id):
+    """
+    Return the alias of the database holding the tasks of a user.
+
+    Directory entries are cached for DB_SHARD_CACHE_SECONDS, users
+    without one keep their tasks on the default database. A stale entry
+    cached before a move points at a database fencing the user off, its
+    writes fail with a `is_shard_moved` error.
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    key = SHARD_KEY.format(user_id)
+    shard = cache.get(key)
+    if shard is None:
+        shard = directory_shard(user_id)
+        cache.set(key, shard, settings.DB_SHARD_CACHE_SECONDS)
+    return shard
+
+def directory_shard(user_id):
+    """Return the shard of a user from the directory itself, bypassing the cache."""
+    entry = TaskShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id)
+    return entry.values_list('shard', flat=True).first() or DEFAULT_DB_ALIAS
+
+def set_shard(user_id, shard):
+    """Point the directory entry of a user at a shard."""
+    TaskShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(user_id=user_id, defaults={'shard': shard})
+    cache.set(SHARD_KEY.format(user_id), shard, settings.DB_SHARD_CACHE_SECONDS)
+
+def place_user(user_id):
+    """Put a new user on their hash shard."""
+    if is_sharded():
+        set_shard(user_id, hash_shard(user_id))
+
+def forget_user(user_id):
+    """Drop the cached shard of a user."""
+    cache.delete(SHARD_KEY.format(user_id))
+
+def is_shard_moved(exc):
+    """Return whether a database error was raised by writing tasks of a user moved off the database."""
+    return getattr(exc.__cause__, 'pgcode', None) == SHARD_MOVED_PGCODE
+
+@contextmanager
+def forget_moved_user(user_id):
+    """Drop the cached shard of a user when their tasks turn out to have moved, and re-raise."""
+    try:
+        yield
+    except Exception as exc:
+        if is_shard_moved(exc):
+            forget_user(user_id)
+        raise
+
+def task_db(user_id):
+    """Return the database the tasks of a user are written to."""
+    return router.db_for_write(Task, user_id=user_id)
+
+def task_shard(user_id):
+    """Return the database holding the tasks of a user without routing a write."""
+    shard = shard_for_user(user_id)
+    return shard if shard in settings.DATABASE_SHARDS else DEFAULT_DB_ALIAS
+
+def reserve_id_range(using):
+    """Move the task id sequence of a shard to the start of its id range."""
+    if using not in settings.DATABASE_SHARDS or connections[using].vendor != 'postgresql':
+        return
+    start = settings.DATABASE_SHARDS.index(using) << ID_RANGE_BITS
+    if not start:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(RESERVE_IDS_SQL, [start, Task._meta.db_table, start])
+
+def delete_user_tasks(user_id, using):
+    """Delete the fence, tasks and counter of a user from a shard, without loading them."""
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TaskFence._meta.db_table} WHERE user_id = %s', [user_id])
+        cursor.execute(f'DELETE FROM {Task._meta.db_table} WHERE user_id = %s', [user_id])
+        cursor.execute(f'DELETE FROM {ArchivedTask._meta.db_table} WHERE user_id = %s', [user_id])
+        cursor.execute(f'DELETE FROM {TaskCounter._meta.db_table} WHERE user_id = %s', [user_id])
+
+class TaskShardRouter:
+    """
+    Send the tasks and task counters of a user to the user's shard.
+
+    The user comes from the `user_id` hint of `for_user` querysets and
+    `task_db`, or from the instance being read or saved. Tasks on the
+    default database are left to the next router, so they are still
+    read from replicas. Users are always read from the default database.
+    """
+    sharded_models = (Task, TaskCounter, ArchivedTask, TaskWithArchived)
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if model not in self.sharded_models:
+            # Users and other relations of tasks stay on the default database.
+            if isinstance(instance, self.sharded_models) and instance._state.db != DEFAULT_DB_ALIAS:
+                return DEFAULT_DB_ALIAS
+            return None
+        if isinstance(instance, self.sharded_models) and instance._state.db is not None:
+            shard = instance._state.db
+        else:
+            user_id = hints.get('user_id')
+            if user_id is None and instance is not None:
+                is_user = instance._meta.label == settings.AUTH_USER_MODEL
+                user_id = instance.pk if is_user else getattr(instance, 'user_id', None)
+            if user_id is None:
+                return None
+            shard = shard_for_user(user_id)
+        if shard == DEFAULT_DB_ALIAS or shard not in settings.DATABASE_SHARDS:
+            return None
+        return shard
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, self.sharded_models) or isinstance(obj2, self.sharded_models):
+            return True
+        return None
+
+def copy_value(value):
+    """Return a column value as written to a COPY csv, empty for NULL."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def copy_tasks(using, rows, model=Task, columns=MOVE_COLUMNS):
+    """Write task rows, ids and times included, with COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([copy_value(value) for value in row])
+    buffer.seek(0)
+    sql = (
+        f'COPY {model._meta.db_table} ({", ".join(columns)}) FROM STDIN '
+        'WITH (FORMAT csv, FORCE_NOT_NULL (title, description))'
+    )
+    with connections[using].cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
+
+class TaskMover:
+    """
+    Move the tasks of users between shards in batches.
+
+    Tasks are copied in id order, `batch_size` at a time, while the user
+    keeps working on the source shard. Then, with the source task table
+    locked against writes, the tasks written or deleted meanwhile are
+    caught up, the directory entry is switched, the source tasks are
+    deleted and the user is fenced off the source, in one transaction
+    per database. Processes still routing the user to the source with a
+    cached directory entry have their writes rejected by the fence
+    trigger instead of writing tasks nobody reads. Archived tasks are
+    moved the same way and task counters follow the rows through their
+    triggers.
+    """
+
+    def __init__(self, batch_size=1000, sleep=0, progress=None):
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.progress = progress
+
+    def move(self, user_id, target):
+        """Move the tasks of a user to a shard and return how many the user has there."""
+        source = directory_shard(user_id)
+        if source == target:
+            return 0
+        tasks = Task.all_objects.using(source).filter(user_id=user_id)
+        archived = ArchivedTask.objects.using(source).filter(user_id=user_id)
+        # Left over by an interrupted move or an earlier move off the
+        # target, the source still has them.
+        delete_user_tasks(user_id, target)
+
+        # Transactions below the horizon ended before the copy starts,
+        # the copy sees what they wrote.
+        with connections[source].cursor() as cursor:
+            cursor.execute(SNAPSHOT_XMIN_SQL)
+            since = cursor.fetchone()[0]
+        copied, last_id = self.copy_batches(user_id, target, tasks, MOVE_COLUMNS)
+        self.copy_batches(user_id, target, archived, ARCHIVE_MOVE_COLUMNS, copied=copied)
+
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                self.transfer(user_id, source, target, since=since, after_id=last_id)
+                set_shard(user_id, target)
+        except Exception:
+            forget_user(user_id)
+            raise
+        return Task.all_objects.using(target).filter(user_id=user_id).count()
+
+    def copy_batches(self, user_id, target, queryset, columns, copied=0):
+        """Copy the rows of a queryset to the target in id order and return the count and last id."""
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list(*columns)[:self.batch_size])
+            if not rows:
+                return copied, last_id
+            copy_tasks(target, rows, model=queryset.model, columns=columns)
+            copied += len(rows)
+            last_id = rows[-1][0]
+            if self.progress is not None:
+                self.progress(user_id, copied)
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def transfer(self, user_id, source, target, since=None, after_id=0):
+        """
+        Copy the tasks of a user over their copies on the target, delete them from the source and fence it.
+
+        With `since`, a transaction id horizon, only the tasks written by
+        transactions from it on or with ids above `after_id` are copied,
+        the others were copied before. Copies of tasks deleted from the
+        source are deleted. Archived tasks are never changed, only the
+        ones archived or restored since the copy are added or removed.
+        """
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            with connections[source].cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {Task._meta.db_table}, {ArchivedTask._meta.db_table} IN SHARE MODE')
+            tasks = Task.all_objects.using(source).filter(user_id=user_id)
+            copies = Task.all_objects.using(target).filter(user_id=user_id)
+            deleted = set(copies.values_list('id', flat=True)) - set(tasks.values_list('id', flat=True))
+            if deleted:
+                copies.filter(id__in=deleted).delete()
+            if since is not None:
+                tasks = tasks.filter(Q(id__gt=after_id) | Q(change_xid__gte=since))
+            rows = list(tasks.values_list(*MOVE_COLUMNS))
+            if rows:
+                with connections[target].cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {Task._meta.db_table} WHERE id = ANY(%s)', [[row[0] for row in rows]])
+                copy_tasks(target, rows)
+
+            archived = ArchivedTask.objects.using(source).filter(user_id=user_id)
+            source_ids = set(archived.values_list('id', flat=True))
+            copies = ArchivedTask.objects.using(target).filter(user_id=user_id)
+            target_ids = set(copies.values_list('id', flat=True))
+            if target_ids - source_ids:
+                copies.filter(id__in=target_ids - source_ids).delete()
+            if source_ids - target_ids:
+                missing = archived.filter(id__in=source_ids - target_ids).values_list(*ARCHIVE_MOVE_COLUMNS)
+                copy_tasks(target, missing, model=ArchivedTask, columns=ARCHIVE_MOVE_COLUMNS)
+
+            delete_user_tasks(user_id, source)
+            TaskFence.objects.using(source).create(user_id=user_id)
+            return len(rows)
+
+def shard_loads():
+    """Return the task count of every user with tasks, per shard."""
+    return {
+        shard: dict(TaskCounter.objects.using(shard).filter(total__gt=0).values_list('user_id', 'total'))
+        for shard in settings.DATABASE_SHARDS
+    }
+
+def plan_rebalance(loads):
+    """
+    Return the `(user_id, source, target)` moves evening out the task counts of the shards.
+
+    The fullest shard gives its largest user that fits in half the gap
+    to the emptiest shard, until no user fits.
+    """
+    loads = {shard: dict(users) for shard, users in loads.items()}
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    moves = []
+    while len(totals) > 1:
+        source = max(totals, key=totals.get)
+        target = min(totals, key=totals.get)
+        gap = totals[source] - totals[target]
+        fitting = [(count, user_id) for user_id, count in loads[source].items() if 2 * count <= gap]
+        if not fitting:
+            break
+        count, user_id = max(fitting)
+        del loads[source][user_id]
+        loads[target][user_id] = count
+        totals[source] -= count
+        totals[target] += count
+        moves.append((user_id, source, target))
+    return moves
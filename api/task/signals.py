@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.core.management.base import CommandError
+from django.db.models.signals import post_migrate, post_save, pre_delete, pre_migrate
+from django.dispatch import receiver
+
+from .partitions import task_partition_count
+from .shards import delete_user_tasks, forget_user, place_user, reserve_id_range, shard_for_user
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def place_new_user(sender, instance, created, **kwargs):
+    """Put the tasks of a new user on a shard."""
+    if created:
+        place_user(instance.pk)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_sharded_tasks(sender, instance, using, **kwargs):
+    """Delete the tasks a deleted user has on another shard than the default database."""
+    user_id = instance.pk
+    shard = shard_for_user(user_id)
+    if shard != DEFAULT_DB_ALIAS:
+        transaction.on_commit(lambda: delete_user_tasks(user_id, shard), using=using)
+        transaction.on_commit(lambda: forget_user(user_id), using=using)
+
+
+@receiver(pre_migrate)
+def refuse_migrating_partitioned_tasks(sender, using, plan, **kwargs):
+    """
+    Stop task migrations not written for a task table partitioned by partition_tasks.
+
+    The migration state knows nothing of the partitions, the composite
+    primary key or the rebuilt indexes, so a migration altering the
+    table could fail halfway or undo them. Migrations that work on both
+    layouts declare `partitioned_tasks = True`.
+    """
+    if sender.name != 'task' or not plan:
+        return
+    unsafe = [
+        migration.name for migration, backwards in plan
+        if migration.app_label == 'task' and not getattr(migration, 'partitioned_tasks', False)
+    ]
+    if unsafe and task_partition_count(using):
+        raise CommandError(
+            f'The task table of {using} is partitioned and task migrations {", ".join(unsafe)} '
+            'do not support it. Run partition_tasks --partitions 0 first and partition again afterwards.'
+        )
+
+
+@receiver(post_migrate)
+def reserve_task_ids(sender, using, **kwargs):
+    """Start the task ids of a migrated shard at its id range."""
+    if sender.name == 'task':
+        reserve_id_range(using)
@@ -0,0 +1,56 @@
+from django.core import signing
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+SYNC_TOKEN_SALT = 'task.sync'
+
+# Every transaction with an id below the horizon has ended, so no task
+# can still appear below it. The transaction reading is let through when
+# it is the oldest running one, it sees its own writes.
+SYNC_HORIZON_SQL = """
+txid_snapshot_xmin(txid_current_snapshot())
++ (txid_current_if_assigned() IS NOT DISTINCT FROM txid_snapshot_xmin(txid_current_snapshot()))::int
+"""
+
+def make_sync_token(task, shard):
+    """Return an opaque token pointing just past a task of a shard in sync order."""
+    return signing.dumps([task.change_xid, task.id, shard], salt=SYNC_TOKEN_SALT)
+
+def read_sync_token(token):
+    """
+    Return the (change_xid, id, shard) position of a sync token, raise ValueError if invalid.
+
+    Tokens of the former `(updated, id)` format return None, their
+    clients sync again from the start.
+    """
+    try:
+        position = signing.loads(token, salt=SYNC_TOKEN_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise ValueError('Invalid sync token.')
+    if isinstance(position, list) and len(position) == 2 and isinstance(position[0], str):
+        return None
+    if (
+        not isinstance(position, list) or len(position) != 3
+        or not all(isinstance(value, int) for value in position[:2]) or not isinstance(position[2], str)
+    ):
+        raise ValueError('Invalid sync token.')
+    return tuple(position)
+
+def changes_since(queryset, position, limit):
+    """
+    Return up to `limit` tasks changed after a position and whether more remain.
+
+    Tasks are walked in (change_xid, id) order, the transaction ids the
+    tasks were last written by. Only the changes of ended transactions
+    are returned, so a transaction committing after a later one cannot
+    land behind a token already handed out and no change is missed.
+    Soft deleted tasks are included.
+    """
+    queryset = queryset.filter(change_xid__lt=RawSQL(SYNC_HORIZON_SQL, []))
+    if position is not None:
+        change_xid, task_id = position[:2]
+        queryset = queryset.filter(change_xid__gte=change_xid).filter(
+            Q(change_xid__gt=change_xid) | Q(id__gt=task_id)
+        )
+    tasks = list(queryset.order_by('change_xid', 'id')[:limit + 1])
+    return tasks[:limit], len(tasks) > limit
@@ -1,19 +1,78 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import os
+import re
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, migrations, transaction
+from django.db.utils import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient, force_authenticate
 
-from .models import Task
-from .serializers import TaskSerializer, TaskDetailSerializer
+from core.authentication import token_cache
+from core.concurrency import close_db_connections
+from core.models import Job
+from user.models import AuthToken
+
+from .archive import TaskArchiver, restore_tasks
+from .imports import TaskImportCommitError, TaskImporter
+from .models import ArchivedTask, Task, TaskCounter, TaskFence, TaskShard, TaskWithArchived
+from .partitions import TaskPartitioner, task_partition_count
+from .serializers import TaskSerializer, TaskDetailSerializer, task_values, task_detail_values
+from .shards import (
+    ARCHIVE_MOVE_COLUMNS,
+    ID_RANGE_BITS,
+    MOVE_COLUMNS,
+    SHARD_KEY,
+    TaskMover,
+    hash_shard,
+    plan_rebalance,
+    reserve_id_range,
+    set_shard,
+    shard_for_user,
+)
+from .signals import refuse_migrating_partitioned_tasks
+from .sync import SYNC_TOKEN_SALT
 
 TASKS_URL = reverse('task:task-list')
+BULK_URL = reverse('task:task-bulk')
+CHANGES_URL = reverse('task:task-changes')
+EXPORT_URL = reverse('task:task-export')
+STATS_URL = reverse('task:task-stats')
+CLEAR_COMPLETED_URL = reverse('task:task-clear-completed')
+ASYNC_TASKS_URL = reverse('task:async-task-list')
+EXPORT_MEMORY_ROWS = int(os.environ.get('TASK_EXPORT_MEMORY_ROWS', 20000))
+QUERY_PLAN_ROWS = 2000
+QUERY_BUDGET_SIZES = [1, 10, 100]
+# Configured by api/test_settings.py.
+SHARD_ALIASES = ['shard1', 'shard2']
 
 def detail_task(task_id):
     """Create and return a task detail url."""
     return reverse('task:task-detail', args=[task_id])
 
+def async_detail_task(task_id):
+    """Create and return an async task detail url."""
+    return reverse('task:async-task-detail', args=[task_id])
+
 def create_task(title='test title', description='test description', user=None):
     """Create and return a task."""
     return Task.objects.create(title=title, description=description, user=user)
@@ -35,6 +94,36 @@ class TaskModelTests(TestCase):
         self.assertEqual(task.description, 'test dsc')
         self.assertFalse(task.is_completed)
 
+class TaskValuesRepresentationTests(TestCase):
+    """Test the values fast path renders like the task serializers."""
+
+    def setUp(self):
+        self.user = create_user()
+        create_task(title='first', description='', user=self.user)
+        create_task(title='zażółć "quoted"', description='multi\nline', user=self.user)
+
+    def test_list_representation_matches_serializer(self):
+        """Test list rows render to the same bytes as TaskSerializer."""
+        rows = Task.objects.values(*task_values.fields)
+        serializer = TaskSerializer(Task.objects.all(), many=True)
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(task_values.to_representation_many(rows)),
+            renderer.render(serializer.data),
+        )
+
+    def test_detail_representation_matches_serializer(self):
+        """Test detail rows render to the same bytes as TaskDetailSerializer."""
+        rows = Task.objects.values(*task_detail_values.fields)
+        serializer = TaskDetailSerializer(Task.objects.all(), many=True)
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(task_detail_values.to_representation_many(rows)),
+            renderer.render(serializer.data),
+        )
+
 class PublicTaskApiTests(TestCase):
     """Test public task api."""
 
@@ -76,7 +165,7 @@ class PrivateTaskApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         tasks = Task.objects.all()
         serializer = TaskSerializer(tasks, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
     def test_task_list_limited_to_user(self):
         """Test task list is limited to owner."""
@@ -88,7 +177,7 @@ class PrivateTaskApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         tasks = Task.objects.filter(user=self.user)
         serializer = TaskSerializer(tasks, many=True)
-        self.assertEqual(serializer.data, response.data)
+        self.assertEqual(serializer.data, response.data['results'])
 
     def test_create_task(self):
         """Test create a task."""
@@ -115,6 +204,12 @@ class PrivateTaskApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(serializer.data, response.data)
 
+    def test_retrieve_task_detail_invalid_id(self):
+        """Test retrieve task detail with a malformed id returns 404."""
+        response = self.client.get(detail_task('invalid'))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_update_task_success(self):
         """Test edit task is successful."""
         task = create_task(title='test task', description='test description', user=self.user)
@@ -136,4 +231,1347 @@ class PrivateTaskApiTests(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         exists = Task.objects.filter(id=task.id).exists()
-        self.assertFalse(exists)
\ No newline at end of file
+        self.assertFalse(exists)
+        self.assertIsNotNone(Task.all_objects.get(id=task.id).deleted)
+
+    def test_task_list_paginated_with_cursor(self):
+        """Test task list is split into pages linked by cursors."""
+        for i in range(5):
+            create_task(title=f'task {i}', user=self.user)
+        response = self.client.get(TASKS_URL, {'page_size': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['previous'])
+        self.assertIn('cursor=', response.data['next'])
+
+    def test_task_list_cursor_walks_all_tasks_in_order(self):
+        """Test following next cursors returns every task exactly once."""
+        for i in range(7):
+            create_task(title=f'task {i}', user=self.user)
+        ids = []
+        url = f'{TASKS_URL}?page_size=3'
+        while url:
+            response = self.client.get(url)
+            ids.extend(task['id'] for task in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Task.objects.filter(user=self.user).values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_task_list_cursor_stable_for_equal_created(self):
+        """Test tasks sharing a created timestamp are ordered by id and not skipped."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(4)]
+        Task.objects.filter(id__in=[t.id for t in tasks]).update(created=tasks[0].created)
+        ids = []
+        url = f'{TASKS_URL}?page_size=3'
+        while url:
+            response = self.client.get(url)
+            ids.extend(task['id'] for task in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(ids, sorted((t.id for t in tasks), reverse=True))
+
+    def test_search_ranks_title_matches_first(self):
+        """Test search returns matching tasks with title matches ranked first."""
+        in_description = create_task(title='weekly chores', description='buy groceries', user=self.user)
+        in_title = create_task(title='groceries', description='milk and bread', user=self.user)
+        create_task(title='call mom', description='about the weekend', user=self.user)
+        response = self.client.get(TASKS_URL, {'search': 'grocer'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['results']], [in_title.id, in_description.id])
+
+    def test_search_limited_to_user(self):
+        """Test search does not return other users tasks."""
+        other_user = create_user(username='otheruser', email='other@example.com')
+        create_task(title='groceries', user=other_user)
+        response = self.client.get(TASKS_URL, {'search': 'groceries'})
+
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_short_term_matches_title_prefix(self):
+        """Test terms too short for full-text search match title prefixes."""
+        task = create_task(title='Go jogging', user=self.user)
+        create_task(title='ego', user=self.user)
+        response = self.client.get(TASKS_URL, {'search': 'go'})
+
+        self.assertEqual([result['id'] for result in response.data['results']], [task.id])
+
+    def test_search_cursor_walks_all_results(self):
+        """Test following next cursors returns every search result exactly once."""
+        tasks = [create_task(title=f'report {i}', user=self.user) for i in range(5)]
+        create_task(title='unrelated', user=self.user)
+        ids = []
+        url = f'{TASKS_URL}?search=report&page_size=2'
+        while url:
+            response = self.client.get(url)
+            ids.extend(task['id'] for task in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(sorted(ids), sorted(task.id for task in tasks))
+
+    def test_filter_by_completion(self):
+        """Test filtering the task list by completion state."""
+        open_task = create_task(title='open', user=self.user)
+        Task.objects.create(title='done', is_completed=True, user=self.user)
+        response = self.client.get(TASKS_URL, {'is_completed': 'false'})
+
+        self.assertEqual([task['id'] for task in response.data['results']], [open_task.id])
+
+    def test_filter_by_created_range(self):
+        """Test filtering the task list by a created time range."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(3)]
+        for days, task in zip([3, 2, 1], tasks):
+            Task.objects.filter(id=task.id).update(created=timezone.now() - timedelta(days=days))
+        params = {
+            'created_after': (timezone.now() - timedelta(days=2, hours=1)).isoformat(),
+            'created_before': (timezone.now() - timedelta(days=1, hours=1)).isoformat(),
+        }
+        response = self.client.get(TASKS_URL, params)
+
+        self.assertEqual([task['id'] for task in response.data['results']], [tasks[1].id])
+
+    def test_filter_by_title_prefix(self):
+        """Test filtering the task list by a case insensitive title prefix."""
+        task = create_task(title='Buy milk', user=self.user)
+        create_task(title='Call the bank', user=self.user)
+        response = self.client.get(TASKS_URL, {'title': 'buy'})
+
+        self.assertEqual([result['id'] for result in response.data['results']], [task.id])
+
+    def test_filter_invalid_value(self):
+        """Test an invalid filter value returns an error."""
+        response = self.client.get(TASKS_URL, {'created_after': 'yesterday'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ordering_by_title_walks_all_tasks(self):
+        """Test ordering by title paginates every task once in title order."""
+        titles = ['b', 'a', 'c', 'a', 'd']
+        for title in titles:
+            create_task(title=title, user=self.user)
+        result = []
+        url = f'{TASKS_URL}?ordering=title&page_size=2'
+        while url:
+            response = self.client.get(url)
+            result.extend(task['title'] for task in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(result, sorted(titles))
+
+    def test_ordering_by_unknown_field_ignored(self):
+        """Test ordering by a field outside the whitelist keeps the default order."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(3)]
+        response = self.client.get(TASKS_URL, {'ordering': 'description'})
+
+        self.assertEqual([task['id'] for task in response.data['results']], [t.id for t in reversed(tasks)])
+
+    def test_bulk_create_tasks(self):
+        """Test creating many tasks in one request."""
+        payload = [
+            {'title': 'first', 'description': 'first description'},
+            {'title': 'second', 'is_completed': True},
+        ]
+        response = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([task['title'] for task in response.data], ['first', 'second'])
+        tasks = Task.objects.filter(user=self.user)
+        self.assertEqual(tasks.count(), 2)
+        self.assertTrue(tasks.get(title='second').is_completed)
+
+    def test_bulk_create_invalid_item_creates_nothing(self):
+        """Test an invalid item returns per item errors and creates no tasks."""
+        payload = [{'title': 'valid'}, {'description': 'missing title'}]
+        response = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('title', response.data[1])
+        self.assertFalse(Task.objects.exists())
+
+    def test_bulk_update_tasks(self):
+        """Test partially updating many tasks in one request."""
+        first = create_task(title='first', user=self.user)
+        second = create_task(title='second', user=self.user)
+        payload = [
+            {'id': first.id, 'is_completed': True},
+            {'id': second.id, 'title': 'updated'},
+        ]
+        response = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.is_completed)
+        self.assertEqual(first.title, 'first')
+        self.assertEqual(second.title, 'updated')
+
+    def test_bulk_update_other_users_task_not_found(self):
+        """Test bulk update can not modify tasks of other users."""
+        other_user = create_user(username='anotheruser', email='another@example.com')
+        own = create_task(title='own', user=self.user)
+        other = create_task(title='other', user=other_user)
+        payload = [{'id': own.id, 'title': 'changed'}, {'id': other.id, 'title': 'changed'}]
+        response = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[1], {'id': ['Not found.']})
+        own.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(own.title, 'own')
+        self.assertEqual(other.title, 'other')
+
+    def test_bulk_delete_tasks(self):
+        """Test deleting many tasks limited to the owner."""
+        other_user = create_user(username='anotheruser', email='another@example.com')
+        own = create_task(user=self.user)
+        other = create_task(user=other_user)
+        response = self.client.delete(BULK_URL, {'ids': [own.id, other.id]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': [own.id], 'not_found': [other.id]})
+        self.assertFalse(Task.objects.filter(id=own.id).exists())
+        self.assertTrue(Task.objects.filter(id=other.id).exists())
+
+    def test_stats_counts_tasks(self):
+        """Test stats returns the total, completed and open task counts."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(4)]
+        create_task(user=create_user(username='otheruser', email='other@example.com'))
+        self.client.patch(detail_task(tasks[0].id), {'is_completed': True})
+        self.client.delete(detail_task(tasks[1].id))
+        with self.assertNumQueries(1):
+            response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'total': 3, 'completed': 1, 'open': 2})
+
+    def test_stats_without_tasks(self):
+        """Test stats of a user without tasks are zero."""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data, {'total': 0, 'completed': 0, 'open': 0})
+
+    def test_stats_follow_bulk_changes(self):
+        """Test stats follow tasks created, updated and deleted in bulk."""
+        response = self.client.post(BULK_URL, [{'title': f'task {i}'} for i in range(3)], format='json')
+        ids = [task['id'] for task in response.data]
+        self.client.patch(BULK_URL, [{'id': i, 'is_completed': True} for i in ids[:2]], format='json')
+        self.client.delete(BULK_URL, {'ids': [ids[0]]}, format='json')
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data, {'total': 2, 'completed': 1, 'open': 1})
+
+    def test_export_json(self):
+        """Test exporting tasks as a json array matching the detail serializer."""
+        create_task(title='first', user=self.user)
+        create_task(title='second', user=self.user)
+        response = self.client.get(EXPORT_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(b''.join(response.streaming_content))
+        tasks = Task.objects.filter(user=self.user)
+        self.assertEqual(data, TaskDetailSerializer(tasks, many=True).data)
+
+    def test_export_ndjson_limited_to_user(self):
+        """Test exporting tasks as ndjson only includes the user's tasks."""
+        other_user = create_user(username='anotheruser', email='another@example.com')
+        create_task(title='other', user=other_user)
+        task = create_task(title='own', user=self.user)
+        response = self.client.get(EXPORT_URL, {'output': 'ndjson'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [TaskDetailSerializer(task).data])
+
+    def test_export_memory_constant(self):
+        """
+        Test export memory does not grow with the number of tasks.
+
+        Set TASK_EXPORT_MEMORY_ROWS=1000000 to profile a full million rows.
+        """
+        batch = 10000
+        for start in range(0, EXPORT_MEMORY_ROWS, batch):
+            Task.objects.bulk_create(
+                Task(title=f'task {i}', description='description', user=self.user)
+                for i in range(start, min(start + batch, EXPORT_MEMORY_ROWS))
+            )
+        response = self.client.get(EXPORT_URL, {'output': 'ndjson'})
+
+        tracemalloc.start()
+        try:
+            lines = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, EXPORT_MEMORY_ROWS)
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+class TaskSyncTests(TransactionTestCase):
+    """Test the changes feed, every request commits like in production."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+
+    def test_changes_without_token_returns_all_tasks(self):
+        """Test the first sync returns every task and a sync token."""
+        first = create_task(title='first', user=self.user)
+        second = create_task(title='second', user=self.user)
+        response = self.client.get(CHANGES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['changed']], [first.id, second.id])
+        self.assertEqual(response.data['deleted'], [])
+        self.assertFalse(response.data['has_more'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_changes_since_token_returns_only_changes(self):
+        """Test syncing with a token returns only updated and deleted tasks."""
+        unchanged = create_task(title='unchanged', user=self.user)
+        updated = create_task(title='updated', user=self.user)
+        deleted = create_task(title='deleted', user=self.user)
+        token = self.client.get(CHANGES_URL).data['next']
+
+        self.client.patch(detail_task(updated.id), {'is_completed': True})
+        self.client.delete(detail_task(deleted.id))
+        response = self.client.get(CHANGES_URL, {'since': token})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['changed']], [updated.id])
+        self.assertTrue(response.data['changed'][0]['is_completed'])
+        self.assertEqual(response.data['deleted'], [deleted.id])
+        self.assertNotIn(unchanged.id, [task['id'] for task in response.data['changed']])
+
+    def test_changes_returned_in_bounded_batches(self):
+        """Test the changes feed is split into batches linked by tokens, also within one transaction."""
+        with transaction.atomic():
+            tasks = [create_task(title=f'task {i}', user=self.user) for i in range(5)]
+        ids = []
+        params = {'limit': 2}
+        while True:
+            response = self.client.get(CHANGES_URL, params)
+            ids.extend(task['id'] for task in response.data['changed'])
+            params['since'] = response.data['next']
+            if not response.data['has_more']:
+                break
+
+        self.assertEqual(ids, [task.id for task in tasks])
+
+    def test_changes_invalid_token(self):
+        """Test a tampered sync token is rejected."""
+        response = self.client.get(CHANGES_URL, {'since': 'invalid'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('since', response.data)
+
+    def test_changes_wait_for_earlier_transactions(self):
+        """Test a change committed after a later one is not skipped by the tokens handed out meanwhile."""
+        first = create_task(title='first', user=self.user)
+        token = self.client.get(CHANGES_URL).data['next']
+        other = connections.create_connection('default')
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute('SELECT txid_current()')
+                fast = create_task(title='fast', user=self.user)
+                response = self.client.get(CHANGES_URL, {'since': token})
+                self.assertEqual(response.data['changed'], [])
+                token = response.data['next']
+                cursor.execute(
+                    'INSERT INTO task_task (title, description, is_completed, created, updated, user_id) '
+                    'VALUES (%s, %s, false, now(), now(), %s) RETURNING id',
+                    ['slow', '', self.user.id],
+                )
+                slow_id = cursor.fetchone()[0]
+            other.commit()
+        finally:
+            other.close()
+
+        response = self.client.get(CHANGES_URL, {'since': token})
+        self.assertEqual([task['id'] for task in response.data['changed']], [slow_id, fast.id])
+        self.assertNotIn(first.id, [task['id'] for task in response.data['changed']])
+
+    def test_changes_token_of_other_shard_syncs_from_start(self):
+        """Test a token handed out before the user moved shards returns every task again."""
+        task = create_task(user=self.user)
+        token = signing.dumps([2 ** 40, task.id, 'shard1'], salt=SYNC_TOKEN_SALT)
+        response = self.client.get(CHANGES_URL, {'since': token})
+
+        self.assertEqual([item['id'] for item in response.data['changed']], [task.id])
+
+    def test_changes_legacy_token_syncs_from_start(self):
+        """Test a token of the former format returns every task again."""
+        task = create_task(user=self.user)
+        token = signing.dumps([task.updated.isoformat(), task.id], salt=SYNC_TOKEN_SALT)
+        response = self.client.get(CHANGES_URL, {'since': token})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['changed']], [task.id])
+
+class TaskCounterTests(TestCase):
+    """Test the materialized task counters."""
+
+    def test_rebuild_counters(self):
+        """Test the rebuild command recounts tasks of every user."""
+        user = create_user()
+        create_task(user=user)
+        Task.objects.create(title='done', is_completed=True, user=user)
+        TaskCounter.objects.all().delete()
+        other_user = create_user(username='otheruser', email='other@example.com')
+        TaskCounter.objects.create(user=other_user, total=5, version=7)
+        out = io.StringIO()
+        call_command('rebuild_task_counters', stdout=out)
+
+        self.assertIn('1 users', out.getvalue())
+        self.assertEqual(
+            list(TaskCounter.objects.order_by('user_id').values_list('user_id', 'total', 'completed', 'version')),
+            [(user.id, 2, 1, TaskCounter.objects.get(user=user).version), (other_user.id, 0, 0, 7)],
+        )
+
+    def test_deleting_user_drops_counter(self):
+        """Test deleting a user with tasks removes its counter."""
+        user = create_user()
+        create_task(user=user)
+        user.delete()
+
+        self.assertFalse(TaskCounter.objects.exists())
+
+@tag('query_budget')
+class TaskQueryBudgetTests(TestCase):
+    """Test task endpoints run a fixed number of queries whatever the number of tasks."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = create_user()
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        # Authenticate once so the budgets below exclude the token lookup.
+        self.client.get(STATS_URL)
+
+    def seed(self, size):
+        """Give the user `size` tasks and return their ids."""
+        missing = size - Task.objects.filter(user=self.user).count()
+        Task.objects.bulk_create(
+            Task(title=f'task {i}', description='description', is_completed=i % 3 == 0, user=self.user)
+            for i in range(missing)
+        )
+        return list(Task.objects.filter(user=self.user).values_list('id', flat=True))
+
+    def assertQueryBudget(self, budget, request):
+        """Assert a request runs `budget` queries for every number of tasks."""
+        for size in QUERY_BUDGET_SIZES:
+            with self.subTest(size=size):
+                ids = self.seed(size)
+                with self.assertNumQueries(budget):
+                    response = request(ids)
+                self.assertLess(response.status_code, 400)
+
+    def test_token_authentication(self):
+        """Test an uncached token costs one query for the token and its user."""
+        def request(ids):
+            token_cache.clear()
+            return self.client.get(STATS_URL)
+
+        self.assertQueryBudget(2, request)
+
+    def test_list(self):
+        """Test listing a page of tasks reads the task version and the page."""
+        self.assertQueryBudget(2, lambda ids: self.client.get(TASKS_URL, {'page_size': len(ids)}))
+
+    def test_list_filtered_and_searched(self):
+        """Test filters, search and ordering add no queries to the list."""
+        params = {'is_completed': 'false', 'search': 'task', 'ordering': 'title'}
+        self.assertQueryBudget(2, lambda ids: self.client.get(TASKS_URL, params))
+
+    def test_retrieve(self):
+        """Test retrieving a task reads the task version and the task."""
+        self.assertQueryBudget(2, lambda ids: self.client.get(detail_task(ids[0])))
+
+    def test_create(self):
+        """Test creating a task runs one insert."""
+        self.assertQueryBudget(1, lambda ids: self.client.post(TASKS_URL, {'title': 'new'}))
+
+    def test_update(self):
+        """Test updating a task loads and saves it."""
+        self.assertQueryBudget(2, lambda ids: self.client.patch(detail_task(ids[0]), {'is_completed': True}))
+
+    def test_delete(self):
+        """Test deleting a task loads and soft deletes it."""
+        self.assertQueryBudget(2, lambda ids: self.client.delete(detail_task(ids[0])))
+
+    def test_bulk_create(self):
+        """Test bulk creating runs one insert in a savepoint."""
+        def request(ids):
+            return self.client.post(BULK_URL, [{'title': f'new {i}'} for i in range(len(ids))], format='json')
+
+        self.assertQueryBudget(3, request)
+
+    def test_bulk_update(self):
+        """Test bulk updating locks and updates all tasks at once."""
+        def request(ids):
+            return self.client.patch(BULK_URL, [{'id': i, 'is_completed': True} for i in ids], format='json')
+
+        self.assertQueryBudget(4, request)
+
+    def test_bulk_delete(self):
+        """Test bulk deleting locks and deletes all tasks at once."""
+        self.assertQueryBudget(4, lambda ids: self.client.delete(BULK_URL, {'ids': ids}, format='json'))
+
+    def test_changes(self):
+        """Test reading the changes feed runs one query."""
+        self.assertQueryBudget(1, lambda ids: self.client.get(CHANGES_URL))
+
+    def test_export(self):
+        """Test exporting streams every task from one query."""
+        def request(ids):
+            response = self.client.get(EXPORT_URL)
+            b''.join(response.streaming_content)
+            return response
+
+        self.assertQueryBudget(1, request)
+
+    def test_stats(self):
+        """Test stats are read from one counter row."""
+        self.assertQueryBudget(1, lambda ids: self.client.get(STATS_URL))
+
+class TaskQueryPlanTests(TestCase):
+    """Test the task list filters are served by their indexes."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        other_user = create_user(username='otheruser', email='other@example.com')
+        Task.objects.bulk_create([
+            Task(
+                title=f'task {i}',
+                description='quarterly report' if i % 100 == 0 else 'notes',
+                is_completed=i % 4 != 0,
+                user=user,
+            )
+            for user in [self.user, other_user]
+            for i in range(QUERY_PLAN_ROWS)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE task_task')
+
+    def explain_list(self, params):
+        """Return the query plan of the task list query for the given parameters."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(TASKS_URL, params)
+        sql = [query['sql'] for query in queries.captured_queries if 'FROM "task_task"' in query['sql']][-1]
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_plans_use_indexes(self):
+        """Test each filter and ordering is answered from its index."""
+        cases = [
+            ({}, 'task_user_created_id_idx'),
+            ({'is_completed': 'false'}, 'task_user_open_created_idx'),
+            ({'created_after': '2022-01-01T00:00:00Z'}, 'task_user_created_id_idx'),
+            ({'title': 'task 1999'}, 'task_user_title_prefix_idx'),
+            ({'ordering': 'title'}, 'task_user_title_id_idx'),
+            ({'ordering': '-updated'}, 'task_user_updated_id_idx'),
+            ({'search': 'quarterly'}, 'task_search_idx'),
+        ]
+        for params, index in cases:
+            with self.subTest(params=params):
+                self.assertIn(index, self.explain_list(params))
+
+class TaskConditionalGetTests(TestCase):
+    """Test conditional requests and response caching of the task api."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+        self.task = create_task(user=self.user)
+
+    def test_list_not_modified(self):
+        """Test a matching If-None-Match returns 304 after reading only the task version."""
+        response = self.client.get(TASKS_URL)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_not_modified(self):
+        """Test a matching If-None-Match on a task detail returns 304."""
+        etag = self.client.get(detail_task(self.task.id))['ETag']
+        response = self.client.get(detail_task(self.task.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_task_change_modifies_etag(self):
+        """Test changing a task returns the full response again."""
+        etag = self.client.get(TASKS_URL)['ETag']
+        self.client.patch(detail_task(self.task.id), {'is_completed': True})
+        response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['results'][0]['is_completed'])
+
+    def test_bulk_change_modifies_etag(self):
+        """Test bulk writes start a new task version."""
+        etag = self.client.get(TASKS_URL)['ETag']
+        self.client.post(BULK_URL, [{'title': 'new'}], format='json')
+        response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_change_outside_requests_modifies_etag(self):
+        """Test writes of other processes, like job workers, start a new version without the cache."""
+        etag = self.client.get(TASKS_URL)['ETag']
+        Task.objects.filter(id=self.task.id).update(title='renamed by a job')
+        response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['title'], 'renamed by a job')
+
+    def test_etag_survives_cache_loss(self):
+        """Test the version is read from the database, so a cleared cache keeps the ETag."""
+        etag = self.client.get(TASKS_URL)['ETag']
+        cache.clear()
+        response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_not_shared_between_users(self):
+        """Test another user's ETag does not match."""
+        etag = self.client.get(TASKS_URL)['ETag']
+        other_user = create_user(username='anotheruser', email='another@example.com')
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(TASKS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(TASK_LIST_CACHE_TIMEOUT=60)
+    def test_list_body_cached(self):
+        """Test the rendered list body is served from the cache after reading the task version."""
+        first = self.client.get(TASKS_URL)
+        with self.assertNumQueries(1):
+            second = self.client.get(TASKS_URL)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    @override_settings(TASK_LIST_CACHE_TIMEOUT=60)
+    def test_list_body_cache_keyed_by_query(self):
+        """Test list pages with different query parameters are cached separately."""
+        create_task(title='second', user=self.user)
+        first = self.client.get(TASKS_URL, {'page_size': 1})
+        second = self.client.get(TASKS_URL)
+
+        self.assertEqual(len(first.json()['results']), 1)
+        self.assertEqual(len(second.json()['results']), 2)
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TaskReplicaReadTests(TransactionTestCase):
+    """Test task reads of safe requests go to the replica."""
+    # Configured by api/test_settings.py as a mirror of the default database.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(user=self.user)
+        self.task = create_task(user=self.user)
+
+    def test_list_reads_replica(self):
+        """Test listing tasks reads the tasks from the replica."""
+        with CaptureQueriesContext(connections['replica']) as replica, \
+                CaptureQueriesContext(connection) as primary:
+            response = self.client.get(TASKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['results']], [self.task.id])
+        self.assertTrue(any(f'FROM "{Task._meta.db_table}"' in query['sql'] for query in replica.captured_queries))
+        # Only the task version is compared with the primary's.
+        self.assertFalse(any(f'FROM "{Task._meta.db_table}"' in query['sql'] for query in primary.captured_queries))
+
+    def test_changes_read_replica(self):
+        """Test the changes feed reads from the replica."""
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(CHANGES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['changed']], [self.task.id])
+        self.assertTrue(any(f'FROM "{TaskWithArchived._meta.db_table}"' in query['sql'] for query in replica.captured_queries))
+
+class AsyncTaskApiTests(TransactionTestCase):
+    """Test the async task api."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = AuthToken.objects.create(user=self.user)
+        self.headers = {'AUTHORIZATION': f'Token {self.token.key}'}
+
+    def tearDown(self):
+        close_db_connections()
+
+    async def test_list_without_auth(self):
+        """Test the async list requires authentication."""
+        response = await self.async_client.get(ASYNC_TASKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    def test_list_matches_sync_list(self):
+        """Test the async list returns the same page as the sync list."""
+        create_task(title='first', user=self.user)
+        create_task(title='second', user=self.user)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        expected = client.get(TASKS_URL).json()
+
+        response = async_to_sync(self.async_client.get)(ASYNC_TASKS_URL, **self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], expected['results'])
+
+    async def test_create_and_retrieve(self):
+        """Test creating a task and retrieving it asynchronously."""
+        payload = {'title': 'async title', 'description': 'async description'}
+        response = await self.async_client.post(
+            ASYNC_TASKS_URL, payload, content_type='application/json', **self.headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        task_id = response.json()['id']
+        response = await self.async_client.get(async_detail_task(task_id), **self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['title'], payload['title'])
+        task = await sync_to_async(Task.objects.get)(id=task_id)
+        self.assertEqual(task.user_id, self.user.id)
+
+    async def test_create_invalid_payload(self):
+        """Test invalid payloads return the serializer errors."""
+        response = await self.async_client.post(
+            ASYNC_TASKS_URL, {'description': 'no title'}, content_type='application/json', **self.headers
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('title', response.json())
+
+    async def test_retrieve_other_users_task(self):
+        """Test tasks of other users are not found."""
+        other_user = await sync_to_async(create_user)(username='anotheruser', email='another@example.com')
+        task = await sync_to_async(create_task)(user=other_user)
+        response = await self.async_client.get(async_detail_task(task.id), **self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+@override_settings(DATABASE_SHARDS=['default', *SHARD_ALIASES])
+class TaskShardTests(TestCase):
+    """Test tasks sharded by user over several databases."""
+    databases = {'default', *SHARD_ALIASES}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for alias in SHARD_ALIASES:
+            reserve_id_range(alias)
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        set_shard(self.user.pk, 'shard2')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_new_user_placed_by_hash(self):
+        """Test new users get a directory entry on their hash shard."""
+        user = create_user(username='placed', email='placed@example.com')
+        cache.clear()
+
+        self.assertEqual(TaskShard.objects.get(user=user).shard, hash_shard(user.pk))
+        self.assertEqual(shard_for_user(user.pk), hash_shard(user.pk))
+
+    def test_user_without_entry_stays_on_default(self):
+        """Test users without a directory entry keep their tasks on the default database."""
+        user = create_user(username='legacy', email='legacy@example.com')
+        TaskShard.objects.filter(user=user).delete()
+        cache.clear()
+        task = create_task(user=user)
+
+        self.assertEqual(shard_for_user(user.pk), 'default')
+        self.assertTrue(Task.objects.using('default').filter(id=task.id).exists())
+
+    def test_api_reads_and_writes_user_shard(self):
+        """Test the task endpoints work on the shard of the user."""
+        response = self.client.post(TASKS_URL, {'title': 'sharded', 'is_completed': True})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        task_id = response.data['id']
+        self.client.post(BULK_URL, [{'title': 'bulk 1'}, {'title': 'bulk 2'}], format='json')
+        self.client.patch(detail_task(task_id), {'title': 'renamed'})
+
+        self.assertGreaterEqual(task_id, 2 << ID_RANGE_BITS)
+        self.assertFalse(Task.all_objects.using('default').exists())
+        self.assertEqual(Task.objects.using('shard2').get(id=task_id).title, 'renamed')
+        response = self.client.get(TASKS_URL)
+        self.assertEqual([task['title'] for task in response.data['results']], ['bulk 2', 'bulk 1', 'renamed'])
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 3, 'completed': 1, 'open': 2})
+
+        self.client.delete(detail_task(task_id))
+        self.assertIsNotNone(Task.all_objects.using('shard2').get(id=task_id).deleted)
+        self.assertEqual(self.client.get(detail_task(task_id)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_move_user_tasks(self):
+        """Test the move command copies tasks, ids and times included, and switches the shard."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(5)]
+        tasks[0].soft_delete()
+        Task.objects.using('shard2').filter(id=tasks[1].id).update(is_completed=True)
+        expected = list(Task.all_objects.using('shard2').order_by('id').values_list(*MOVE_COLUMNS))
+        out = io.StringIO()
+        call_command(
+            'move_user_tasks', str(self.user.pk), '--to', 'shard1', '--batch-size', '2',
+            stdout=out, stderr=io.StringIO(),
+        )
+
+        self.assertIn('Moved 5 tasks', out.getvalue())
+        self.assertEqual(shard_for_user(self.user.pk), 'shard1')
+        self.assertEqual(TaskShard.objects.get(user=self.user).shard, 'shard1')
+        self.assertEqual(list(Task.all_objects.using('shard1').order_by('id').values_list(*MOVE_COLUMNS)), expected)
+        self.assertFalse(Task.all_objects.using('shard2').exists())
+        self.assertFalse(TaskCounter.objects.using('shard2').exists())
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 4, 'completed': 1, 'open': 3})
+        response = self.client.get(TASKS_URL)
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_move_archived_tasks(self):
+        """Test moving a user moves their archived tasks, also the ones archived or restored meanwhile."""
+        old = timezone.now() - timedelta(days=settings.TASK_ARCHIVE_AFTER_DAYS + 1)
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(3)]
+        source = Task.objects.using('shard2')
+        source.filter(id__in=[tasks[0].id, tasks[1].id]).update(is_completed=True, updated=old)
+        TaskArchiver(using='shard2').run()
+        mover = TaskMover()
+        archived = ArchivedTask.objects.using('shard2').filter(user_id=self.user.pk)
+        mover.copy_batches(self.user.pk, 'shard1', archived, ARCHIVE_MOVE_COLUMNS)
+
+        restore_tasks(self.user.pk, 'shard2', ids=[tasks[1].id])
+        source.filter(id=tasks[2].id).update(is_completed=True, updated=old)
+        TaskArchiver(using='shard2').run()
+        expected = list(archived.order_by('id').values_list(*ARCHIVE_MOVE_COLUMNS))
+        mover.transfer(self.user.pk, 'shard2', 'shard1')
+        set_shard(self.user.pk, 'shard1')
+
+        moved = ArchivedTask.objects.using('shard1').order_by('id').values_list(*ARCHIVE_MOVE_COLUMNS)
+        self.assertEqual(list(moved), expected)
+        self.assertFalse(ArchivedTask.objects.using('shard2').exists())
+        self.assertEqual(list(Task.objects.using('shard1').values_list('id', flat=True)), [tasks[1].id])
+        response = self.client.get(TASKS_URL, {'include_archived': 'true'})
+        self.assertEqual([task['id'] for task in response.data['results']], [tasks[2].id, tasks[1].id, tasks[0].id])
+
+    def test_move_catches_up_changes_during_copy(self):
+        """Test tasks written or deleted while a move copies them are caught up."""
+        tasks = [create_task(title=f'task {i}', user=self.user) for i in range(3)]
+        mover = TaskMover()
+        with connections['shard2'].cursor() as cursor:
+            cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            since = cursor.fetchone()[0]
+        source = Task.all_objects.using('shard2').filter(user_id=self.user.pk)
+        copied, last_id = mover.copy_batches(self.user.pk, 'default', source, MOVE_COLUMNS)
+        source.filter(id=tasks[0].id).update(title='renamed')
+        source.filter(id=tasks[1].id).delete()
+        added = Task.objects.using('shard2').create(title='added', user=self.user)
+        mover.transfer(self.user.pk, 'shard2', 'default', since=since, after_id=last_id)
+
+        titles = Task.all_objects.using('default').filter(user=self.user).order_by('id').values_list('title', flat=True)
+        self.assertEqual(list(titles), ['renamed', 'task 2', 'added'])
+        self.assertEqual(TaskCounter.objects.using('default').get(user=self.user).total, 3)
+        self.assertGreater(added.id, last_id)
+
+    def test_moved_user_fenced_off_source(self):
+        """Test writes routed to the shard a user moved off fail instead of being lost."""
+        create_task(user=self.user)
+        TaskMover().move(self.user.pk, 'default')
+
+        self.assertTrue(TaskFence.objects.using('shard2').filter(user=self.user).exists())
+        with self.assertRaises(OperationalError), transaction.atomic(using='shard2'):
+            Task.objects.using('shard2').create(title='late', user=self.user)
+        other = create_user(username='other', email='other@example.com')
+        Task.objects.using('shard2').create(title='unaffected', user=other)
+
+        TaskMover().move(self.user.pk, 'shard2')
+        self.assertFalse(TaskFence.objects.using('shard2').filter(user=self.user).exists())
+        self.assertTrue(TaskFence.objects.using('default').filter(user=self.user).exists())
+        self.assertEqual(Task.objects.using('shard2').filter(user=self.user).count(), 1)
+
+    def test_stale_shard_entry_answers_retry(self):
+        """Test a write routed by a stale directory entry answers 503 and the retry reaches the new shard."""
+        TaskMover().move(self.user.pk, 'default')
+        cache.set(SHARD_KEY.format(self.user.pk), 'shard2')
+        response = self.client.post(TASKS_URL, {'title': 'stale'})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['detail'].code, 'task_shard_moved')
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIsNone(cache.get(SHARD_KEY.format(self.user.pk)))
+
+        response = self.client.post(TASKS_URL, {'title': 'retried'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Task.objects.using('default').filter(title='retried', user=self.user).exists())
+
+    def test_plan_rebalance(self):
+        """Test rebalancing moves users from the fullest shards to the emptiest ones."""
+        moves = plan_rebalance({'default': {1: 10, 2: 6, 3: 2}, 'shard1': {}, 'shard2': {4: 1}})
+
+        self.assertEqual(moves, [(2, 'default', 'shard1'), (3, 'default', 'shard2')])
+
+    def test_rebalance_dry_run(self):
+        """Test a dry run prints the planned moves without moving tasks."""
+        other = create_user(username='other', email='other@example.com')
+        set_shard(other.pk, 'shard2')
+        for i in range(3):
+            create_task(user=self.user)
+        create_task(user=other)
+        out = io.StringIO()
+        call_command('move_user_tasks', '--rebalance', '--dry-run', stdout=out)
+
+        self.assertIn(f'Would move user {other.pk} from shard2 to', out.getvalue())
+        self.assertIn('Planned 1 moves.', out.getvalue())
+        self.assertEqual(Task.objects.using('shard2').count(), 4)
+
+    def test_delete_user_deletes_shard_tasks(self):
+        """Test deleting a user deletes their tasks and counter on another shard."""
+        create_task(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+
+        self.assertFalse(Task.all_objects.using('shard2').exists())
+        self.assertFalse(TaskCounter.objects.using('shard2').exists())
+
+    def test_import_writes_user_shards(self):
+        """Test imported tasks land on the shard of their user."""
+        other = create_user(username='other', email='other@example.com')
+        set_shard(other.pk, 'default')
+        rows = [
+            (2, {'username': self.user.username, 'title': 'mine'}),
+            (3, {'email': other.email, 'title': 'theirs'}),
+        ]
+        result = TaskImporter().run(rows)
+
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(list(Task.objects.using('shard2').values_list('title', flat=True)), ['mine'])
+        self.assertEqual(list(Task.objects.using('default').values_list('title', flat=True)), ['theirs'])
+
+    def test_import_reports_committed_shards(self):
+        """Test a failed shard commit reports the shards that committed."""
+        other = create_user(username='other', email='other@example.com')
+        set_shard(other.pk, 'default')
+        rows = [
+            (2, {'username': self.user.username, 'title': 'mine'}),
+            (3, {'email': other.email, 'title': 'theirs'}),
+        ]
+        atomic = transaction.atomic
+
+        @contextlib.contextmanager
+        def failing_atomic(using=None):
+            with atomic(using=using):
+                yield
+                if using == 'default':
+                    raise OperationalError('commit failed')
+
+        with mock.patch('task.imports.transaction.atomic', failing_atomic):
+            with self.assertRaises(TaskImportCommitError) as cm:
+                TaskImporter().run(rows)
+
+        self.assertEqual(cm.exception.committed, {'shard2': 1})
+        self.assertIn('commit failed (already committed: shard2 (1 tasks))', str(cm.exception))
+        self.assertFalse(Task.objects.using('default').exists())
+
+    def test_admin_lists_tasks_per_shard(self):
+        """Test the task admin lists and opens tasks of every shard."""
+        task = create_task(title='on shard two', user=self.user)
+        other = create_user(username='other', email='other@example.com')
+        set_shard(other.pk, 'default')
+        create_task(title='on default', user=other)
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'adminpass123')
+        self.client.force_login(admin)
+        changelist = reverse('admin:task_task_changelist')
+
+        response = self.client.get(changelist)
+        self.assertContains(response, 'on shard two')
+        self.assertContains(response, 'on default')
+        self.assertContains(response, '2 tasks')
+        response = self.client.get(changelist, {'shard': 'shard2'})
+        self.assertContains(response, 'on shard two')
+        self.assertNotContains(response, 'on default')
+        with mock.patch('core.admin.TaskAdmin.list_per_page', 1):
+            first, second = self.client.get(changelist), self.client.get(changelist, {'p': 2})
+        self.assertContains(first, 'on default')
+        self.assertNotContains(first, 'on shard two')
+        self.assertContains(second, 'on shard two')
+        response = self.client.get(reverse('admin:task_task_change', args=[task.id]))
+        self.assertContains(response, 'on shard two')
+
+class TaskPartitionTests(TestCase):
+    """Test rebuilding the task table as hash partitions by user."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.other_user = create_user(username='otheruser', email='other@example.com')
+        for i in range(5):
+            create_task(title=f'task {i}', user=self.user)
+            create_task(title=f'other {i}', user=self.other_user)
+        Task.objects.filter(title='task 0').update(is_completed=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def snapshot(self):
+        """Return every task row and counter."""
+        return (
+            list(Task.all_objects.order_by('id').values_list()),
+            list(TaskCounter.objects.order_by('user_id').values_list()),
+        )
+
+    def test_partition_tasks(self):
+        """Test the command partitions the table keeping tasks, counters and ids."""
+        before = self.snapshot()
+        out = io.StringIO()
+        call_command('partition_tasks', '--partitions', '4', '--batch-size', '3', stdout=out, stderr=io.StringIO())
+
+        self.assertIn('copied 10 tasks', out.getvalue())
+        self.assertEqual(task_partition_count(), 4)
+        self.assertEqual(self.snapshot(), before)
+        response = self.client.post(TASKS_URL, {'title': 'after'})
+        self.assertGreater(response.data['id'], before[0][-1][0])
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 6, 'completed': 1, 'open': 5})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = 'task_task'::regclass ORDER BY tgname")
+            triggers = [row[0] for row in cursor.fetchall()]
+        self.assertIn('task_fence_insert', triggers)
+        self.assertIn('task_counter_insert', triggers)
+
+    def test_migrations_refused_on_partitioned_table(self):
+        """Test task migrations run on a partitioned table only when they declare they support it."""
+        config = apps.get_app_config('task')
+        unsafe = migrations.Migration('9999_alter_task', 'task')
+        safe = migrations.Migration('9999_task_trigger', 'task')
+        safe.partitioned_tasks = True
+        refuse_migrating_partitioned_tasks(config, 'default', [(unsafe, False)])
+        call_command('partition_tasks', '--partitions', '4', stdout=io.StringIO(), stderr=io.StringIO())
+
+        with self.assertRaisesMessage(CommandError, '9999_alter_task'):
+            refuse_migrating_partitioned_tasks(config, 'default', [(safe, False), (unsafe, False)])
+        refuse_migrating_partitioned_tasks(config, 'default', [(safe, False)])
+
+    def test_partition_tasks_again_is_noop(self):
+        """Test partitioning into the current number of partitions changes nothing."""
+        call_command('partition_tasks', '--partitions', '0', stdout=io.StringIO())
+
+        self.assertEqual(task_partition_count(), 0)
+
+    def test_unpartition_tasks(self):
+        """Test a partitioned table is turned back into a plain one."""
+        before = self.snapshot()
+        call_command('partition_tasks', '--partitions', '4', stdout=io.StringIO(), stderr=io.StringIO())
+        call_command('partition_tasks', '--partitions', '0', stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(task_partition_count(), 0)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_writes_during_copy_are_mirrored(self):
+        """Test tasks written while the new table is filled end up in it."""
+        partitioner = TaskPartitioner(4, batch_size=2)
+        partitioner.create()
+        partitioner.mirror()
+        Task.objects.filter(title='task 1').update(title='renamed')
+        Task.all_objects.filter(title='task 2').delete()
+        create_task(title='added', user=self.user)
+        expected = self.snapshot()
+        partitioner.copy()
+        partitioner.swap()
+
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_queries_are_pruned(self):
+        """Test task api queries of a user only read that user's partition."""
+        call_command('partition_tasks', '--partitions', '4', stdout=io.StringIO(), stderr=io.StringIO())
+        task_id = Task.objects.filter(user=self.user).values_list('id', flat=True).first()
+        urls = [TASKS_URL, f'{TASKS_URL}?search=task', f'{CHANGES_URL}', detail_task(task_id)]
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url)
+                sql = [query['sql'] for query in queries.captured_queries if 'FROM "task_task' in query['sql']][-1]
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN {sql}')
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                self.assertEqual(len(set(re.findall(r'task_task_p4_\d', plan))), 1, plan)
+
+
+
+class TaskJobTests(TestCase):
+    """Test the task operations run as background jobs."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_workers(self):
+        call_command('run_workers', '--burst', stdout=io.StringIO())
+
+    def test_clear_completed(self):
+        """Test deleting the completed tasks is queued and done by a worker."""
+        other_user = create_user(username='otheruser', email='other@example.com')
+        open_task = create_task(title='open', user=self.user)
+        for n in range(3):
+            Task.objects.create(title=f'done {n}', is_completed=True, user=self.user)
+        Task.objects.create(title='other', is_completed=True, user=other_user)
+
+        response = self.client.delete(CLEAR_COMPLETED_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Location'], reverse('core:job-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['status'], Job.Status.QUEUED)
+        self.assertEqual(Task.objects.filter(user=self.user).count(), 4)
+
+        self.run_workers()
+
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+        self.assertEqual(job.result, {'deleted': 3})
+        self.assertEqual(list(Task.objects.filter(user=self.user)), [open_task])
+        self.assertEqual(Task.objects.filter(user=other_user).count(), 1)
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 1, 'completed': 0, 'open': 1})
+
+    def test_export_job(self):
+        """Test a background export is written to a file downloaded from the job."""
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        task = create_task(title='own', user=self.user)
+        create_task(title='other', user=create_user(username='otheruser', email='other@example.com'))
+
+        with override_settings(MEDIA_ROOT=media_root.name):
+            response = self.client.post(EXPORT_URL, {'output': 'ndjson'})
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.run_workers()
+            job = self.client.get(response['Location']).data
+            download = self.client.get(reverse('core:job-download', args=[job['id']]))
+            content = b''.join(download.streaming_content).decode()
+
+        self.assertEqual(job['status'], Job.Status.SUCCEEDED)
+        self.assertEqual(job['result']['tasks'], 1)
+        self.assertEqual(download['Content-Type'], 'application/x-ndjson')
+        self.assertIn(f'tasks-{job["id"]}.ndjson', download['Content-Disposition'])
+        self.assertEqual([json.loads(line) for line in content.splitlines()], [TaskDetailSerializer(task).data])
+
+    def test_jobs_queued_with_token(self):
+        """Test token authenticated users can queue jobs and read their status."""
+        token_cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {AuthToken.objects.create(user=self.user).key}')
+
+        export = client.post(EXPORT_URL, {'output': 'json'})
+        clear = client.delete(CLEAR_COMPLETED_URL)
+
+        self.assertEqual(export.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(clear.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(set(Job.objects.values_list('user_id', flat=True)), {self.user.pk})
+        response = client.get(reverse('core:job-list'))
+        self.assertEqual([job['id'] for job in response.data['results']], [clear.data['id'], export.data['id']])
+        self.assertEqual(client.get(clear['Location']).status_code, status.HTTP_200_OK)
+
+    def test_expired_exports_deleted(self):
+        """Test export files are kept until they expire and then deleted by the cleanup command."""
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        create_task(user=self.user)
+
+        with override_settings(MEDIA_ROOT=media_root.name):
+            response = self.client.post(EXPORT_URL, {'output': 'json'})
+            self.run_workers()
+            download_url = reverse('core:job-download', args=[response.data['id']])
+            out = io.StringIO()
+            call_command('delete_expired_exports', stdout=out)
+            self.assertIn('Deleted 0 expired exports', out.getvalue())
+            self.assertEqual(self.client.get(download_url).status_code, status.HTTP_200_OK)
+
+            call_command('delete_expired_exports', '--hours', '0', stdout=out)
+            self.assertIn('Deleted 1 expired exports', out.getvalue())
+            self.assertEqual(self.client.get(download_url).status_code, status.HTTP_404_NOT_FOUND)
+
+        job = Job.objects.get(pk=response.data['id'])
+        expires = datetime.fromisoformat(job.result['expires'])
+        self.assertAlmostEqual(
+            (expires - job.finished).total_seconds(), settings.TASK_EXPORT_EXPIRE_HOURS * 3600, delta=5,
+        )
+
+    def test_rebuild_counters_in_background(self):
+        """Test the counter rebuild can be queued for the workers."""
+        create_task(user=self.user)
+        TaskCounter.objects.all().delete()
+        out = io.StringIO()
+
+        call_command('rebuild_task_counters', '--background', stdout=out)
+
+        self.assertIn('Queued job', out.getvalue())
+        self.assertFalse(TaskCounter.objects.exists())
+        self.run_workers()
+        self.assertEqual(Job.objects.get(name='task.rebuild_counters').result, {'users': 1})
+        self.assertEqual(TaskCounter.objects.get(user=self.user).total, 1)
+
+
+class TaskArchiveTests(TestCase):
+    """Test archiving old completed tasks."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.days = settings.TASK_ARCHIVE_AFTER_DAYS
+        self.old = timezone.now() - timedelta(days=self.days + 1)
+
+    def create_old_task(self, title, is_completed=True, user=None):
+        """Create and return a task last updated before the archive age."""
+        task = create_task(title=title, user=user or self.user)
+        Task.all_objects.filter(id=task.id).update(is_completed=is_completed, updated=self.old)
+        return task
+
+    def test_archive_old_completed_tasks(self):
+        """Test only completed tasks older than the archive age are moved, ids and times included."""
+        archived = self.create_old_task('old completed')
+        self.create_old_task('old open', is_completed=False)
+        self.create_old_task('old deleted').soft_delete()
+        Task.objects.create(title='recent completed', is_completed=True, user=self.user)
+        other = self.create_old_task('other user', user=create_user(username='otheruser', email='other@example.com'))
+
+        count = TaskArchiver(batch_size=2).run()
+
+        self.assertEqual(count, 2)
+        self.assertEqual(set(ArchivedTask.objects.values_list('id', flat=True)), {archived.id, other.id})
+        copy = ArchivedTask.objects.get(id=archived.id)
+        self.assertEqual((copy.title, copy.created, copy.updated), (archived.title, archived.created, self.old))
+        self.assertFalse(Task.all_objects.filter(id=archived.id).exists())
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 3, 'completed': 2, 'open': 1})
+
+    def test_list_include_archived(self):
+        """Test archived tasks are only listed when asked for, marked as archived."""
+        archived = self.create_old_task('archived')
+        task = create_task(title='live', user=self.user)
+        TaskArchiver().run()
+
+        response = self.client.get(TASKS_URL)
+        self.assertEqual([row['id'] for row in response.data['results']], [task.id])
+
+        response = self.client.get(TASKS_URL, {'include_archived': 'true'})
+        self.assertEqual(response.data['results'], [
+            {'id': task.id, 'title': 'live', 'is_completed': False, 'is_archived': False},
+            {'id': archived.id, 'title': 'archived', 'is_completed': True, 'is_archived': True},
+        ])
+        response = self.client.get(TASKS_URL, {'include_archived': 'true', 'is_completed': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [archived.id])
+        response = self.client.get(TASKS_URL, {'include_archived': 'maybe'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_include_archived(self):
+        """Test an archived task is only found when archived tasks are included."""
+        archived = self.create_old_task('archived')
+        TaskArchiver().run()
+
+        self.assertEqual(self.client.get(detail_task(archived.id)).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(detail_task(archived.id), {'include_archived': 'true'})
+        self.assertEqual(response.data['title'], 'archived')
+        self.assertTrue(response.data['is_archived'])
+
+    def test_restore(self):
+        """Test restoring moves an archived task back to the user's tasks."""
+        archived = self.create_old_task('archived')
+        TaskArchiver().run()
+
+        response = self.client.post(reverse('task:task-restore', args=[archived.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, TaskDetailSerializer(Task.objects.get(id=archived.id)).data)
+        self.assertFalse(ArchivedTask.objects.exists())
+        self.assertEqual(Task.objects.get(id=archived.id).updated, self.old)
+        self.assertEqual(self.client.get(STATS_URL).data, {'total': 1, 'completed': 1, 'open': 0})
+        response = self.client.post(reverse('task:task-restore', args=[archived.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(TaskArchiver().run(), 0)
+        self.assertEqual(TaskArchiver().run(now=timezone.now() + timedelta(days=self.days + 1)), 1)
+
+    def test_archived_tasks_synced_as_deleted(self):
+        """Test the changes feed reports archived tasks as deleted and restored ones as changed."""
+        archived = self.create_old_task('archived')
+        live = create_task(title='live', user=self.user)
+        TaskArchiver().run()
+
+        response = self.client.get(CHANGES_URL)
+        self.assertEqual([task['id'] for task in response.data['changed']], [live.id])
+        self.assertEqual(response.data['deleted'], [archived.id])
+
+        restore_tasks(self.user.pk, 'default', ids=[archived.id])
+        response = self.client.get(CHANGES_URL)
+        self.assertEqual(sorted(task['id'] for task in response.data['changed']), [archived.id, live.id])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_rebuild_counters_counts_archived_tasks(self):
+        """Test rebuilt counters match the ones kept by the triggers across archiving."""
+        self.create_old_task('archived')
+        create_task(title='live', user=self.user)
+        TaskArchiver().run()
+        kept = list(TaskCounter.objects.values_list('user_id', 'total', 'completed'))
+
+        call_command('rebuild_task_counters', stdout=io.StringIO())
+
+        self.assertEqual(list(TaskCounter.objects.values_list('user_id', 'total', 'completed')), kept)
+        self.assertEqual(kept, [(self.user.pk, 2, 1)])
+
+    def test_restore_other_users_task_not_found(self):
+        """Test users cannot restore the archived tasks of others."""
+        other_user = create_user(username='otheruser', email='other@example.com')
+        archived = self.create_old_task('theirs', user=other_user)
+        TaskArchiver().run()
+
+        response = self.client.post(reverse('task:task-restore', args=[archived.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(ArchivedTask.objects.filter(id=archived.id).exists())
+
+    def test_archive_command(self):
+        """Test the command archives the tasks older than --days, directly or in the background."""
+        self.create_old_task('old')
+        recent = Task.objects.create(title='recent', is_completed=True, user=self.user)
+        Task.objects.filter(id=recent.id).update(updated=timezone.now() - timedelta(days=2))
+        out = io.StringIO()
+
+        call_command('archive_tasks', stdout=out, stderr=io.StringIO())
+        self.assertIn('Archived 1 tasks.', out.getvalue())
+
+        call_command('archive_tasks', '--days', '1', '--background', stdout=out)
+        call_command('run_workers', '--burst', stdout=io.StringIO())
+        self.assertEqual(Job.objects.get(name='task.archive_tasks').result, {'archived': 1})
+        self.assertEqual(ArchivedTask.objects.count(), 2)
+
+    def test_partitioned_table_keeps_archive_view(self):
+        """Test the archived tasks are still listed after the task table was partitioned."""
+        archived = self.create_old_task('archived')
+        TaskArchiver().run()
+
+        TaskPartitioner(2).run()
+        response = self.client.get(TASKS_URL, {'include_archived': 'true'})
+
+        self.assertEqual([row['id'] for row in response.data['results']], [archived.id])
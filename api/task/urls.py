@@ -2,7 +2,7 @@ from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
-from task import views
+from task import async_views, views
 
 router = DefaultRouter()
 router.register('tasks', views.TaskViewSet)
@@ -11,4 +11,6 @@ app_name = 'task'
 
 urlpatterns = [
     path('', include(router.urls)),
-]
\ No newline at end of file
+    path('async/tasks/', async_views.task_list_view, name='async-task-list'),
+    path('async/tasks/<int:pk>/', async_views.task_detail_view, name='async-task-detail'),
+]
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+
+from core.db.routers import read_primary
+
+from .models import TaskCounter
+
+def read_task_version(user_id, using):
+    """Return the version of a user's tasks on one database, 0 before their first task."""
+    counter = TaskCounter.objects.for_user(user_id).using(using).values_list('version', flat=True)
+    return counter.first() or 0
+
+def get_task_version(user_id):
+    """
+    Return the version of a user's tasks, 0 before their first task.
+
+    Versions are kept on the task counter by its triggers, in the same
+    transaction as every change, so they are shared by all processes
+    and never go back. They only compare within one database. A request
+    reading from a replica which has not replayed the primary's version
+    yet reads the rest from the primary, so no lagging body is sent or
+    cached under a newer version.
+    """
+    using = router.db_for_read(TaskCounter, user_id=user_id)
+    version = read_task_version(user_id, using)
+    if using in settings.DATABASE_REPLICAS:
+        primary_version = read_task_version(user_id, DEFAULT_DB_ALIAS)
+        if primary_version != version:
+            read_primary()
+            return primary_version
+    return version
@@ -1,27 +1,377 @@
-from rest_framework import viewsets
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.urls import reverse
+
+from rest_framework import serializers, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.response import Response
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+
+from core.authentication import CachedTokenAuthentication
+from core.exceptions import ServiceUnavailable
+from core.jobs import enqueue
+from core.serializers import JobSerializer
+
+from .serializers import (
+    TaskDetailSerializer,
+    TaskSerializer,
+    TaskBulkDeleteSerializer,
+    TaskBulkDeleteResultSerializer,
+    TaskChangesQuerySerializer,
+    TaskChangesSerializer,
+    TaskExportQuerySerializer,
+    TaskStatsSerializer,
+    task_values,
+    task_detail_values,
+    archived_task_values,
+    archived_task_detail_values,
+)
+from .archive import restore_tasks
+from .models import Task, TaskWithArchived
+from .counters import get_task_counts
+from .export import EXPORT_FORMATS, export_rows
+from .filters import TaskFilterBackend, TaskOrderingFilter, TaskSearchFilter
+from .pagination import TaskCursorPagination
+from .shards import forget_user, is_shard_moved, task_db, task_shard
+from .sync import changes_since, make_sync_token
+from .versions import get_task_version
+
+BULK_MAX_ITEMS = 1000
+
+class TaskShardMoved(ServiceUnavailable):
+    """The tasks of the user moved to another shard while the request wrote them."""
+    default_detail = 'Your tasks moved to another database, retry the request.'
+    default_code = 'task_shard_moved'
 
-from .serializers import TaskDetailSerializer, TaskSerializer
-from .models import Task
 class TaskViewSet(viewsets.ModelViewSet):
     """View for managing task api."""
     serializer_class = TaskDetailSerializer
     queryset = Task.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = TaskCursorPagination
+    filter_backends = [TaskFilterBackend, TaskSearchFilter, TaskOrderingFilter]
+    ordering = ('-created', '-id')
+    throttle_scope = 'task'
 
     def get_queryset(self):
         """Get the list of items for this view."""
-        queryset = Task.objects.filter(user=self.request.user)
+        if self.action in ('list', 'retrieve') and self.include_archived():
+            return TaskWithArchived.objects.for_user(self.request.user.pk)
+        queryset = Task.objects.for_user(self.request.user.pk)
         return queryset
 
+    def include_archived(self):
+        """Return whether the request reads the archived tasks too."""
+        value = self.request.query_params.get('include_archived')
+        return value is not None and serializers.BooleanField().to_internal_value(value)
+
+    # list and retrieve render `.values()` rows instead of serializing
+    # model instances, the output matches the serializers byte for byte.
+    # Both answer conditional requests from the user's task version
+    # before reading any task.
+    # They carry no docstring so the schema keeps the view description.
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response()
+        if not_modified is not None:
+            return not_modified
+        self.list_cache_key = self.get_list_cache_key()
+        if self.list_cache_key is not None:
+            cached = cache.get(self.list_cache_key)
+            if cached is not None:
+                self.list_cache_key = None
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        representation = archived_task_values if queryset.model is TaskWithArchived else task_values
+        page = self.paginator.paginate_values(queryset, request, representation, view=self)
+        return self.get_paginated_response(page)
+
+    def retrieve(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        queryset = self.filter_queryset(self.get_queryset())
+        representation = archived_task_detail_values if queryset.model is TaskWithArchived else task_detail_values
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            queryset.values(*representation.fields),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]},
+        )
+        self.check_object_permissions(request, row)
+        return Response(representation.to_representation(row))
+
+    def get_not_modified_response(self):
+        """Return a 304 response if the client has the current task version."""
+        # Versions only compare within a shard, so the shard is part of
+        # the validators. There is no Last-Modified, versions are no times.
+        self.task_shard = task_shard(self.request.user.pk)
+        self.task_version = get_task_version(self.request.user.pk)
+        return get_conditional_response(self.request, etag=self.get_etag())
+
+    def get_etag(self):
+        """Return the weak ETag of the current task version."""
+        renderer_format = self.request.accepted_renderer.format
+        return f'W/"{self.request.user.pk}.{self.task_shard}.{self.task_version}.{renderer_format}"'
+
+    def get_list_cache_key(self):
+        """Return the cache key of the rendered list body, None if not cached."""
+        if not settings.TASK_LIST_CACHE_TIMEOUT or self.request.accepted_renderer.format != 'json':
+            return None
+        query = hashlib.md5(self.request.GET.urlencode().encode()).hexdigest()
+        return f'task:list:{self.request.user.pk}:{self.task_shard}:{self.task_version}:{query}'
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Add the validators to task responses and cache rendered lists."""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'task_version', None) is None or response.status_code not in (200, 304):
+            return response
+
+        response['ETag'] = self.get_etag()
+        patch_vary_headers(response, ['Accept', 'Authorization'])
+        patch_cache_control(response, private=True, no_cache=True)
+
+        if getattr(self, 'list_cache_key', None) is not None and isinstance(response, Response):
+            response.render()
+            cache.set(
+                self.list_cache_key,
+                (response.content, response['Content-Type']),
+                settings.TASK_LIST_CACHE_TIMEOUT,
+            )
+        return response
+
+    def handle_exception(self, exc):
+        """Answer writes to a shard the user's tasks moved off with 503, the retry finds the new one."""
+        if isinstance(exc, DatabaseError) and is_shard_moved(exc):
+            forget_user(self.request.user.pk)
+            exc = TaskShardMoved(1)
+        return super().handle_exception(exc)
+
     def perform_create(self, serializer):
         """Create a new task."""
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
+
+    def perform_destroy(self, instance):
+        """Soft delete a task so the deletion reaches synced clients."""
+        instance.soft_delete()
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
         if self.action == 'list':
             return TaskSerializer
-        return self.serializer_class
\ No newline at end of file
+        return self.serializer_class
+
+    @extend_schema(
+        request=TaskDetailSerializer(many=True),
+        responses={201: TaskDetailSerializer(many=True)},
+    )
+    @action(detail=False, methods=['post'], url_path='bulk', filter_backends=[])
+    def bulk(self, request):
+        """Create many tasks in one transaction."""
+        error = self._check_bulk_size(request.data)
+        if error:
+            return error
+        serializer = TaskDetailSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = [
+            Task(user_id=request.user.pk, **item)
+            for item in serializer.validated_data
+        ]
+        using = task_db(request.user.pk)
+        with transaction.atomic(using=using):
+            Task.objects.using(using).bulk_create(tasks)
+        return Response(TaskDetailSerializer(tasks, many=True).data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        request=TaskDetailSerializer(many=True, partial=True),
+        responses=TaskDetailSerializer(many=True),
+    )
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """Partially update many tasks, identified by id, in one transaction."""
+        error = self._check_bulk_size(request.data)
+        if error:
+            return error
+        serializer = TaskDetailSerializer(data=request.data, many=True, partial=True)
+        valid = serializer.is_valid()
+        if not isinstance(request.data, list):
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        errors = [dict(item) for item in serializer.errors] if not valid else [{} for _ in request.data]
+
+        ids = [self._bulk_item_id(item) for item in request.data]
+        using = task_db(request.user.pk)
+        with transaction.atomic(using=using):
+            found = self.get_queryset().select_for_update().in_bulk([i for i in ids if i is not None])
+            for task_id, item_errors in zip(ids, errors):
+                if task_id not in found:
+                    item_errors['id'] = ['Not found.']
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            now = timezone.now()
+            fields = {'updated'}
+            for task_id, data in zip(ids, serializer.validated_data):
+                task = found[task_id]
+                for field, value in data.items():
+                    setattr(task, field, value)
+                task.updated = now
+                fields.update(data)
+            Task.objects.using(using).bulk_update(found.values(), fields)
+
+        return Response(TaskDetailSerializer([found[i] for i in ids], many=True).data)
+
+    @extend_schema(
+        request=TaskBulkDeleteSerializer,
+        responses=TaskBulkDeleteResultSerializer,
+    )
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete many tasks, identified by id, in one transaction."""
+        serializer = TaskBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        error = self._check_bulk_size(ids)
+        if error:
+            return error
+
+        using = task_db(request.user.pk)
+        with transaction.atomic(using=using):
+            queryset = self.get_queryset().filter(id__in=ids)
+            deleted = set(queryset.select_for_update().values_list('id', flat=True))
+            now = timezone.now()
+            queryset.update(deleted=now, updated=now)
+
+        result = {
+            'deleted': [i for i in ids if i in deleted],
+            'not_found': [i for i in ids if i not in deleted],
+        }
+        return Response(TaskBulkDeleteResultSerializer(result).data)
+
+    @extend_schema(
+        parameters=[TaskChangesQuerySerializer],
+        responses=TaskChangesSerializer,
+    )
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Return tasks changed or deleted since a sync token.
+
+        Changes are returned oldest first in batches of at most `limit`,
+        clients follow `next` until `has_more` is false and keep the last
+        token for their next sync. Archived tasks are reported as
+        deleted, restoring one reports it as changed again.
+        """
+        query = TaskChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since = query.validated_data.get('since')
+        shard = task_shard(request.user.pk)
+        if since is not None and since[2] != shard:
+            # Transaction ids of another shard do not compare, tasks moved
+            # since the token was handed out are synced again from the start.
+            since = None
+
+        queryset = TaskWithArchived.all_objects.for_user(request.user.pk)
+        tasks, has_more = changes_since(queryset, since, query.validated_data['limit'])
+        if tasks:
+            next_token = make_sync_token(tasks[-1], shard)
+        else:
+            next_token = request.query_params.get('since') if since is not None else None
+        result = {
+            'changed': [task for task in tasks if task.deleted is None and not task.is_archived],
+            'deleted': [task.id for task in tasks if task.deleted is not None or task.is_archived],
+            'next': next_token,
+            'has_more': has_more,
+        }
+        return Response(TaskChangesSerializer(result).data)
+
+    @extend_schema(request=None, responses=TaskDetailSerializer)
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """Move an archived task back to the user's tasks."""
+        try:
+            task_id = int(pk)
+        except ValueError:
+            raise Http404()
+        restored = restore_tasks(request.user.pk, task_db(request.user.pk), ids=[task_id])
+        if not restored:
+            raise Http404()
+        task = self.get_queryset().get(pk=task_id)
+        return Response(TaskDetailSerializer(task).data)
+
+    @extend_schema(responses=TaskStatsSerializer)
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Return the total, completed and open task counts of the user."""
+        return Response(TaskStatsSerializer(get_task_counts(request.user.pk)).data)
+
+    @extend_schema(
+        parameters=[TaskExportQuerySerializer],
+        responses={(200, 'application/json'): OpenApiTypes.OBJECT, (200, 'application/x-ndjson'): OpenApiTypes.STR},
+    )
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every task of the user as a JSON array or NDJSON."""
+        query = TaskExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        stream, content_type = EXPORT_FORMATS[query.validated_data['output']]
+
+        response = StreamingHttpResponse(
+            stream(export_rows(self.get_queryset())),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="tasks.{query.validated_data["output"]}"'
+        return response
+
+    @extend_schema(request=TaskExportQuerySerializer, responses={202: JobSerializer})
+    @export.mapping.post
+    def export_job(self, request):
+        """Export every task of the user to a file in the background, downloaded from the job."""
+        query = TaskExportQuerySerializer(data=request.data)
+        query.is_valid(raise_exception=True)
+        job = enqueue('task.export', {'output': query.validated_data['output']}, user_id=request.user.pk)
+        return self._job_response(job)
+
+    @extend_schema(request=None, responses={202: JobSerializer})
+    @action(detail=False, methods=['delete'], url_path='completed')
+    def clear_completed(self, request):
+        """Delete every completed task of the user in the background."""
+        job = enqueue('task.clear_completed', user_id=request.user.pk)
+        return self._job_response(job)
+
+    @staticmethod
+    def _job_response(job):
+        """Return the accepted response of a queued job, pointing at its status."""
+        headers = {'Location': reverse('core:job-detail', args=[job.pk])}
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
+    def _check_bulk_size(self, items):
+        """Return an error response if a bulk payload has too many items."""
+        if isinstance(items, list) and len(items) > BULK_MAX_ITEMS:
+            return Response(
+                {'non_field_errors': [f'Ensure this list has no more than {BULK_MAX_ITEMS} items.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return None
+
+    @staticmethod
+    def _bulk_item_id(item):
+        """Return the task id of a bulk update item or None."""
+        try:
+            return int(item['id'])
+        except (TypeError, KeyError, ValueError):
+            return None
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user.models import AuthToken
+
+class Command(BaseCommand):
+    """Django command to delete expired api tokens."""
+    help = 'Delete expired api tokens in small batches, each in its own transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per statement.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--database', default='default', help='Database to purge the tokens from.')
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        tokens = AuthToken.objects.db_manager(options['database'])
+        # Tokens expiring while the purge runs are left for the next one.
+        now = timezone.now()
+        purged = 0
+        while True:
+            deleted = tokens.delete_expired(options['batch_size'], now=now)
+            purged += deleted
+            if deleted < options['batch_size']:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired tokens.'))
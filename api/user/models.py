@@ -1,5 +1,10 @@
-from django.db import models
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models, router
 from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.utils import timezone
 
 class UserManager(BaseUserManager):
     """Manager for users."""
@@ -15,3 +20,115 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
 
     objects = UserManager()
+
+def token_expiry(now=None):
+    """Return the expiry of a token issued or refreshed at `now`."""
+    return (now or timezone.now()) + timedelta(seconds=settings.AUTH_TOKEN_TTL)
+
+class AuthTokenManager(models.Manager):
+    """Manager for api tokens."""
+
+    def issue(self, user, device=''):
+        """
+        Create the token of a user's device, or rotate it to a new key.
+
+        One upsert on the `(user, device)` constraint, so concurrent
+        logins from the same device leave exactly one token behind.
+        Clients logging in without a device share one token, like before
+        tokens had devices, its key is kept until it expires and only
+        its expiry is extended.
+        """
+        now = timezone.now()
+        token = self.model(
+            key=self.model.generate_key(), user=user, device=device, created=now, expires=token_expiry(now),
+        )
+        table = self.model._meta.db_table
+        with connections[self._db or router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                f'''
+                INSERT INTO "{table}" AS token (key, user_id, device, created, expires)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, device) DO UPDATE
+                SET key = CASE WHEN %s OR token.expires <= EXCLUDED.created THEN EXCLUDED.key ELSE token.key END,
+                    created = CASE
+                        WHEN %s OR token.expires <= EXCLUDED.created THEN EXCLUDED.created ELSE token.created
+                    END,
+                    expires = EXCLUDED.expires
+                RETURNING key, created
+                ''',
+                [token.key, user.pk, device, token.created, token.expires, bool(device), bool(device)],
+            )
+            token.key, token.created = cursor.fetchone()
+        return token
+
+    def delete_expired(self, batch_size, now=None):
+        """
+        Delete up to `batch_size` expired tokens and return how many were deleted.
+
+        Rows locked by a concurrent refresh are skipped, so a batch only
+        holds short row locks and never waits on authentication.
+        """
+        table = self.model._meta.db_table
+        with connections[self._db or router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                f'''
+                DELETE FROM "{table}" WHERE key IN (
+                    SELECT key FROM "{table}" WHERE expires <= %s
+                    ORDER BY expires LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                ''',
+                [now or timezone.now(), batch_size],
+            )
+            return cursor.rowcount
+
+class AuthToken(models.Model):
+    """
+    Expiring api token of a user on one device.
+
+    Using a token slides its expiry forward, logging in again on the
+    same device rotates the key and revoking deletes the row.
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='auth_tokens')
+    device = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    expires = models.DateTimeField(default=token_expiry)
+
+    objects = AuthTokenManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device'], name='authtoken_user_device_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires'], name='authtoken_expires_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = self.generate_key()
+        return super().save(*args, **kwargs)
+
+    @classmethod
+    def generate_key(cls):
+        return secrets.token_hex(20)
+
+    def is_expired(self, now=None):
+        return self.expires <= (now or timezone.now())
+
+    def refresh(self, now=None):
+        """
+        Slide the expiry forward and return whether it moved.
+
+        The row is written at most once every AUTH_TOKEN_REFRESH_INTERVAL
+        seconds, so busy tokens do not cost a write per request.
+        """
+        expires = token_expiry(now)
+        if expires - self.expires < timedelta(seconds=settings.AUTH_TOKEN_REFRESH_INTERVAL):
+            return False
+        AuthToken.objects.filter(key=self.key).update(expires=expires)
+        self.expires = expires
+        return True
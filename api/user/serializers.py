@@ -1,7 +1,10 @@
 from rest_framework import serializers
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 
 from django.contrib.auth import get_user_model
 
+from .models import AuthToken
+
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for the user model."""
 
@@ -28,4 +31,16 @@ class UserSerializer(serializers.ModelSerializer):
             user.set_password(password)
             user.save()
 
-        return user
\ No newline at end of file
+        return user
+
+class TokenCreateSerializer(AuthTokenSerializer):
+    """Serializer for logging in on a device."""
+    device = serializers.CharField(max_length=64, required=False, default='', allow_blank=True)
+
+class TokenSerializer(serializers.ModelSerializer):
+    """Serializer for an issued token."""
+    token = serializers.CharField(source='key')
+
+    class Meta:
+        model = AuthToken
+        fields = ['token', 'device', 'expires']
@@ -1,10 +1,23 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings, tag
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework import status
 from rest_framework.test import APIClient, force_authenticate
 
+from core.authentication import token_cache
+from core.hashers import PasswordHashingUnavailable
+
+from .models import AuthToken
+
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 PROFILE_URL = reverse('user:profile')
@@ -36,6 +49,8 @@ class PublicUserApiTests(TestCase):
     """Test public user api."""
 
     def setUp(self):
+        # Start with full signup and login rate limits.
+        cache.clear()
         self.client = APIClient()
 
     def test_create_user_success(self):
@@ -128,6 +143,35 @@ class PublicUserApiTests(TestCase):
         self.assertNotIn('token', response.data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_token_outdated_hash_upgraded(self):
+        """Test logging in rehashes a password stored with an outdated hasher."""
+        user = create_user()
+        user.password = make_password('testpass123', hasher='pbkdf2_sha1')
+        user.save()
+
+        response = self.client.post(TOKEN_URL, {'username': user.username, 'password': 'testpass123'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, get_hasher().algorithm)
+        self.assertTrue(user.check_password('testpass123'))
+
+    def test_token_busy_hashing_pool(self):
+        """Test logins are rejected with a retry delay while the hashing pool is full."""
+        payload = {
+            'username': 'testusername',
+            'password': 'testpass123',
+        }
+        create_user(**payload)
+
+        with mock.patch('core.hashers.hashing_pool.run', side_effect=PasswordHashingUnavailable(3)):
+            response = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['detail'].code, 'password_hashing_unavailable')
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertNotIn('token', response.data)
+
     def test_retrieve_profile_without_auth_fails(self):
         """Test retrieve profile without being  authenticated returns an 401 status."""
         response = self.client.get(PROFILE_URL)
@@ -163,4 +207,170 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.username, payload['username'])
         self.assertEqual(self.user.email, payload['email'])
         self.assertTrue(self.user.check_password(payload['password']))
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class AuthTokenTests(TestCase):
+    """Test issuing, refreshing and revoking expiring tokens."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user()
+        self.client = APIClient()
+
+    def login(self, device=None):
+        payload = {'username': self.user.username, 'password': 'testpass123'}
+        if device is not None:
+            payload['device'] = device
+        return self.client.post(TOKEN_URL, payload)
+
+    def get_profile(self, key):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return self.client.get(PROFILE_URL)
+
+    def test_login_issues_expiring_token(self):
+        """Test logging in returns a token with its device and expiry."""
+        response = self.login('phone')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AuthToken.objects.get(user=self.user)
+        self.assertEqual(response.data['token'], token.key)
+        self.assertEqual(response.data['device'], 'phone')
+        self.assertGreater(token.expires, timezone.now())
+
+    def test_login_rotates_device_token(self):
+        """Test logging in again on a device replaces only that device's token."""
+        laptop = self.login('laptop').data['token']
+        first = self.login('phone').data['token']
+        self.assertEqual(self.get_profile(first).status_code, status.HTTP_200_OK)
+        second = self.login('phone').data['token']
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.get_profile(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_profile(second).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_profile(laptop).status_code, status.HTTP_200_OK)
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 2)
+
+    def test_login_without_device_keeps_token(self):
+        """Test logging in again without a device keeps the shared token and extends it."""
+        first = self.login().data['token']
+        AuthToken.objects.filter(key=first).update(expires=timezone.now() + timedelta(seconds=60))
+        second = self.login().data['token']
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.get_profile(first).status_code, status.HTTP_200_OK)
+        self.assertGreater(AuthToken.objects.get(key=first).expires, timezone.now() + timedelta(seconds=3600))
+
+    def test_login_without_device_replaces_expired_token(self):
+        """Test logging in without a device after the shared token expired issues a new key."""
+        token = AuthToken.objects.create(user=self.user, expires=timezone.now() - timedelta(seconds=1))
+        key = self.login().data['token']
+
+        self.assertNotEqual(key, token.key)
+        self.assertEqual(self.get_profile(key).status_code, status.HTTP_200_OK)
+        self.assertEqual(AuthToken.objects.filter(user=self.user).count(), 1)
+
+    def test_expired_token_rejected(self):
+        """Test an expired token is not accepted."""
+        token = AuthToken.objects.create(user=self.user, expires=timezone.now() - timedelta(seconds=1))
+        response = self.get_profile(token.key)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_with_expired_token_header(self):
+        """Test logging in works while sending an expired token."""
+        token = AuthToken.objects.create(user=self.user, expires=timezone.now() - timedelta(seconds=1))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    @override_settings(AUTH_TOKEN_TTL=3600, AUTH_TOKEN_REFRESH_INTERVAL=60)
+    def test_use_slides_expiry(self):
+        """Test using a token extends its expiry once the refresh interval passed."""
+        expires = timezone.now() + timedelta(seconds=600)
+        token = AuthToken.objects.create(user=self.user, expires=expires)
+        self.get_profile(token.key)
+        token.refresh_from_db()
+
+        self.assertGreater(token.expires, expires + timedelta(seconds=2900))
+
+    @override_settings(AUTH_TOKEN_TTL=3600, AUTH_TOKEN_REFRESH_INTERVAL=60)
+    def test_fresh_token_not_rewritten(self):
+        """Test using a recently refreshed token does not write it again."""
+        token = AuthToken.objects.create(user=self.user)
+        with self.assertNumQueries(1):
+            self.get_profile(token.key)
+
+    def test_revoke_token(self):
+        """Test revoking the current token logs the device out."""
+        key = self.login('phone').data['token']
+        self.get_profile(key)
+        response = self.client.delete(TOKEN_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(AuthToken.objects.filter(key=key).exists())
+        self.assertEqual(self.get_profile(key).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_requires_authentication(self):
+        """Test revoking without a token is rejected."""
+        response = self.client.delete(TOKEN_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_purge_tokens(self):
+        """Test the purge command deletes expired tokens in batches and keeps valid ones."""
+        past = timezone.now() - timedelta(days=1)
+        AuthToken.objects.bulk_create(
+            AuthToken(key=AuthToken.generate_key(), user=self.user, device=f'old {i}', expires=past)
+            for i in range(5)
+        )
+        valid = AuthToken.objects.create(user=self.user, device='current')
+        out = io.StringIO()
+        call_command('purge_tokens', batch_size=2, stdout=out)
+
+        self.assertEqual(list(AuthToken.objects.values_list('key', flat=True)), [valid.key])
+        self.assertIn('Purged 5 expired tokens.', out.getvalue())
+
+@tag('query_budget')
+class UserQueryBudgetTests(TestCase):
+    """Test user endpoints run a fixed number of queries."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user()
+        self.token = AuthToken.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        # Authenticate once so the budgets below exclude the token lookup.
+        self.client.get(PROFILE_URL)
+
+    def test_create_user(self):
+        """Test creating a user checks both unique fields and inserts it."""
+        payload = {'username': 'newuser', 'email': 'new@example.com', 'password': 'testpass123'}
+        with self.assertNumQueries(3):
+            response = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_create_token(self):
+        """Test obtaining a token loads the user and upserts the device token."""
+        payload = {'username': self.user.username, 'password': 'testpass123'}
+        with self.assertNumQueries(2):
+            response = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_profile(self):
+        """Test the profile of a cached user is served without queries."""
+        with self.assertNumQueries(0):
+            response = self.client.get(PROFILE_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_profile(self):
+        """Test updating the profile loads, validates and saves the user."""
+        with self.assertNumQueries(3):
+            response = self.client.patch(PROFILE_URL, {'username': 'updatedusername'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -1,16 +1,34 @@
-from rest_framework import status, generics, authentication, permissions
-from rest_framework.decorators import api_view
+from django.contrib.auth import get_user_model
+
+from rest_framework import status, generics, permissions
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.decorators import api_view, throttle_classes
 from rest_framework.response import Response
 
 from drf_spectacular.utils import extend_schema
 
-from .serializers import UserSerializer
+from core.authentication import CachedTokenAuthentication, token_cache
+from core.throttling import TokenBucketThrottle
+
+from .models import AuthToken
+from .serializers import TokenCreateSerializer, TokenSerializer, UserSerializer
+
+class SignupThrottle(TokenBucketThrottle):
+    """Limit signups per client IP."""
+    scope = 'user.create'
+    per_user = False
+
+class LoginThrottle(TokenBucketThrottle):
+    """Limit logins and revocations per client IP."""
+    scope = 'user.token'
+    per_user = False
 
 @extend_schema(
     request = UserSerializer,
     responses = UserSerializer
 )
 @api_view(['POST'])
+@throttle_classes([SignupThrottle])
 def create_user_view(request):
     """Create a new user view."""
     serializer = UserSerializer(data=request.data)
@@ -19,12 +37,51 @@ def create_user_view(request):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class TokenView(ObtainAuthToken):
+    """Issue and revoke per-device tokens view."""
+    serializer_class = TokenCreateSerializer
+    authentication_classes = [CachedTokenAuthentication]
+    throttle_classes = [LoginThrottle]
+
+    def perform_authentication(self, request):
+        """Authenticate lazily, so logging in ignores an expired token header."""
+
+    def get_permissions(self):
+        if self.request.method == 'DELETE':
+            return [permissions.IsAuthenticated()]
+        return []
+
+    @extend_schema(
+        request = TokenCreateSerializer,
+        responses = TokenSerializer
+    )
+    def post(self, request, *args, **kwargs):
+        """Log in on a device, replacing the device's previous token."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = AuthToken.objects.issue(serializer.validated_data['user'], serializer.validated_data['device'])
+        # The previous key was replaced in place, without a delete signal.
+        token_cache.invalidate_user(token.user_id)
+        return Response(TokenSerializer(token).data)
+
+    @extend_schema(
+        request = None,
+        responses = {status.HTTP_204_NO_CONTENT: None}
+    )
+    def delete(self, request, *args, **kwargs):
+        """Revoke the token the request is authenticated with."""
+        AuthToken.objects.filter(key=request.auth).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class ProfileView(generics.RetrieveUpdateAPIView):
     """Retrieve and update user profile view."""
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
+    throttle_scope = 'user.profile'
 
     def get_object(self):
         """Return the authenticated user."""
-        return self.request.user
+        if self.request.method in permissions.SAFE_METHODS:
+            return self.request.user
+        return get_user_model().objects.get(pk=self.request.user.pk)